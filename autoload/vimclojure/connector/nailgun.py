@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# Nailgun client for VimClojure
+# nailgun.py:   talks the nailgun chunk protocol directly instead of running ng
+# License:      This file is placed in the public domain.
+#               No warranty, express or implied.
+#               *** ***   Use At-Your-Own-Risk!   *** ***
+#
+# Every chunk is a 4 byte big endian length, a 1 byte chunk type and the
+# payload. The client sends the arguments (A), environment (E), working
+# directory (D), the nail class (C), then stdin (0) and its end (.). The
+# server answers with stdout (1) and stderr (2) chunks and the exit code (X),
+# then closes the connection.
+# It is loaded by vimclojure#connector#nailgun#PythonExecute() via pyfile,
+# so all names start with nailgun.
+#
+###############################################################################
+
+
+import os
+import socket
+import struct
+
+import vim
+
+
+nailgun_class      = 'vimclojure.Nail'   # Class running the nails of VimClojure
+nailgun_chunk_size = 65536              # Maximum size of a stdin chunk sent
+nailgun_connect_failed = 230            # Exit code of ng if unable to connect
+
+
+def nailgun_chunk(kind, data):
+    return struct.pack('>ic', len(data), kind) + data
+
+def nailgun_recv(sock, size):
+    """
+    Receive exactly size bytes
+    """
+    data = []
+    while size > 0:
+        d = sock.recv(size)
+        if d == '':
+            raise socket.error('Nailgun server closed the connection')
+        data.append(d)
+        size = size - len(d)
+    return ''.join(data)
+
+def nailgun_request(nail, args, stdin):
+    """
+    Build the chunks running the nail with the arguments and the input
+    """
+    chunks = [nailgun_chunk('A', a) for a in [nail] + args]
+    for [k, v] in os.environ.items():
+        chunks.append(nailgun_chunk('E', k + '=' + v))
+    chunks.append(nailgun_chunk('E', 'NAILGUN_FILESEPARATOR=' + os.sep))
+    chunks.append(nailgun_chunk('E', 'NAILGUN_PATHSEPARATOR=' + os.pathsep))
+    chunks.append(nailgun_chunk('D', os.getcwd()))
+    chunks.append(nailgun_chunk('C', nailgun_class))
+    for i in range(0, len(stdin), nailgun_chunk_size):
+        chunks.append(nailgun_chunk('0', stdin[i:i+nailgun_chunk_size]))
+    chunks.append(nailgun_chunk('.', ''))
+    return ''.join(chunks)
+
+def nailgun_execute(host, port, nail, args, stdin):
+    """
+    Run the nail on the nailgun server, return its exit code, stdout and
+    all output (stdout and stderr in the order received)
+    """
+    try:
+        sock = socket.create_connection((host, int(port)))
+    except socket.error, e:
+        return [nailgun_connect_failed, '', 'Unable to connect to the nailgun server: ' + str(e)]
+    stdout = []
+    output = []
+    try:
+        sock.sendall(nailgun_request(nail, args, stdin))
+        while True:
+            [size, kind] = struct.unpack('>ic', nailgun_recv(sock, 5))
+            data = nailgun_recv(sock, size)
+            if kind == '1':
+                stdout.append(data)
+                output.append(data)
+            elif kind == '2':
+                output.append(data)
+            elif kind == 'X':
+                return [int(data.strip() or '0'), ''.join(stdout), ''.join(output)]
+            # Newer servers also send start-input (S) and heartbeat (H)
+            # chunks, stdin is already sent and there is nothing to answer
+    except socket.error, e:
+        output.append('\n' + str(e))
+        return [nailgun_connect_failed, '', ''.join(output)]
+    finally:
+        sock.close()
+
+def nailgun_vim_execute():
+    """
+    Run the nail of vimclojure#connector#nailgun#PythonExecute(), set
+    s:nailgun_result to the value printed by the nail or s:nailgun_status
+    and s:nailgun_output if it failed
+    """
+    lines = vim.eval('input')
+    stdin = ''.join([l + '\n' for l in lines])
+    [status, stdout, output] = nailgun_execute(vim.eval('g:vimclojure#connector#nailgun#Server'),
+                                       vim.eval('g:vimclojure#connector#nailgun#Port'),
+                                       vim.eval('a:nail'), vim.eval('a:000'), stdin)
+    if status == 0:
+        # The nail prints a Vim expression
+        if stdout.endswith('\n'):
+            stdout = stdout[:-1]
+        try:
+            vim.command('let s:nailgun_result = ' + stdout)
+        except vim.error:
+            status = -1
+    vim.command('let s:nailgun_status = ' + str(status))
+    if status != 0:
+        vim.command('let s:nailgun_output = [' + ','.join(["'" + l.replace("'", "''") + "'" for l in output.split('\n')]) + ']')
@@ -17,6 +17,15 @@ if !exists("g:vimclojure#connector#nailgun#Port")
 	let vimclojure#connector#nailgun#Port = "2113"
 endif
 
+" Talk to the nailgun server from the embedded Python instead of running
+" the ng client for every command.
+if !exists("g:vimclojure#connector#nailgun#Python")
+	let vimclojure#connector#nailgun#Python = has("python")
+endif
+
+let s:python_client = expand("<sfile>:p:r") . ".py"
+let s:python_loaded = 0
+
 function! vimclojure#connector#nailgun#Execute(nail, input, ...)
 	if type(a:input) == type("")
 		let input = split(a:input, '\n', 1)
@@ -55,7 +64,37 @@ function! vimclojure#connector#nailgun#Execute(nail, input, ...)
 	return result
 endfunction
 
+function! vimclojure#connector#nailgun#PythonExecute(nail, input, ...)
+	if type(a:input) == type("")
+		let input = split(a:input, '\n', 1)
+	else
+		let input = a:input
+	endif
+
+	if !s:python_loaded
+		python import vim
+		execute "pyfile " . fnameescape(s:python_client)
+		let s:python_loaded = 1
+	endif
+
+	let s:nailgun_status = -1
+	let s:nailgun_output = []
+	unlet! s:nailgun_result
+	python nailgun_vim_execute()
+
+	if s:nailgun_status != 0
+		throw "Error executing Nail! (" . s:nailgun_status . ")\n"
+					\ . join(s:nailgun_output, "\n")
+	endif
+	return s:nailgun_result
+endfunction
+
 function! vimclojure#connector#nailgun#Connector()
+	if g:vimclojure#connector#nailgun#Python && has("python")
+		return {
+					\ 'execute': function("vimclojure#connector#nailgun#PythonExecute")
+					\ }
+	endif
 	return {
 				\ 'execute': function("vimclojure#connector#nailgun#Execute")
 				\ }
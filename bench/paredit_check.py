@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# Paren index check for Paredit
+# paredit_check.py: checks paredit.py on buffers with strings and comments
+# License:      This file is placed in the public domain.
+#               No warranty, express or implied.
+#               *** ***   Use At-Your-Own-Risk!   *** ***
+#
+# Usage:
+#   python bench/paredit_check.py [-p paredit.py]
+#
+# Each case is a buffer with the cursor position and the expected result of
+# paredit_balanced(), or a text with the expected result of paredit_matched().
+# The buffers are also changed line by line, so that the lines following a
+# change are scanned again from the state kept at their start.
+# The exit status is 1 if any result is different from the expected one.
+#
+###############################################################################
+
+
+import os
+import sys
+import getopt
+
+import replay
+
+here = os.path.dirname(os.path.abspath(__file__))
+default_paredit = os.path.join(here, '..', 'ftplugin', 'paredit.py')
+
+# [filetype, buffer lines, cursor (line, column), balanced]
+balanced_cases = [
+    ['lisp',    ['(defun f (x)', '  (+ x 1))'], (2, 2), 1],
+    ['lisp',    ['(defun f (x)', '  x))'], (2, 2), 0],
+    ['lisp',    ['(defun f (x)', '  "a ) string"', '  x)'], (3, 2), 1],
+    ['lisp',    ['(defun f (x)', '  ; a ) comment', '  x)'], (3, 2), 1],
+    ['lisp',    ['(defun f (x)', '  #| a ) block', '     ( comment |#', '  x)'], (4, 2), 1],
+    ['lisp',    ['(defun f (x)', '  #| outer #| inner ) |#', '     still ( comment |#', '  x)'], (4, 2), 1],
+    ['lisp',    ['(defun f (x) #| ) |# (g x))'], (1, 1), 1],
+    ['lisp',    ['#| (((', '|#', '(f x)'], (3, 1), 1],
+    ['lisp',    ['(f #\\( x)'], (1, 1), 1],
+    ['clojure', ['(defn f [x]', '  #| is no comment )', '  x)'], (3, 2), 0],
+]
+
+# [text, clojure, start in string, start in comment, matched]
+matched_cases = [
+    ['(a "(" b)', False, False, False, '(  " "  )'],
+    ['(a ; (\n b)', False, False, False, '(        )'],
+    ['(a #| ( |# b)', False, False, False, '(           )'],
+    ['(a #| #| ( |# ) |# b)', False, False, False, '(                   )'],
+    [' ( |# (b)', False, False, True, '      ( )'],
+    [' ; x\n(b)', False, False, True, '     ( )'],
+    [' ; x\n#| ( |# (b)', False, False, True, '             ( )'],
+    ['[a #| ]', True, False, False, '[     ]'],
+]
+
+
+def check_balanced(ns, vim, ft, lines, cursor, expected, bufnr):
+    vim.answers['&ft'] = ft
+    buf = replay.fake_buffer(lines)
+    buf.number = bufnr
+    vim.current.buffer = buf
+    vim.current.window.cursor = cursor
+    failed = 0
+    # Scan the whole buffer, then scan it again after changing each line
+    ticks = [str(t) for t in range(len(lines) + 1)]
+    for i in range(len(ticks)):
+        if i > 0:
+            buf[i-1] = buf[i-1] + ' '
+        vim.answers['b:changedtick'] = ticks[i]
+        del vim.commands[:]
+        ns['paredit_balanced'](1, len(lines), 1)
+        got = vim.commands[-1]
+        if got != 'let s:paredit_balanced=%d' % expected:
+            sys.stdout.write('%s %r at %r: %s, expected %d\n' % (ft, lines, cursor, got, expected))
+            failed = failed + 1
+        if i > 0:
+            buf[i-1] = buf[i-1][:-1]
+    return failed
+
+def main():
+    paredit = default_paredit
+    opts, args = getopt.getopt(sys.argv[1:], 'p:')
+    for o, a in opts:
+        if o == '-p':
+            paredit = a
+
+    vim = replay.fake_vim()
+    sys.modules['vim'] = vim
+    ns = {'__name__': '__main__'}
+    execfile(paredit, ns)
+
+    failed = 0
+    n = 0
+    for [ft, lines, cursor, expected] in balanced_cases:
+        n = n + 1
+        failed = failed + check_balanced(ns, vim, ft, lines, cursor, expected, n)
+    for [text, clojure, in_string, in_comment, expected] in matched_cases:
+        got = ns['paredit_matched'](text, in_string, in_comment, clojure)
+        if got != expected:
+            sys.stdout.write('%r: %r, expected %r\n' % (text, got, expected))
+            failed = failed + 1
+
+    sys.stdout.write('%d cases, %d failed\n' % (len(balanced_cases) + len(matched_cases), failed))
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
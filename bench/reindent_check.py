@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# Reindent check for Slimv
+# reindent_check.py: compares reindent.py with SlimvIndent() run by Vim
+# License:      This file is placed in the public domain.
+#               No warranty, express or implied.
+#               *** ***   Use At-Your-Own-Risk!   *** ***
+#
+# Usage:
+#   python bench/reindent_check.py [-e vim] [-s slimv.vim] [-r reindent.py]
+#                                  [file]...
+#
+# SlimvGetFiletype(), SlimvLispindent() and SlimvIndent() are taken from
+# slimv.vim and run by a Vim started with -u NONE (Python support is not
+# needed), reindenting each file with the = operator: the whole file, then a
+# range in the middle of it, and a range starting inside the first multi-line
+# docstring. reindent.py reindents the same ranges of the original text
+# through the fake vim module of replay.py, one after the other in the same
+# buffer, so the tokens kept from the previous call are checked as well.
+# When no file is given then the .clj and .lisp files bundled with Slimv are
+# checked. The exit status is 1 if any line is indented differently.
+#
+###############################################################################
+
+
+import os
+import re
+import sys
+import time
+import getopt
+import tempfile
+import subprocess
+
+import replay
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.join(here, '..')
+default_slimv = os.path.join(root, 'ftplugin', 'slimv.vim')
+default_reindent = os.path.join(root, 'ftplugin', 'reindent.py')
+
+# Script variables and functions of slimv.vim needed by SlimvIndent()
+script_vars = ['s:skip_sc', 's:skip_q', 's:spec_indent', 's:spec_param', 's:binding_form']
+script_funcs = ['SlimvGetFiletype', 'SlimvLispindent', 'SlimvIndent']
+
+vim_script = """
+let g:slimv_lisp = ''
+let g:slimv_indent_maxlines = 50
+let g:slimv_indent_keylists = 1
+let s:swank_connected = 0
+%(defs)s
+let &runtimepath = g:root . ',' . &runtimepath
+syntax on
+execute 'edit ' . fnameescape( g:infile )
+let &filetype = g:ft
+setlocal expandtab tabstop=8 nolisp indentkeys= indentexpr=SlimvIndent(v:lnum)
+call writefile( [&iskeyword, &lispwords], g:outfile . '.opts' )
+let s:start = reltime()
+execute 'silent normal! ' . g:first . 'G=' . g:last . 'G'
+call writefile( [reltimestr( reltime( s:start ) )], g:outfile . '.time' )
+execute 'silent write! ' . fnameescape( g:outfile )
+qa!
+"""
+
+
+def vim_definitions(path):
+    """
+    Extract the script variables and functions needed by SlimvIndent()
+    """
+    lines = open(path).read().split('\n')
+    defs = []
+    infunc = False
+    for line in lines:
+        if infunc:
+            defs.append(line)
+            if re.match(r'endfunction\b', line):
+                infunc = False
+            continue
+        m = re.match(r'function!?\s+(\w+)\s*\(', line)
+        if m and m.group(1) in script_funcs:
+            defs.append(line)
+            infunc = True
+            continue
+        m = re.match(r'let\s+(s:\w+)\s*=', line)
+        if m and m.group(1) in script_vars:
+            defs.append(line)
+    return '\n'.join(defs)
+
+def vim_reindent(vimexe, script, path, ft, first, last, tmp):
+    """
+    Reindent lines first..last of the file in Vim, return the lines,
+    &iskeyword, &lispwords and the time taken
+    """
+    out = os.path.join(tmp, 'out')
+    cmd = "let g:root='%s' | let g:infile='%s' | let g:outfile='%s' | let g:ft='%s' | let g:first=%d | let g:last=%d" % \
+          (root, path, out, ft, first, last)
+    subprocess.call([vimexe, '-N', '-u', 'NONE', '-i', 'NONE', '-e', '-s', '--cmd', cmd, '-S', script])
+    lines = open(out).read().split('\n')[:-1]
+    isk, lw = open(out + '.opts').read().split('\n')[:2]
+    t = float(open(out + '.time').read())
+    return lines, isk, lw, t
+
+def py_reindent(ns, vim, buf, first, last):
+    """
+    Reindent lines first..last of buf with reindent.py, return the time taken
+    """
+    vim.answers['a:first'] = str(first)
+    vim.answers['a:last'] = str(last)
+    vim.current.buffer = buf
+    t = time.time()
+    ns['reindent_range']()
+    return time.time() - t
+
+def docstring_line(lines):
+    """
+    Return the 1-based number of the second line of the first multi-line
+    docstring or None
+    """
+    for i in range(len(lines) - 1):
+        if re.match(r'\s+"[^"]*$', lines[i]):
+            return i + 2
+    return None
+
+def compare(name, expected, got):
+    n = 0
+    for i in range(len(expected)):
+        if i >= len(got) or expected[i] != got[i]:
+            if n < 5:
+                sys.stdout.write('  %s:%d\n    vim: %r\n    py:  %r\n' %
+                                 (name, i + 1, expected[i], i < len(got) and got[i] or None))
+            n = n + 1
+    return n
+
+def bundled_files():
+    files = []
+    for d in ['swank-clojure', 'slime']:
+        for dirpath, dirnames, filenames in os.walk(os.path.join(root, d)):
+            dirnames.sort()
+            for f in sorted(filenames):
+                if f.endswith('.clj') or f.endswith('.lisp'):
+                    files.append(os.path.join(dirpath, f))
+    return files
+
+def main():
+    vimexe = 'vim'
+    slimv = default_slimv
+    reindent = default_reindent
+    opts, args = getopt.getopt(sys.argv[1:], 'e:s:r:')
+    for o, a in opts:
+        if o == '-e':
+            vimexe = a
+        elif o == '-s':
+            slimv = a
+        elif o == '-r':
+            reindent = a
+    files = args or bundled_files()
+
+    tmp = tempfile.mkdtemp()
+    script = os.path.join(tmp, 'check.vim')
+    open(script, 'w').write(vim_script % {'defs': vim_definitions(slimv)})
+
+    failed = 0
+    vim_total = 0.0
+    py_total = 0.0
+    for path in files:
+        ft = 'lisp'
+        if path.endswith('.clj'):
+            ft = 'clojure'
+        text = open(path).read().split('\n')
+        if text[-1] == '':
+            text.pop()
+        if not text:
+            continue
+        n = len(text)
+        ranges = [(1, n), (n / 3 + 1, max(2 * n / 3, n / 3 + 1))]
+        d = docstring_line(text)
+        if d:
+            ranges.append((d, min(d + 40, n)))
+
+        vim = None
+        ns = None
+        for first, last in ranges:
+            expected, isk, lw, t = vim_reindent(vimexe, script, path, ft, first, last, tmp)
+            vim_total = vim_total + t
+            if vim is None:
+                vim = replay.fake_vim({'&tabstop': '8', '&expandtab': '1',
+                                       'g:slimv_indent_maxlines': '50', 'g:slimv_indent_keylists': '1',
+                                       'SlimvGetFiletype()': ft, 's:swank_connected': '0',
+                                       's:spec_indent': 'flet\\|labels\\|macrolet\\|symbol-macrolet',
+                                       's:spec_param': 'defmacro', 's:binding_form': 'let\\|let\\*',
+                                       '&iskeyword': isk, '&lispwords': lw})
+                ns = {'__name__': '__main__'}
+                sys.modules['vim'] = vim
+                execfile(reindent, ns)
+            # Every range starts from the original text in the same buffer,
+            # so only the lines changed by the previous call are tokenized again
+            buf = replay.fake_buffer(text)
+            buf.number = 1
+            py_total = py_total + py_reindent(ns, vim, buf, first, last)
+            diff = compare('%s %d-%d' % (os.path.relpath(path, root), first, last), expected, list(buf))
+            if diff:
+                failed = failed + 1
+                sys.stdout.write('%s %d-%d: %d lines differ\n' % (path, first, last, diff))
+        sys.modules.pop('vim', None)
+
+    sys.stdout.write('%d files, vim %.3f s, reindent.py %.3f s\n' % (len(files), vim_total, py_total))
+    if failed:
+        sys.stdout.write('%d ranges differ\n' % failed)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
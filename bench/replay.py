@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# Replay harness for the SWANK client of Slimv
+# replay.py:    feeds recorded swank traffic to swank.py without a live server
+# License:      This file is placed in the public domain.
+#               No warranty, express or implied.
+#               *** ***   Use At-Your-Own-Risk!   *** ***
+#
+# A recording is a framed swank message stream (6 hex digit length headers,
+# each followed by the message) captured between Slimv and a swank server.
+# Messages sent by Slimv (:emacs-rex) are not replayed, they only register
+# the pending requests in swank.py, so that the replies find their actions.
+# Everything else is written to the client through a socketpair standing in
+# for the server, while a fake vim module records what swank.py does.
+#
+# Usage:
+#   python bench/replay.py [-s swank.py] recording
+#
+###############################################################################
+
+
+import os
+import sys
+import types
+import socket
+import getopt
+import threading
+
+here = os.path.dirname(os.path.abspath(__file__))
+default_swank = os.path.join(here, '..', 'ftplugin', 'swank.py')
+
+
+class fake_buffer(list):
+    """
+    Vim buffer stand-in, append() takes a line or a list of lines
+    """
+    def append(self, lines):
+        if type(lines) == list:
+            self.extend(lines)
+        else:
+            list.append(self, lines)
+
+class fake_window:
+    def __init__(self):
+        self.cursor = (1, 0)
+
+def fake_vim(answers=None):
+    """
+    Return a vim module stand-in recording the commands executed,
+    vim.eval() returns the value given for the expression in answers
+    """
+    vim = types.ModuleType('vim')
+    vim.commands = []
+    vim.evals = []
+    vim.answers = {'bufwinnr(g:slimv_repl_name)': '1'}
+    if answers:
+        vim.answers.update(answers)
+    vim.current = types.ModuleType('current')
+    vim.current.buffer = fake_buffer([''])
+    vim.current.window = fake_window()
+
+    def command(cmd):
+        vim.commands.append(cmd)
+
+    def eval(expr):
+        vim.evals.append(expr)
+        if expr in vim.answers:
+            return vim.answers[expr]
+        if expr.startswith('exists('):
+            return '0'
+        return ''
+
+    vim.command = command
+    vim.eval = eval
+    return vim
+
+def load_client(path=default_swank, vim=None):
+    """
+    Load swank.py into a fresh namespace using the given (or a new) fake vim
+    """
+    if vim is None:
+        vim = fake_vim()
+    sys.modules['vim'] = vim
+    ns = {'__name__': 'swank', 'vim': vim}
+    execfile(path, ns)
+    return ns
+
+def split_stream(data):
+    """
+    Split a stream where message lengths count the items of data
+    """
+    msgs = []
+    pos = 0
+    while pos + 6 <= len(data):
+        msglen = int(data[pos:pos+6], 16)
+        msgs.append(data[pos+6:pos+6+msglen])
+        pos = pos + 6 + msglen
+    return msgs
+
+def read_recording(fname):
+    """
+    Split a framed swank message stream into the list of messages
+    """
+    f = open(fname, 'rb')
+    data = f.read()
+    f.close()
+    try:
+        # Recent swank servers count bytes
+        return split_stream(data)
+    except ValueError:
+        # Old swank servers count unicode characters
+        return [m.encode('utf-8') for m in split_stream(data.decode('utf-8'))]
+
+def frame(msg):
+    return '%06x' % len(msg) + msg
+
+class replay_server:
+    """
+    Server stand-in writing the recorded messages to swank.py through a
+    socketpair, requests in the recording are registered as actions instead
+    """
+    def __init__(self, swank):
+        self.swank = swank
+        self.server, client = socket.socketpair()
+        swank['sock'] = client
+        if 'swank_buffer' in swank:
+            swank['recv_buffer'] = swank['swank_buffer']()
+
+    def request(self, msg):
+        """
+        Register the action for an :emacs-rex message sent by Slimv
+        """
+        swank = self.swank
+        [l, r] = swank['parse_sexpr'](msg)
+        form = r[1]
+        name = ':' + form[0].split(':')[-1]
+        data = ''
+        if name in [':simple-completions', ':fuzzy-completions', ':operator-arglist']:
+            data = form[2] + ' ' + swank['unquote'](form[1])
+        key = r[-1]
+        action = swank['swank_action'](key, name, data)
+        if hasattr(swank['actions'], 'add'):
+            swank['actions'].add(action)
+        else:
+            swank['actions'][key] = action
+        swank['id'] = max(swank['id'], int(key))
+
+    def play(self, msgs):
+        """
+        Feed the messages to swank.py and process them in swank_listen(),
+        return the REPL output produced
+        """
+        stream = []
+        for m in msgs:
+            if m.startswith('(:emacs-rex '):
+                self.request(m)
+            else:
+                stream.append(frame(m))
+        # Count the messages received by counting the parser calls
+        parse_sexpr = self.swank['parse_sexpr']
+        parsed = [0]
+        def counting_parse(msg):
+            parsed[0] = parsed[0] + 1
+            return parse_sexpr(msg)
+        self.swank['parse_sexpr'] = counting_parse
+
+        writer = threading.Thread(target=self.server.sendall, args=(''.join(stream),))
+        writer.daemon = True
+        writer.start()
+        listen = self.swank['swank_listen']
+        output = []
+        idle = 0
+        try:
+            while parsed[0] < len(stream) and idle < 10:
+                count = parsed[0]
+                if listen.func_code.co_argcount > 0:
+                    text = listen(1.0)
+                else:
+                    # Older swank.py versions without a timeout parameter
+                    text = listen()
+                if type(text) == list:
+                    text = ''.join(text)
+                output.append(text)
+                if parsed[0] == count:
+                    idle = idle + 1
+                else:
+                    idle = 0
+        finally:
+            self.swank['parse_sexpr'] = parse_sexpr
+        writer.join()
+        return ''.join(output)
+
+    def close(self):
+        self.server.close()
+
+def replay(msgs, path=default_swank, vim=None):
+    """
+    Replay messages through a new swank.py client, return the client
+    namespace and the REPL output
+    """
+    swank = load_client(path, vim)
+    server = replay_server(swank)
+    try:
+        output = server.play(msgs)
+    finally:
+        server.close()
+    return swank, output
+
+def main():
+    opts, files = getopt.getopt(sys.argv[1:], 's:')
+    path = default_swank
+    for k, v in opts:
+        if k == '-s':
+            path = v
+    for fname in files:
+        swank, output = replay(read_recording(fname), path)
+        vim = swank['vim']
+        sys.stdout.write(output)
+        print
+        print '%s: %d vim commands, %d vim evals, %d buffer lines' % \
+              (fname, len(vim.commands), len(vim.evals), len(vim.current.buffer))
+
+if __name__ == '__main__':
+    main()
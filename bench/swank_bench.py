@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# Benchmark for the SWANK client of Slimv
+# swank_bench.py: times swank.py functions over recorded swank traffic
+# License:      This file is placed in the public domain.
+#               No warranty, express or implied.
+#               *** ***   Use At-Your-Own-Risk!   *** ***
+#
+# Usage:
+#   python bench/swank_bench.py [-s swank.py]... [-n repeat]
+#                               [-o results] [-b baseline [-f factor]]
+#                               [recording]...
+#
+# Each recording is a file holding a framed swank message stream, i.e. a
+# sequence of 6 hex digit length headers each followed by the message, see
+# replay.py. When no recording is given then small, large and pathological
+# recordings are generated that mimic real swank sessions.
+# Pass -s several times to compare different versions of swank.py, e.g. the
+# one in the previous commit:
+#   git show HEAD~1:ftplugin/swank.py > /tmp/swank_old.py
+#   python bench/swank_bench.py -s /tmp/swank_old.py -s ftplugin/swank.py
+#
+# The timings of the last swank.py are saved with -o, and compared to a saved
+# baseline with -b: the exit status is 1 if any of them is more than factor
+# (default 2) times slower than in the baseline.
+#
+###############################################################################
+
+
+import os
+import sys
+import time
+import getopt
+import tempfile
+
+import replay
+
+
+def quote(s):
+    return '"' + s.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def session_messages(n, source):
+    """
+    Build a swank session with replies of size n: REPL output, completions,
+    a debugger, a compilation with notes in file source and an inspector
+    """
+    msgs = []
+
+    # Evaluation printing n lines and returning a big nested data structure
+    msgs.append('(:emacs-rex (swank:listener-eval "(run)") "user" :repl-thread 1)')
+    for i in range(n):
+        msgs.append('(:write-string "%d\\n" :repl-result)' % i)
+    line = '{:id %d, :name "item-%d", :tags [:a :b :c], :path "C:\\\\tmp\\\\x"}\n'
+    text = ''.join([line % (i, i) for i in range(n * 6)])
+    msgs.append('(:return (:ok (:values ' + quote(text) + ')) 1)')
+
+    # Fuzzy completion list
+    msgs.append('(:emacs-rex (swank:fuzzy-completions "sym" "user" :limit 2000 :time-limit-in-msec 2000) nil t 2)')
+    compl = ['("clojure.core/symbol-%d" "%d.0" (("clojure.core/" 0) ("sym" 13)) "-f---m--")' % (i, i)
+             for i in range(min(n, 2000))]
+    msgs.append('(:return (:ok ((' + ' '.join(compl) + ') nil)) 2)')
+
+    # Deep backtrace, e.g. a Clojure stack overflow
+    frames = ['(%d "clojure.core$map$fn__%d.invoke(core.clj:%d)" (:restartable nil))' % (i, i, i)
+              for i in range(n)]
+    restarts = '(("QUIT" "Quit to the SLIME top level") ("ABORT" "Return to SLIME\'s top level."))'
+    msgs.append('(:debug 1 1 ("java.lang.StackOverflowError" "  [Thrown class java.lang.StackOverflowError]" nil) '
+                + restarts + ' (' + ' '.join(frames) + ') (nil))')
+    msgs.append('(:debug-return 1 1 nil)')
+
+    # Compilation with n notes
+    msgs.append('(:emacs-rex (swank:compile-string-for-emacs "(ns big)" "big.clj" 1 nil nil) "user" t 3)')
+    notes = ['(:message "Reflection warning, call to method %d can\'t be resolved." :severity :warning '
+             ':location (:location (:file %s) (:position %d) nil) :references nil)' % (i, quote(source), i * 40)
+             for i in range(n)]
+    msgs.append('(:return (:ok (:compilation-result (' + ' '.join(notes) + ') t 0.5 nil "big.fasl")) 3)')
+
+    # Inspector of a collection with n elements
+    msgs.append('(:emacs-rex (swank:init-inspector "big-map") "user" t 4)')
+    content = ' '.join(['"Key %d: " (:value "value-%d" %d) "\\n"' % (i, i, i) for i in range(n)])
+    msgs.append('(:return (:ok (:title "big-map" :id 0 :content ((' + content + ') %d 0 %d))) 4)' % (n, n))
+    return msgs
+
+def pathological_messages(source):
+    """
+    Build messages stressing the parser and the REPL: deep nesting, long
+    strings full of escapes, many tiny messages and a huge backtrace
+    """
+    msgs = []
+    msgs.append('(:emacs-rex (swank:listener-eval "(deep)") "user" :repl-thread 1)')
+    msgs.append('(:return (:ok (:values "x" ' + '(' * 5000 + 'x' + ')' * 5000 + ')) 1)')
+    msgs.append('(:emacs-rex (swank:listener-eval "(escapes)") "user" :repl-thread 2)')
+    msgs.append('(:return (:ok (:values ' + quote('\\"' * 200000) + ')) 2)')
+    for i in range(20000):
+        msgs.append('(:write-string "." :repl-result)')
+    msgs.append('(:indentation-update (' + ' '.join(['("def%d" . 1)' % i for i in range(5000)]) + '))')
+    frames = ['(%d "%s")' % (i, 'x' * 500) for i in range(20000)]
+    msgs.append('(:debug 1 1 ("Control stack exhausted" "  [Condition of type STORAGE-CONDITION]" nil) '
+                '(("ABORT" "Return to SLIME\'s top level.")) (' + ' '.join(frames) + ') (nil))')
+    return msgs
+
+def generated_recordings():
+    """
+    Build the recordings and the source file compiler notes refer to
+    """
+    fd, source = tempfile.mkstemp('.clj')
+    os.write(fd, ''.join(['(defn f%d [x] (.method x))\n' % i for i in range(50000)]))
+    os.close(fd)
+    recordings = {'small': session_messages(10, source),
+                  'large': session_messages(5000, source),
+                  'pathological': pathological_messages(source)}
+    return recordings, source
+
+class chunked_stream:
+    """
+    Socket stand-in returning the stream in chunks like a real socket would
+    """
+    def __init__(self, data, chunk):
+        self.data = data
+        self.pos = 0
+        self.chunk = chunk
+
+    def recv_into(self, view):
+        n = min(len(view), self.chunk, len(self.data) - self.pos)
+        view[:n] = self.data[self.pos:self.pos+n]
+        self.pos = self.pos + n
+        return n
+
+def split_frames(swank, stream):
+    """
+    Split a framed stream into messages using the swank.py receive buffer
+    """
+    buf = swank['swank_buffer']()
+    s = chunked_stream(stream, 65536)
+    while True:
+        if buf.next_message(swank['use_unicode']) is None and buf.fill(s) == 0:
+            break
+
+def timed(fn, repeat):
+    """
+    Return the best time of repeat calls of fn, fn returns its own time
+    if it has to exclude some preparation from it
+    """
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        elapsed = fn()
+        if elapsed is None:
+            elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def parsed(swank, msgs, head):
+    """
+    Return the parsed messages starting with head
+    """
+    result = []
+    for m in msgs:
+        if m.startswith('(' + head):
+            result.append(swank['parse_sexpr'](m)[1])
+    return result
+
+def strings(swank, msgs):
+    """
+    Return the quoted strings in the messages
+    """
+    result = []
+    for m in msgs:
+        stack = [swank['parse_sexpr'](m)[1]]
+        while stack:
+            r = stack.pop()
+            if type(r) == list:
+                stack.extend(r)
+            elif r[:1] == '"':
+                result.append(r)
+    return result
+
+def benchmarks(path, msgs):
+    """
+    Return the list of (name, function) benchmarks for a recording
+    """
+    swank = replay.load_client(path)
+    debugs = parsed(swank, msgs, ':debug ')
+    returns = [r[1][1] for r in parsed(swank, msgs, ':return ') if r[1][0] == ':ok' and type(r[1][1]) == list]
+    compiles = [p for p in returns if p and p[0] == ':compilation-result']
+    inspects = [p for p in returns if p and p[0] == ':title']
+    quoted = strings(swank, msgs)
+    texts = [swank['unquote'](q) for q in quoted]
+
+    def parse():
+        for m in msgs:
+            swank['parse_sexpr'](m)
+
+    def listen():
+        client = replay.load_client(path)
+        server = replay.replay_server(client)
+        try:
+            start = time.time()
+            server.play(msgs)
+            return time.time() - start
+        finally:
+            server.close()
+
+    def debug():
+        for r in debugs:
+            swank['swank_parse_debug'](r)
+
+    def compile():
+        for p in compiles:
+            swank['swank_parse_compile'](p)
+
+    def inspect():
+        for p in inspects:
+            swank['swank_parse_inspect'](p)
+
+    def unquote():
+        for q in quoted:
+            swank['unquote'](q)
+
+    def requote():
+        for t in texts:
+            swank['requote'](t)
+
+    result = [('parse_sexpr', parse), ('swank_listen', listen),
+              ('unquote', unquote), ('requote', requote)]
+    if debugs:
+        result.append(('swank_parse_debug', debug))
+    if compiles:
+        result.append(('swank_parse_compile', compile))
+    if inspects:
+        result.append(('swank_parse_inspect', inspect))
+    if 'swank_buffer' in swank:
+        stream = ''.join([replay.frame(m) for m in msgs])
+        result.append(('swank_buffer', lambda: split_frames(swank, stream)))
+    return result
+
+def main():
+    opts, files = getopt.getopt(sys.argv[1:], 's:n:o:b:f:')
+    swanks = [v for k, v in opts if k == '-s'] or [replay.default_swank]
+    repeat = 3
+    output = None
+    baseline = None
+    factor = 2.0
+    for k, v in opts:
+        if k == '-n':
+            repeat = int(v)
+        elif k == '-o':
+            output = v
+        elif k == '-b':
+            baseline = v
+        elif k == '-f':
+            factor = float(v)
+
+    source = None
+    if files:
+        recordings = {}
+        for fname in files:
+            recordings[os.path.basename(fname)] = replay.read_recording(fname)
+    else:
+        recordings, source = generated_recordings()
+
+    results = {}
+    try:
+        for path in swanks:
+            print path
+            results = {}
+            for name in sorted(recordings.keys()):
+                msgs = recordings[name]
+                size = sum([len(m) for m in msgs])
+                print '  %s: %d msgs %d bytes' % (name, len(msgs), size)
+                for bname, fn in benchmarks(path, msgs):
+                    try:
+                        t = timed(fn, repeat)
+                        results[name + ' ' + bname] = t
+                        print '    %-22s %9.3f sec' % (bname, t)
+                    except Exception, e:
+                        print '    %-22s failed: %s' % (bname, str(e)[:60])
+    finally:
+        if source:
+            os.remove(source)
+
+    if output:
+        f = open(output, 'w')
+        for key in sorted(results.keys()):
+            f.write('%s %f\n' % (key, results[key]))
+        f.close()
+    if baseline:
+        slower = []
+        f = open(baseline, 'r')
+        for line in f:
+            [key, t] = line.rsplit(' ', 1)
+            # Ignore differences below 10ms, these are just noise
+            if key in results and results[key] > float(t) * factor and results[key] - float(t) > 0.01:
+                slower.append('%s: %.3f sec, baseline %.3f sec' % (key, results[key], float(t)))
+        f.close()
+        if slower:
+            print 'Slower than the baseline:'
+            print '\n'.join(['  ' + s for s in slower])
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
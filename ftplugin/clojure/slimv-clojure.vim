@@ -148,11 +148,11 @@ function! b:SlimvHyperspecLookup( word, exact, all )
     endif
 
     let symbol = []
-    if exists( 'g:slimv_cljapi_db' )
-        let symbol = SlimvFindSymbol( a:word, a:exact, a:all, g:slimv_cljapi_db,  g:slimv_cljapi_root,  symbol )
+    if exists( 'g:slimv_cljapi_loaded' )
+        let symbol = SlimvFindSymbol( a:word, a:exact, a:all, 'g:slimv_cljapi_db',  g:slimv_cljapi_root,  symbol )
     endif
-    if exists( 'g:slimv_javadoc_db' )
-        let symbol = SlimvFindSymbol( a:word, a:exact, a:all, g:slimv_javadoc_db, g:slimv_javadoc_root, symbol )
+    if exists( 'g:slimv_javadoc_loaded' )
+        let symbol = SlimvFindSymbol( a:word, a:exact, a:all, 'g:slimv_javadoc_db', g:slimv_javadoc_root, symbol )
     endif
     if exists( 'g:slimv_cljapi_user_db' )
         " Give a choice for the user to extend the symbol database
@@ -161,7 +161,7 @@ function! b:SlimvHyperspecLookup( word, exact, all )
         else
             let user_root = ''
         endif
-        let symbol = SlimvFindSymbol( a:word, a:exact, a:all, g:slimv_cljapi_user_db, user_root, symbol )
+        let symbol = SlimvFindSymbol( a:word, a:exact, a:all, 'g:slimv_cljapi_user_db', user_root, symbol )
     endif
     return symbol
 endfunction
@@ -158,14 +158,14 @@ function! b:SlimvHyperspecLookup( word, exact, all )
 
     let symbol = []
     if exists( 'g:slimv_clhs_loaded' )
-        let symbol = SlimvFindSymbol( a:word, a:exact, a:all, g:slimv_clhs_clhs,          g:slimv_clhs_root, symbol )
-        let symbol = SlimvFindSymbol( a:word, a:exact, a:all, g:slimv_clhs_issues,        g:slimv_clhs_root, symbol )
-        let symbol = SlimvFindSymbol( a:word, a:exact, a:all, g:slimv_clhs_chapters,      g:slimv_clhs_root, symbol )
-        let symbol = SlimvFindSymbol( a:word, a:exact, a:all, g:slimv_clhs_control_chars, g:slimv_clhs_root, symbol )
-        let symbol = SlimvFindSymbol( a:word, a:exact, a:all, g:slimv_clhs_macro_chars,   g:slimv_clhs_root, symbol )
-        let symbol = SlimvFindSymbol( a:word, a:exact, a:all, g:slimv_clhs_loop,          g:slimv_clhs_root, symbol )
-        let symbol = SlimvFindSymbol( a:word, a:exact, a:all, g:slimv_clhs_arguments,     g:slimv_clhs_root, symbol )
-        let symbol = SlimvFindSymbol( a:word, a:exact, a:all, g:slimv_clhs_glossary,      g:slimv_clhs_root, symbol )
+        let symbol = SlimvFindSymbol( a:word, a:exact, a:all, 'g:slimv_clhs_clhs',          g:slimv_clhs_root, symbol )
+        let symbol = SlimvFindSymbol( a:word, a:exact, a:all, 'g:slimv_clhs_issues',        g:slimv_clhs_root, symbol )
+        let symbol = SlimvFindSymbol( a:word, a:exact, a:all, 'g:slimv_clhs_chapters',      g:slimv_clhs_root, symbol )
+        let symbol = SlimvFindSymbol( a:word, a:exact, a:all, 'g:slimv_clhs_control_chars', g:slimv_clhs_root, symbol )
+        let symbol = SlimvFindSymbol( a:word, a:exact, a:all, 'g:slimv_clhs_macro_chars',   g:slimv_clhs_root, symbol )
+        let symbol = SlimvFindSymbol( a:word, a:exact, a:all, 'g:slimv_clhs_loop',          g:slimv_clhs_root, symbol )
+        let symbol = SlimvFindSymbol( a:word, a:exact, a:all, 'g:slimv_clhs_arguments',     g:slimv_clhs_root, symbol )
+        let symbol = SlimvFindSymbol( a:word, a:exact, a:all, 'g:slimv_clhs_glossary',      g:slimv_clhs_root, symbol )
     endif
     if exists( 'g:slimv_clhs_user_db' )
         " Give a choice for the user to extend the symbol database
@@ -174,7 +174,7 @@ function! b:SlimvHyperspecLookup( word, exact, all )
         else
             let user_root = ''
         endif
-        let symbol = SlimvFindSymbol( a:word, a:exact, a:all, g:slimv_clhs_user_db, user_root, symbol )
+        let symbol = SlimvFindSymbol( a:word, a:exact, a:all, 'g:slimv_clhs_user_db', user_root, symbol )
     endif
     return symbol
 endfunction
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# Paren structure index for Paredit
+# paredit.py:   delimiter, string and comment positions for paredit.vim
+# License:      This file is placed in the public domain.
+#               No warranty, express or implied.
+#               *** ***   Use At-Your-Own-Risk!   *** ***
+#
+# The index of a buffer holds the delimiters outside of strings and comments
+# for each line, and if the line starts inside a string or a #| |# block
+# comment. When the buffer changes (b:changedtick) only the changed lines are
+# scanned again, and the lines following them until the state at a line start
+# is the same as before the change.
+# It is loaded by paredit.vim via pyfile, so it shares the namespace with
+# swank.py, all names start with paredit or paren.
+#
+###############################################################################
+
+
+import re
+
+import vim
+
+
+# Tokens outside of strings: block comment, escaped character, comment, string
+# and delimiter, the group is the closing quote of the string if it is in the
+# same line
+paren_token_re  = re.compile(r'#\||\\.?|;.*|"(?:[^"\\]|\\.?)*("?)|[][(){}]')
+
+# Start and end of a block comment, they may be nested
+paren_block_re  = re.compile(r'#\||\|#')
+
+# Rest of a string continued from the previous line
+paren_string_re = re.compile(r'(?:[^"\\]|\\.?)*("?)')
+
+# Characters examined by paredit_matched()
+paren_special_re = { False: re.compile(r'[";()]|#\|'), True: re.compile(r'[";()\[\]{}]') }
+
+
+def paren_skip_block(text, pos, level):
+    """
+    Skip a block comment at the given nesting level, return the position
+    after its end or None if it does not end in text, and the level left
+    """
+    for m in paren_block_re.finditer(text, pos):
+        if m.group() == '#|':
+            level = level + 1
+        else:
+            level = level - 1
+            if level == 0:
+                return [m.end(), 0]
+    return [None, level]
+
+def paren_scan(line, state, blocks):
+    """
+    Return the (column, delimiter) list of the line and the state at its end,
+    the state is 0 outside, -1 inside a string and n > 0 inside n nested
+    block comments, #| |# is a block comment only if blocks is set
+    """
+    pos = 0
+    if state < 0:
+        m = paren_string_re.match(line)
+        if not m.group(1):
+            # String is not closed in this line
+            return [], -1
+        pos = m.end()
+    elif state > 0:
+        [pos, state] = paren_skip_block(line, 0, state)
+        if pos is None:
+            # Block comment is not closed in this line
+            return [], state
+    tokens = []
+    m = paren_token_re.search(line, pos)
+    while m:
+        t = m.group()
+        pos = m.end()
+        if t == '#|':
+            if blocks:
+                [pos, state] = paren_skip_block(line, pos, 1)
+                if pos is None:
+                    return tokens, state
+        elif t[0] == '"':
+            if not m.group(1):
+                return tokens, -1
+        elif t[0] in '()[]{}':
+            tokens.append((m.start(), t))
+        m = paren_token_re.search(line, pos)
+    return tokens, 0
+
+class paren_index:
+    """
+    Delimiters of the lines of a buffer starting at line base
+    """
+    def __init__ (self):
+        self.tick = None
+        self.base = 0
+        self.blocks = False     # #| |# is a block comment
+        self.lines = []         # Text of the indexed lines
+        self.tokens = []        # (column, delimiter) list of each line
+        self.states = [0]       # State at the line start (see paren_scan()), one more item for the end
+
+    def update(self, buf, tick, base, blocks):
+        """
+        Bring the index up to date after the buffer changed
+        """
+        if tick == self.tick and base == self.base and blocks == self.blocks:
+            return
+        new = buf[base-1:]
+        old = self.lines
+        if base != self.base or blocks != self.blocks:
+            old = []
+        # Lines not changed at the beginning and at the end of the buffer
+        n = min(len(old), len(new))
+        first = 0
+        while first < n and old[first] == new[first]:
+            first = first + 1
+        last = 0
+        while last < n - first and old[-1-last] == new[-1-last]:
+            last = last + 1
+
+        tokens = self.tokens[:first]
+        states = self.states[:first+1]
+        i = first
+        while i < len(new):
+            if i >= len(new) - last:
+                j = i - len(new) + len(old)
+                if states[i] == self.states[j]:
+                    # Same state as before the change, the rest is unchanged
+                    tokens.extend(self.tokens[j:])
+                    states.extend(self.states[j+1:])
+                    break
+            [t, s] = paren_scan(new[i], states[i], blocks)
+            tokens.append(t)
+            states.append(s)
+            i = i + 1
+        self.lines = new
+        self.tokens = tokens
+        self.states = states
+        self.tick = tick
+        self.base = base
+        self.blocks = blocks
+
+    def delimiters(self, first, last):
+        """
+        Return the delimiters from line first to line last
+        """
+        result = []
+        if last < self.base:
+            return result
+        for t in self.tokens[max(first-self.base, 0):last-self.base+1]:
+            result.extend(t)
+        return result
+
+paren_indexes = dict()          # Index by buffer number
+
+def paren_unmatched(tokens, pairs):
+    """
+    Return the number of unmatched closing and opening delimiters for each pair
+    """
+    closing = dict()
+    opening = dict()
+    match = dict()
+    for p in pairs:
+        closing[p[1]] = 0
+        opening[p[0]] = 0
+        match[p[1]] = p[0]
+    for [col, d] in tokens:
+        if d in opening:
+            opening[d] = opening[d] + 1
+        elif d in closing:
+            o = match[d]
+            if opening[o] > 0:
+                opening[o] = opening[o] - 1
+            else:
+                closing[d] = closing[d] + 1
+    return [closing, opening]
+
+def paredit_balanced(matchb, matchf, base):
+    """
+    Check if the delimiters between lines matchb and matchf are balanced
+    around the cursor (like the searchpair() calls of s:IsBalanced() would
+    do), set s:paredit_balanced accordingly
+    """
+    buf = vim.current.buffer
+    clojure = vim.eval('&ft') == 'clojure'
+    index = paren_indexes.setdefault(buf.number, paren_index())
+    index.update(buf, vim.eval('b:changedtick'), base, not clojure)
+    [l, c] = vim.current.window.cursor
+    line = buf[l-1]
+    ch = line[c:c+1]
+    pairs = ['()']
+    if clojure:
+        pairs = ['()', '[]', '{}']
+
+    before = index.delimiters(matchb, l-1)
+    after = index.delimiters(l, l)
+    before.extend([t for t in after if t[0] < c])
+    after = [t for t in after if t[0] > c]
+    after.extend(index.delimiters(l+1, matchf))
+    opening = paren_unmatched(before, pairs)[1]
+    closing = paren_unmatched(after, pairs)[0]
+
+    balanced = 1
+    for p in pairs:
+        [p1, p2] = [opening[p[0]], closing[p[1]]]
+        if not (p1 == p2) and not (p1 == p2 - 1 and ch == p[0]) and not (p1 == p2 + 1 and ch == p[1]):
+            # Number of opening and closing delimiters differ
+            balanced = 0
+    vim.command('let s:paredit_balanced=' + str(balanced))
+
+def paredit_matched(text, in_string, in_comment, clojure):
+    """
+    Filter out all non-matched characters from text, keeping only the
+    delimiters and quotes outside of strings and comments, same as the
+    Vim script version of s:GetMatchedChars(), but #| |# block comments
+    (not in Clojure) are skipped as well
+    """
+    matched = bytearray(' ' * len(text))
+    special = paren_special_re[clojure]
+    i = 0
+    while i < len(text):
+        if in_string:
+            # Wait for closing '"' but skip escaped \" characters
+            j = text.find('"', i)
+            while j > 0 and text[j-1] == '\\':
+                j = text.find('"', j+1)
+            if j < 0:
+                break
+            matched[j] = '"'
+            in_string = False
+        elif in_comment:
+            j = None
+            if not clojure:
+                # Skip a block comment until its unmatched |#
+                j = paren_skip_block(text, i, 1)[0]
+                if j is not None:
+                    j = j - 1
+            if j is None:
+                # Skip parens, wait for end of line
+                j = text.find('\n', i)
+            if j < 0:
+                break
+            in_comment = False
+        else:
+            m = special.search(text, i)
+            if not m:
+                break
+            j = m.start()
+            if j > 0 and text[j-1] == '\\' and (j < 2 or text[j-2] != '\\'):
+                # This is an escaped character, ignore it
+                pass
+            elif text[j] == '"':
+                matched[j] = '"'
+                in_string = True
+            elif text[j] == ';':
+                in_comment = True
+            elif text[j:j+2] == '#|':
+                [j, level] = paren_skip_block(text, j+2, 1)
+                if j is None:
+                    break
+                j = j - 1
+            else:
+                matched[j] = text[j]
+        i = j + 1
+    return str(matched)
+
+def paredit_get_matched():
+    """
+    s:GetMatchedChars() with the result in s:paredit_matched
+    """
+    matched = paredit_matched(vim.eval('a:lines'), vim.eval('a:start_in_string') != '0',
+                              vim.eval('a:start_in_comment') != '0', vim.eval('&ft') == 'clojure')
+    vim.command("let s:paredit_matched='" + matched + "'")
+
+def paredit_forget(bufnr):
+    """
+    Drop the index of a wiped out buffer
+    """
+    if bufnr in paren_indexes:
+        del paren_indexes[bufnr]
@@ -0,0 +1,808 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# Region reindenter for Slimv
+# reindent.py:  indentation of a range of lines computed in one pass
+# License:      This file is placed in the public domain.
+#               No warranty, express or implied.
+#               *** ***   Use At-Your-Own-Risk!   *** ***
+#
+# Every line gets the same indentation as SlimvIndent() (and the lispindent()
+# it falls back to) would give it when reindenting with the = operator, i.e.
+# with the lines above already reindented. However the lines are tokenized
+# only once: the open parens at the start of each line are kept on a stack,
+# so the containing forms are known without searching backwards, and the
+# whole range is written back to the buffer in a single update.
+# Tokenizing always starts at the first line of the buffer, the only position
+# known to be at top level, and the tokens are kept between the calls, so only
+# the lines from the first one changed since the previous call are tokenized
+# again.
+# Columns are byte positions like the ones SlimvIndent() works with.
+# It is loaded by SlimvPyfile() via pyfile, so it shares the namespace with
+# swank.py, all names start with reindent.
+#
+###############################################################################
+
+
+import re
+
+import vim
+
+
+# Tokens outside of strings: block comment, escaped character, comment, string
+# and delimiter, the group is the closing quote of the string if it is in the
+# same line
+reindent_token_re  = re.compile(r'#\||\\.?|;.*|"(?:[^"\\]|\\.?)*("?)|[][(){}]')
+
+# Nested block comments of Common Lisp
+reindent_block_re  = re.compile(r'#\||\|#')
+
+# End of a string as searched by SlimvIndent() (omit \" characters)
+reindent_quote_re  = re.compile(r'[^\\]"')
+
+# Rest of a string continued from the previous line
+reindent_string_re = re.compile(r'(?:[^"\\]|\\.?)*("?)')
+
+# Characters examined by findmatch() of Vim when searching for parens
+reindent_vim_special_re = re.compile(r'[][()"\'\\]')
+
+# Quotes and escaped characters when counting quotes like findmatch()
+reindent_vim_quote_re = re.compile(r'\\.|"')
+
+# Contraction of strings and subforms in the line of the containing form
+reindent_contract_string_re = re.compile(r'".*?[^\\]"')
+reindent_contract_form_re   = [re.compile(r'\([^()]*\)'), re.compile(r'\[[^\[\]]*\]'), re.compile(r'\{[^{}]*\}')]
+
+
+def reindent_keyword_chars(isk):
+    """
+    Return the set of characters in 'iskeyword'
+    """
+    chars = set(range(128, 256))
+    for part in isk.split(','):
+        exclude = len(part) > 1 and part[0] == '^'
+        if exclude:
+            part = part[1:]
+        if part == '':
+            continue
+        if part == '@':
+            codes = [c for c in range(128) if chr(c).isalpha()]
+        elif part == '@-@':
+            codes = [ord('@')]
+        else:
+            m = re.match(r'^(\d+|.)(?:-(\d+|.))?$', part)
+            if not m:
+                continue
+            bounds = [int(b) if b.isdigit() else ord(b) for b in m.groups(m.group(1))]
+            codes = range(bounds[0], bounds[1] + 1)
+        if exclude:
+            chars.difference_update(codes)
+        else:
+            chars.update(codes)
+    return set([chr(c) for c in chars])
+
+def reindent_skip_string(text, i):
+    """
+    Return the position of the last character of the strings and character
+    literals starting at i (i itself if there is none) like Vim does
+    """
+    n = len(text)
+    while i < n:
+        if text[i] == "'":
+            if i + 1 >= n:
+                break
+            j = 2
+            if text[i+1] == '\\' and i + 2 < n:
+                j = 3
+                while i + j - 1 < n and text[i+j-1].isdigit():
+                    j = j + 1
+            if i + j - 1 < n and text[i+j:i+j+1] == "'":
+                i = i + j + 1
+                continue
+        elif text[i] == '"':
+            i = i + 1
+            while i < n:
+                if text[i] == '\\' and i + 1 < n:
+                    i = i + 1
+                elif text[i] == '"':
+                    break
+                i = i + 1
+            if i < n:
+                i = i + 1
+                continue
+        break
+    return min(i, n - 1)
+
+def reindent_comment_col(text):
+    """
+    Column of the comment in the line as Vim finds it in 'lisp' mode or None
+    """
+    if ';' not in text:
+        return None
+    in_str = False
+    for m in re.finditer(r'[";]', text):
+        i = m.start()
+        if text[i] == '"':
+            if in_str:
+                if text[i-1] != '\\':
+                    in_str = False
+            elif i == 0 or (i >= 2 and text[i-1] != '\\' and text[i-2] != '#'):
+                in_str = True
+        elif not in_str and (i < 2 or (text[i-1] != '\\' and text[i-2] != '#')):
+            # Not in a string if a C-like string parser does not think so either
+            j = 0
+            while j < i:
+                j = reindent_skip_string(text, j) + 1
+            if j <= i:
+                return i
+    return None
+
+def reindent_vim_delims(text):
+    """
+    Return the (column, delimiter) list of the parens and brackets in the
+    line that findmatch() of Vim counts when it searches backwards through
+    the line: outside of comments, escapes, and strings if the number of
+    quotes in the line is even (it does not know multi-line strings)
+    """
+    if '(' not in text and ')' not in text and '[' not in text and ']' not in text:
+        return []
+    quotes = 0
+    for m in reindent_vim_quote_re.finditer(text):
+        i = m.start()
+        if m.group() == '"' and (i == 0 or text[i-1] != "'" or text[i+1:i+2] != "'"):
+            quotes = quotes + 1
+    do_quotes = quotes % 2 == 0
+    end = reindent_comment_col(text)
+    if end is None:
+        end = len(text)
+    delims = []
+    inquote = False
+    skip = end
+    for m in reversed(list(reindent_vim_special_re.finditer(text, 0, end))):
+        i = m.start()
+        if i >= skip:
+            continue
+        ch = text[i]
+        if ch == "'":
+            if i > 1:
+                # Skip character literals like 'c' or '\n'
+                if text[i-2] == "'":
+                    skip = i - 2
+                elif text[i-2] == '\\' and i > 2 and text[i-3] == "'":
+                    skip = i - 3
+        elif ch == '\\':
+            pass
+        else:
+            escaped = (i - len(text[:i].rstrip('\\'))) % 2 == 1
+            if ch == '"':
+                if do_quotes and not escaped:
+                    inquote = not inquote
+            elif i > 1 and text[i-1] == '\\' and text[i-2] == '#':
+                # Skip #\( et al
+                pass
+            elif not inquote and not escaped:
+                delims.append((i, ch))
+    delims.reverse()
+    return delims
+
+def reindent_number(s):
+    """
+    Value of a string used as a number in Vim script
+    """
+    m = re.match(r'-?\d+', s)
+    if m:
+        return int(m.group())
+    return 0
+
+class reindent_line:
+    """
+    Text and tokens of a line, columns of the tokens are relative to the end
+    of the leading whitespace, so they stay valid when the line is reindented
+    """
+    def __init__ (self, text):
+        self.text = text
+        self.ws = len(text) - len(text.lstrip(' \t'))
+        self.blank = self.ws == len(text)
+        self.delims = []            # (column, paren) list of the parens
+        self.paren_stack = ()       # Open parens at the start of the line as (line, column)
+        self.bracket_stack = ()     # Open brackets at the start of the line
+        self.vim_stacks = ((), ())  # Open parens and brackets as findmatch() of Vim sees them
+        self.start_string = False   # Line starts inside a string
+        self.start_quote = None     # (line, column) of the quote opening that string
+        self.start_block = 0        # Nesting level of the block comment the line starts in
+        self.start_comment = None   # Paren level of the Clojure comment form the line starts in
+        self.end_string = False     # Line ends inside a string
+        self.end_quote = None       # (line, column) of the quote opening that string
+        self.end_comment = None     # Paren level of the Clojure comment form the line ends in
+        self.count = None           # Change of the paren level as counted by lispindent()
+
+    def indent(self, tabstop):
+        return len(self.text[:self.ws].expandtabs(tabstop))
+
+    def reindent(self, amount, expandtab, tabstop):
+        if expandtab:
+            ws = ' ' * amount
+        else:
+            ws = '\t' * (amount / tabstop) + ' ' * (amount % tabstop)
+        self.text = ws + self.text[self.ws:]
+        self.ws = len(ws)
+
+    def paren_count(self):
+        """
+        Number of opening minus closing parens and brackets, counted like
+        lispindent() does when looking for a previous line at the same level
+        """
+        if self.count is not None:
+            return self.count
+        text = self.text
+        n = len(text)
+        count = 0
+        i = 0
+        while i < n:
+            ch = text[i]
+            if ch == ';':
+                break
+            if ch == '\\':
+                i = i + 2
+                continue
+            if ch == '"' and i + 1 < n:
+                i = i + 1
+                while i < n and text[i] != '"':
+                    if text[i] == '\\':
+                        i = i + 1
+                        if i >= n:
+                            break
+                        if i + 1 >= n:
+                            i = i + 1
+                            break
+                    i = i + 1
+                if i >= n:
+                    break
+            elif ch == '(' or ch == '[':
+                count = count + 1
+            elif ch == ')' or ch == ']':
+                count = count - 1
+            i = i + 1
+        self.count = count
+        return count
+
+class reindent_buffer:
+    """
+    Lines of a buffer tokenized from the first line on, the lines after
+    the reindented range are only tokenized when a form is searched there
+    """
+    def __init__ (self):
+        self.texts = []             # Text of the buffer lines not tokenized yet
+        self.lines = []
+        self.parens = []            # Open parens at the end of the last tokenized line
+        self.brackets = []
+        self.in_string = False
+        self.quote = None           # Quote opening the string the last tokenized line ends in
+        self.block = 0              # Nesting level of the block comment the last tokenized line ends in
+        self.vim_parens = []        # Open parens as findmatch() of Vim sees them
+        self.vim_brackets = []      # Open brackets as findmatch() of Vim sees them
+        self.comment = None         # Paren level of the Clojure comment form the last tokenized line ends in
+        self.clojure = None
+
+    def update(self, buf):
+        """
+        Read the settings and keep the tokens of the lines not changed
+        since the previous call, the rest is tokenized again when needed
+        """
+        clojure = self.clojure
+        self.settings()
+        self.texts = buf[:]
+        n = 0
+        if self.clojure == clojure:
+            m = min(len(self.lines), len(self.texts))
+            while n < m and self.lines[n].text == self.texts[n]:
+                n = n + 1
+        if n < len(self.lines):
+            # Continue tokenizing with the state at the start of line n
+            l = self.lines[n]
+            self.parens = list(l.paren_stack)
+            self.brackets = list(l.bracket_stack)
+            self.in_string = l.start_string
+            self.quote = l.start_quote
+            self.block = l.start_block
+            self.comment = l.start_comment
+            self.vim_parens = list(l.vim_stacks[0])
+            self.vim_brackets = list(l.vim_stacks[1])
+            del self.lines[n:]
+
+    def settings(self):
+        self.tabstop = int(vim.eval('&tabstop'))
+        self.expandtab = vim.eval('&expandtab') != '0'
+        self.maxlines = int(vim.eval('g:slimv_indent_maxlines'))
+        self.keylists = vim.eval('g:slimv_indent_keylists') != '0'
+        self.clojure = vim.eval('SlimvGetFiletype()') == 'clojure'
+        self.spec_indent = self.words(vim.eval('s:spec_indent'))
+        self.spec_param = self.words(vim.eval('s:spec_param'))
+        self.binding_form = self.words(vim.eval('s:binding_form'))
+        self.lispwords = [w for w in vim.eval('&lispwords').split(',') if w != '']
+        self.keyword_chars = reindent_keyword_chars(vim.eval('&iskeyword'))
+        self.keyword_re = re.compile('[' + ''.join([re.escape(c) for c in self.keyword_chars]) + ']+')
+        self.indent_info = None
+        if vim.eval('s:swank_connected') != '0':
+            self.indent_info = globals().get('indent_info')
+
+    def words(self, pattern):
+        """
+        List of the words in a Vim regexp like 'let\|let\*'
+        """
+        return [w.replace('\\', '') for w in pattern.split('\\|')]
+
+    def line(self, i):
+        """
+        Return the tokenized line i (0-based) or None after the last line
+        """
+        while i >= len(self.lines):
+            n = len(self.lines)
+            if n >= len(self.texts):
+                return None
+            self.scan(n, self.texts[n])
+        return self.lines[i]
+
+    def scan(self, n, text):
+        l = reindent_line(text)
+        l.paren_stack = tuple(self.parens)
+        l.bracket_stack = tuple(self.brackets)
+        l.start_string = self.in_string
+        l.start_quote = self.quote
+        l.start_block = self.block
+        l.start_comment = self.comment
+        l.end_comment = self.comment
+        l.vim_stacks = (tuple(self.vim_parens), tuple(self.vim_brackets))
+        self.lines.append(l)
+        for [col, d] in reindent_vim_delims(text):
+            stack = self.vim_parens
+            if d in '[]':
+                stack = self.vim_brackets
+            if d in '([':
+                stack.append((n, col - l.ws))
+            elif stack:
+                stack.pop()
+        pos = 0
+        if self.in_string:
+            m = reindent_string_re.match(text)
+            if not m.group(1):
+                # String is not closed in this line
+                l.end_string = True
+                l.end_quote = self.quote
+                return
+            pos = m.end()
+            self.in_string = False
+            self.quote = None
+        elif self.block:
+            pos = self.skip_block(text, 0)
+        while pos is not None:
+            m = reindent_token_re.search(text, pos)
+            if not m:
+                break
+            t = m.group()
+            col = m.start() - l.ws
+            pos = m.end()
+            if t == '#|':
+                if not self.clojure:
+                    self.block = 1
+                    pos = self.skip_block(text, pos)
+            elif t[0] == '"':
+                if not m.group(1):
+                    self.in_string = True
+                    self.quote = (n, col)
+                    break
+            elif t == '(':
+                if self.clojure and self.comment is None and text.startswith('(comment', m.start()):
+                    # The syntax file highlights the whole form as a comment
+                    self.comment = len(self.parens)
+                self.parens.append((n, col))
+                l.delims.append((col, t))
+            elif t == ')':
+                if self.parens:
+                    self.parens.pop()
+                if self.comment is not None and len(self.parens) <= self.comment:
+                    self.comment = None
+                l.delims.append((col, t))
+            elif t == '[':
+                self.brackets.append((n, col))
+            elif t == ']':
+                if self.brackets:
+                    self.brackets.pop()
+        l.end_string = self.in_string
+        l.end_quote = self.quote
+        l.end_comment = self.comment
+
+    def skip_block(self, text, pos):
+        """
+        Return the position after the end of the block comment or None
+        if it does not end in this line
+        """
+        for m in reindent_block_re.finditer(text, pos):
+            if m.group() == '#|':
+                self.block = self.block + 1
+            else:
+                self.block = self.block - 1
+                if self.block == 0:
+                    return m.end()
+        return None
+
+    def col(self, pos):
+        """
+        Column of a token position in the current text of its line
+        """
+        return self.line(pos[0]).ws + pos[1]
+
+    def text(self, pos):
+        """
+        Text of the line starting at a token position
+        """
+        return self.line(pos[0]).text[self.col(pos):]
+
+    def keyword(self, ch):
+        return ch != '' and ch in self.keyword_chars
+
+    def form_is(self, text, words):
+        """
+        Check if the form starting text is one of words, like matching
+        '\c^(\s*\(words\)\>' would
+        """
+        rest = text[1:].lstrip(' \t')
+        low = rest.lower()
+        for w in words:
+            if w != '' and low.startswith(w.lower()) and self.keyword(w[-1]) and not self.keyword(rest[len(w):len(w)+1]):
+                return True
+        return False
+
+    def enclosing(self, stack, pos, backline):
+        """
+        Index of the innermost paren in stack containing pos, like searching
+        backwards for the unmatched paren would find it, but not above backline
+        """
+        k = len(stack) - 1
+        while k >= 0 and stack[k] >= pos:
+            k = k - 1
+        if k >= 0 and stack[k][0] >= backline:
+            return k
+        return None
+
+    def next_paren(self, pos):
+        """
+        Position of the first opening paren after pos
+        """
+        i = pos[0]
+        col = pos[1]
+        while True:
+            l = self.line(i)
+            if l is None:
+                return None
+            for [c, d] in l.delims:
+                if c > col and d == '(':
+                    return (i, c)
+            i = i + 1
+            col = -len(l.text) - 1
+
+    def match_line(self, pos):
+        """
+        Line of the paren closing the paren at pos, like % would find it,
+        the line of pos if it is not closed
+        """
+        level = 0
+        i = pos[0]
+        col = pos[1] - 1
+        while True:
+            l = self.line(i)
+            if l is None:
+                return pos[0]
+            for [c, d] in l.delims:
+                if c > col:
+                    if d == '(':
+                        level = level + 1
+                    else:
+                        level = level - 1
+                        if level == 0:
+                            return i
+            i = i + 1
+            col = -len(l.text) - 1
+
+    def indent(self, lnum):
+        """
+        Indentation of line lnum (0-based), the same as SlimvIndent() gives
+        """
+        if lnum == 0:
+            # Start of the file
+            return 0
+        pnum = lnum - 1
+        while pnum >= 0 and self.line(pnum).blank:
+            pnum = pnum - 1
+        if pnum < 0:
+            # Hit the start of the file, use zero indent.
+            return 0
+        linenum = lnum
+
+        # Handle multi-line string, not highlighted as a string in a comment form
+        prev = self.line(pnum)
+        if prev.end_string and prev.end_comment is None and prev.text[-1:] != '"':
+            # Previous non-blank line ends with an unclosed string, so this is a multi-line string
+            if prev.end_quote and prev.end_quote[0] == pnum:
+                # Indent to the opening double quote
+                return self.col(prev.end_quote) + 1
+            return self.lispindent(linenum)
+        if prev.start_string and prev.start_comment is None and prev.text[:1] != '"':
+            # Previous non-blank line is the last line of a multi-line string
+            # First find the end of the multi-line string
+            e = pnum
+            end = self.line(e)
+            m = reindent_quote_re.search(end.text, 1)
+            while not m:
+                e = e + 1
+                end = self.line(e)
+                if end is None:
+                    break
+                m = reindent_quote_re.search(end.text)
+            if m and re.search(r'[][(){}]', end.text[m.end():]):
+                # Structural change after the string, no special handling
+                pass
+            elif prev.start_quote:
+                c = self.col(prev.start_quote)
+                if self.line(prev.start_quote[0]).text[:c].strip(' \t') == '':
+                    # Nothing else before the string: indent to the opening "
+                    return c
+                # Pretend that we are really after the first line of the multi-line string
+                pnum = prev.start_quote[0]
+                linenum = pnum + 1
+
+        # Handle special indentation style for flet, labels, etc.
+        # When searching for containing forms, don't go back
+        # more than g:slimv_indent_maxlines lines.
+        backline = max(pnum - self.maxlines, 0)
+        indent_keylists = self.keylists
+        # The searches for the containing forms go on from where the cursor
+        # was left by the previous search, like in SlimvIndent()
+        stack = self.line(lnum).paren_stack
+        cursor = (lnum, float('-inf'))
+        # Beginning of the innermost containing form
+        k = self.enclosing(stack, cursor, backline)
+        l = None
+        if k is not None:
+            l = stack[k][0]
+            c = self.col(stack[k])
+            cursor = stack[k]
+            if self.clojure:
+                # Is this a clojure form with [] binding list?
+                cursor = (lnum, float('-inf'))
+                brackets = self.line(lnum).bracket_stack
+                if brackets and brackets[-1][0] >= backline:
+                    lb = brackets[-1][0]
+                    cb = self.col(brackets[-1])
+                    if lb >= l and (lb > l or cb > c):
+                        return cb + 1
+                    cursor = brackets[-1]
+            # Is this a form with special indentation?
+            line = self.text(stack[k])
+            if self.form_is(line, self.spec_indent):
+                # Find the binding list and the line of its end
+                x = self.next_paren(cursor)
+                if x is not None and self.match_line(x) == pnum:
+                    # We are indenting the first line after the end of the binding list
+                    return c + 2
+            elif l == pnum:
+                # If the containing form starts above this line then find the
+                # second outer containing form (possible start of the binding list)
+                k2 = self.enclosing(stack, cursor, backline)
+                if k2 is not None:
+                    l2 = stack[k2][0]
+                    line2 = self.text(stack[k2])
+                    cursor = stack[k2]
+                    if self.form_is(line2, self.spec_param):
+                        x = self.next_paren(cursor)
+                        if x is not None:
+                            if x == stack[k]:
+                                # This is the parameter list of a special form
+                                return c + 1
+                            cursor = x
+                    if not self.clojure:
+                        if l2 == l and self.form_is(line2, self.binding_form):
+                            # Is this a lisp form with binding list?
+                            return c + 1
+                        if self.form_is(line2, ['cond']) and self.form_is(line, ['t']):
+                            # Is this the 't' case for a 'cond' form?
+                            return c + 1
+                        if self.form_is(line2, ['defpackage']):
+                            indent_keylists = False
+                    # Go one level higher and check if we reached a special form
+                    k3 = self.enclosing(stack, cursor, backline)
+                    if k3 is not None:
+                        line3 = self.text(stack[k3])
+                        if self.form_is(line3, self.spec_indent):
+                            # This is the first body-line of a binding
+                            return c + 2
+                        if self.form_is(line3, ['defsystem']):
+                            indent_keylists = False
+                        # Finally go to the topmost level to check for some forms with special keyword indenting
+                        k4 = None
+                        j = self.enclosing(stack, stack[k3], backline)
+                        while j is not None:
+                            k4 = j
+                            j = self.enclosing(stack, stack[j], backline)
+                        if k4 is not None and self.form_is(self.text(stack[k4]), ['defsystem']):
+                            indent_keylists = False
+
+        # Check if the current form started in the previous nonblank line
+        if l == pnum:
+            form = self.line(l).text[c+1:]
+            # Contract strings, remove comments
+            form = reindent_contract_string_re.sub('""', form)
+            i = form.find(';')
+            if i >= 0:
+                form = form[:i]
+            # Contract subforms by replacing them with a single character
+            f = None
+            while form != f:
+                f = form
+                for r in reindent_contract_form_re:
+                    form = r.sub('0', form)
+            # Find out the function name
+            m = self.keyword_re.search(form)
+            func = ''
+            if m:
+                func = m.group()
+            # If it's a keyword, keep the indentation straight
+            if indent_keylists and func[:1] == ':':
+                if re.match(r':\S*\s+\S', form):
+                    # This keyword has an associated value in the same line
+                    return c + 1
+                else:
+                    # The keyword stands alone in its line with no associated value
+                    return c + 2
+            if self.clojure:
+                # Fix clojure specific indentation issues not handled by the default lisp.vim
+                if func.endswith('defn'):
+                    return c + 2
+            else:
+                if func.endswith('defgeneric') or func.endswith('defsystem') or func.endswith('aif'):
+                    return c + 2
+            # Remove package specification
+            func = re.sub(r'^.*:', '', func)
+            if func != '' and self.indent_info is not None:
+                # Look how many arguments are on the same line
+                args_here = len(re.sub(r"[()\[\]{}#'`,]", '', form).split()) - 1
+                # Get swank indent info
+                indent = self.indent_info.get(func, '')
+                if indent != '' and reindent_number(indent) == args_here:
+                    # The next one is an &body argument, so indent by 2 spaces from the opening '('
+                    return c + 2
+
+        # Use default Lisp indenting
+        li = self.lispindent(linenum)
+        line = self.line(linenum - 1).text[max(li - 1, 0):]
+        m = re.match(r'\(\s+\S', line)
+        if m:
+            # Align to the gap between the opening paren and the first atom
+            return li + m.end() - 2
+        return li
+
+    def lisp_match(self, text, i):
+        """
+        Check if the word at text[i] is in 'lispwords'
+        """
+        for w in self.lispwords:
+            if text.startswith(w, i) and text[i+len(w):i+len(w)+1] in ['', ' ', '\t']:
+                return True
+        return False
+
+    def lispindent(self, lnum):
+        """
+        Indentation of line lnum by the built-in lispindent()
+        """
+        [parens, brackets] = self.line(lnum).vim_stacks
+        pos = None
+        if parens:
+            pos = parens[-1]
+        if brackets and (pos is None or brackets[-1] > pos):
+            pos = brackets[-1]
+        if pos is None:
+            # No containing form, use zero indent
+            return 0
+
+        # Take the indent of the first previous non-white line at the same level
+        count = 0
+        i = lnum - 1
+        while i >= pos[0]:
+            l = self.line(i)
+            if not l.blank:
+                count = count + l.paren_count()
+                if count == 0:
+                    return l.indent(self.tabstop)
+            i = i - 1
+
+        ts = self.tabstop
+        text = self.line(pos[0]).text
+        n = len(text)
+        that = self.col(pos)
+        amount = len(text[:that].expandtabs(ts))
+        if self.lisp_match(text, that + 1):
+            # Some keywords require "body" indenting rules
+            return amount + 2
+        that = that + 1
+        amount = amount + 1
+        firsttry = amount
+        while that < n and text[that] in ' \t':
+            amount = self.advance(amount, text[that])
+            that = that + 1
+        if that < n and text[that] != ';':
+            # Test that it is not '(' to accommodate first let/do argument if it is more than one line
+            if text[that] not in '([':
+                firsttry = firsttry + 1
+            parens = 0
+            quotes = False
+            if text[that] not in '"\'#0123456789':
+                # Skip the function name
+                while that < n and (text[that] not in ' \t' or quotes or parens):
+                    ch = text[that]
+                    if ch == '"':
+                        quotes = not quotes
+                    if ch in '([' and not quotes:
+                        parens = parens + 1
+                    if ch in ')]' and not quotes:
+                        parens = parens - 1
+                    if ch == '\\' and that + 1 < n:
+                        amount = self.advance(amount, ch)
+                        that = that + 1
+                    amount = self.advance(amount, text[that])
+                    that = that + 1
+            while that < n and text[that] in ' \t':
+                amount = self.advance(amount, text[that])
+                that = that + 1
+            if that >= n or text[that] == ';':
+                amount = firsttry
+        return amount
+
+    def advance(self, amount, ch):
+        if ch == '\t':
+            return amount + self.tabstop - amount % self.tabstop
+        return amount + 1
+
+# Tokenized buffers by buffer number
+reindent_buffers = dict()
+
+def reindent_forget(bufnr):
+    """
+    Drop the tokens of a wiped out buffer
+    """
+    if bufnr in reindent_buffers:
+        del reindent_buffers[bufnr]
+
+def reindent_range():
+    """
+    Reindent lines a:first..a:last of the current buffer
+    """
+    buf = vim.current.buffer
+    first = int(vim.eval('a:first')) - 1
+    last = min(int(vim.eval('a:last')), len(buf)) - 1
+    if first > last:
+        return
+    b = reindent_buffers.get(buf.number)
+    if b is None:
+        b = reindent_buffer()
+        reindent_buffers[buf.number] = b
+    b.update(buf)
+    lines = []
+    for i in range(first, last + 1):
+        l = b.line(i)
+        if l.blank:
+            l.reindent(0, b.expandtab, b.tabstop)
+        else:
+            l.reindent(b.indent(i), b.expandtab, b.tabstop)
+        lines.append(l.text)
+
+    # Write back only the lines changed
+    old = buf[first:last+1]
+    a = 0
+    while a < len(lines) and lines[a] == old[a]:
+        a = a + 1
+    z = len(lines)
+    while z > a and lines[z-1] == old[z-1]:
+        z = z - 1
+    if a < z:
+        buf[first+a:first+z] = lines[a:z]
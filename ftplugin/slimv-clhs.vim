@@ -34,6 +34,11 @@ if !exists( 'g:slimv_clhs_root' )
     let g:slimv_clhs_root = 'http://www.lispworks.com/reference/HyperSpec/Body/'
 endif
 
+" The symbol index of symbols.py reads the lists below directly from this file
+if SlimvSymbolIndex()
+    finish
+endif
+
 if !exists( 'g:slimv_clhs_clhs' )
     let g:slimv_clhs_clhs = [
     \["&allow-other-keys", "03_da.htm"],
@@ -21,6 +21,11 @@ if !exists( 'g:slimv_cljapi_root' )
     let g:slimv_cljapi_root = 'http://clojure.github.com/clojure/'
 endif
  
+" The symbol index of symbols.py reads the lists below directly from this file
+if SlimvSymbolIndex()
+    finish
+endif
+
 if !exists( 'g:slimv_cljapi_db' )
     let g:slimv_cljapi_db = [
     \["*", "clojure.core-api.html\\#clojure.core/*"],
@@ -21,6 +21,11 @@ if !exists( 'g:slimv_javadoc_root' )
     let g:slimv_javadoc_root = 'http://java.sun.com/javase/6/docs/api/'
 endif
  
+" The symbol index of symbols.py reads the lists below directly from this file
+if SlimvSymbolIndex()
+    finish
+endif
+
 if !exists( 'g:slimv_javadoc_db' )
     let g:slimv_javadoc_db = [
     \["AbstractAction", "javax/swing/AbstractAction.html"],
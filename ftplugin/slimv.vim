@@ -261,11 +261,31 @@ if !exists( 'g:slimv_indent_keylists' )
     let g:slimv_indent_keylists = 1
 endif
 
+" Reindent regions via reindent.py in one pass if Vim has Python
+if !exists( 'g:slimv_indent_python' )
+    let g:slimv_indent_python = 1
+endif
+
 " Maximum length of the REPL buffer
 if !exists( 'g:slimv_repl_max_len' )
     let g:slimv_repl_max_len = 0
 endif
 
+" Save lines trimmed from the REPL buffer for paging back
+if !exists( 'g:slimv_repl_spill' )
+    let g:slimv_repl_spill = 0
+endif
+
+" Use the symbol index of symbols.py for the Hyperspec lookup if Vim has Python
+if !exists( 'g:slimv_symbol_index' )
+    let g:slimv_symbol_index = 1
+endif
+
+" Directory of the symbol index cache files (~/.cache/slimv if empty)
+if !exists( 'g:slimv_symbol_cache' )
+    let g:slimv_symbol_cache = ''
+endif
+
 " =====================================================================
 "  Template definitions
 " =====================================================================
@@ -288,9 +308,11 @@ let s:last_update = 0                                     " The last update time
 let s:save_updatetime = &updatetime                       " The original value for 'updatetime'
 let s:save_showmode = &showmode                           " The original value for 'showmode'
 let s:python_initialized = 0                              " Is the embedded Python initialized?
+let s:pyfiles = {}                                        " Python modules loaded via pyfile (0 = not found)
 let s:swank_connected = 0                                 " Is the SWANK server connected?
 let s:swank_package = ''                                  " Package to use at the next SWANK eval
 let s:swank_form = ''                                     " Form to send to SWANK
+let s:swank_output_pending = 0                            " Number of output chunks waiting for the REPL buffer
 let s:refresh_disabled = 0                                " Set this variable temporarily to avoid recursive REPL rehresh calls
 let s:sldb_level = -1                                     " Are we in the SWANK debugger? -1 == no, else SLDB level
 let s:compiled_file = ''                                  " Name of the compiled file
@@ -403,23 +425,8 @@ function! SlimvEndUpdateRepl()
     let lastline = line('$')
     let prompt_offset = lastline - b:repl_prompt_line
     if g:slimv_repl_max_len > 0 && lastline > g:slimv_repl_max_len
-        let start = ''
-        let ending = s:CloseForm( getline( 1, lastline - g:slimv_repl_max_len ) )
-        if match( ending, ')\|\]\|}\|"' ) >= 0
-            " Reverse the ending and replace matched characters with their pairs
-            let start = join( reverse( split( ending, '.\zs' ) ), '' )
-            let start = substitute( start, ')', '(', 'g' )
-            let start = substitute( start, ']', '[', 'g' )
-            let start = substitute( start, '}', '{', 'g' )
-        endif
-
-        " Delete extra lines
-        execute "python vim.current.buffer[0:" . (lastline - g:slimv_repl_max_len) . "] = []"
-
-        " Re-balance the beginning of the buffer
-        if start != ''
-            call append( 0, start . " .... ; output shortened" )
-        endif
+        " Delete extra lines and re-balance the beginning of the buffer
+        execute 'python repl_trim(' . g:slimv_repl_max_len . ', ' . (SlimvGetFiletype() == 'clojure') . ', ' . g:slimv_repl_spill . ')'
         let b:repl_prompt_line = line( '$' ) - prompt_offset
     endif
 
@@ -457,13 +464,13 @@ function! SlimvSwankResponse()
             echo substitute(msg,'^\n*','','')
         endif
     endif
-    if s:swank_actions_pending
+    if s:swank_actions_pending || s:swank_output_pending
         let s:last_update = -1
     elseif s:last_update < 0
         " Remember the time when all actions are processed
         let s:last_update = localtime()
     endif
-    if s:swank_actions_pending == 0 && s:last_update >= 0 && s:last_update < localtime() - 2
+    if s:swank_actions_pending == 0 && s:swank_output_pending == 0 && s:last_update >= 0 && s:last_update < localtime() - 2
         " All SWANK output handled long ago, restore original update frequency
         let &updatetime = s:save_updatetime
     endif
@@ -479,23 +486,36 @@ function! SlimvCommand( cmd )
     endif
 endfunction
 
+" Display the statistics of the SWANK traffic
+function! SlimvStats()
+    if s:python_initialized
+        python swank_stats_report()
+    endif
+endfunction
+
+" Return the statistics of the operator arglist cache
+function! SlimvArglistStats()
+    let s:arglist_stats = {}
+    if s:python_initialized
+        python swank_arglist_stats()
+    endif
+    return s:arglist_stats
+endfunction
+
 " Execute the given SWANK command, wait for and return the response
 function! SlimvCommandGetResponse( name, cmd, timeout )
     let s:refresh_disabled = 1
     call SlimvCommand( a:cmd )
     let msg = ''
     let s:swank_action = ''
-    let starttime = localtime()
     let cmd_timeout = a:timeout
     if cmd_timeout == 0
         let cmd_timeout = 3
     endif
-    while s:swank_action == '' && localtime()-starttime < cmd_timeout
-        python swank_output( 0 )
-        redir => msg
-        silent execute 'python swank_response("' . a:name . '")'
-        redir END
-    endwhile
+    " Wait until the response for this very request arrives
+    redir => msg
+    silent execute 'python swank_wait_response("' . a:name . '", ' . cmd_timeout * 1000 . ')'
+    redir END
     let s:refresh_disabled = 0
     return msg
 endfunction
@@ -791,6 +811,18 @@ function! SlimvClearReplBuffer()
         execute "normal! gg0d" . (b:repl_prompt_line-1) . "GG$"
         let b:repl_prompt_line = 1
     endif
+    if s:python_initialized
+        python repl_spill_clear()
+    endif
+endfunction
+
+" Put back the lines most recently trimmed from the beginning of the REPL buffer
+function! SlimvReplPageBack()
+    if s:python_initialized && g:slimv_repl_spill
+        python repl_page_back()
+        let b:repl_prompt_line = b:repl_prompt_line + s:repl_paged_lines
+        normal! gg
+    endif
 endfunction
 
 " Open a new Inspect buffer
@@ -1121,6 +1153,8 @@ function! SlimvConnectSwank()
         python import vim
         execute 'pyfile ' . g:swank_path
         let s:python_initialized = 1
+        " Save the session snapshot for the next Vim session and the buffered log
+        au VimLeavePre * python swank_session_save(); logger.flush()
     endif
 
     if !s:swank_connected
@@ -1154,22 +1188,24 @@ function! SlimvConnectSwank()
         " Connected to SWANK server
         redraw
         echon "\rGetting SWANK connection info..."
-        let starttime = localtime()
-        while s:swank_version == '' && localtime()-starttime < g:slimv_timeout
-            call SlimvSwankResponse()
-        endwhile
+        " Requests not depending on each other are sent in one batch
+        python swank_batch_begin()
+        python swank_connection_info()
+        if g:slimv_simple_compl == 0
+            python swank_require('swank-fuzzy')
+        endif
+        execute 'python swank_batch_end(' . g:slimv_timeout * 1000 . ')'
+        call SlimvSwankResponse()
         if s:swank_version >= '2011-12-04'
+            " The REPL contrib must be loaded before creating the REPL
+            python swank_batch_begin()
             python swank_require('swank-repl')
-            call SlimvSwankResponse()
+            execute 'python swank_batch_end(' . g:slimv_timeout * 1000 . ')'
         endif
         if s:swank_version >= '2008-12-23'
             call SlimvCommandGetResponse( ':create-repl', 'python swank_create_repl()', g:slimv_timeout )
         endif
         let s:swank_connected = 1
-        if g:slimv_simple_compl == 0
-            python swank_require('swank-fuzzy')
-            call SlimvSwankResponse()
-        endif
         redraw
         echon "\rConnected to SWANK server on port " . g:swank_port . "."
         if exists( "g:swank_block_size" ) && SlimvGetFiletype() == 'lisp'
@@ -1611,6 +1647,33 @@ function! SlimvIndent( lnum )
     return li
 endfunction 
 
+" Reindent lines from first to last like the = operator does
+" The lines are indented in one pass by reindent.py if it can be used,
+" otherwise line by line via 'indentexpr'
+function! SlimvIndentRange( first, last )
+    if g:slimv_indent_python && &indentexpr =~ '^SlimvIndent(' && s:ReindentPython()
+        python reindent_range()
+        call cursor( a:first, 1 )
+        normal! ^
+    else
+        execute 'normal! ' . a:first . 'G=' . a:last . 'G'
+    endif
+endfunction
+
+" Load reindent.py, return 1 if it can be used
+function! s:ReindentPython()
+    if !has_key( s:pyfiles, 'reindent.py' ) && SlimvPyfile( 'reindent.py' )
+        " Drop the tokens kept for the buffer when it is wiped out
+        au BufWipeout * execute 'python reindent_forget(' . expand( '<abuf>' ) . ')'
+    endif
+    return SlimvPyfile( 'reindent.py' )
+endfunction
+
+" Operator function for the = mapping
+function! SlimvIndentOperator( type )
+    call SlimvIndentRange( line( "'[" ), line( "']" ) )
+endfunction
+
 " Send command line to REPL buffer
 " Arguments: close = add missing closing parens
 function! SlimvSendCommand( close )
@@ -1872,6 +1935,12 @@ function! SlimvHandleEnterSldb()
             endif
             return
         endif
+        if line ==# '[--more--]'
+            " More frames follow, render or fetch next part
+            call SlimvCommand( 'python swank_sldb_more()' )
+            call SlimvRefreshReplBuffer()
+            return
+        endif
         if foldlevel('.')
             " With a fold just toggle visibility
             normal za
@@ -1947,26 +2016,10 @@ function! SlimvHandleEnterInspect()
             return
         elseif line =~ '^\[--all---\]$'
             " More data follows, fetch all parts
+            " The next range is requested as soon as the previous one arrives
             echon "\rFetching all entries, please wait..."
-            let b:inspect_more = -1
-            call SlimvCommand( 'python swank_inspector_range()' )
+            execute 'python swank_inspector_all(' . (g:slimv_timeout * 1000) . ')'
             call SlimvRefreshReplBuffer()
-            let starttime = localtime()
-            while b:inspect_more < 0 && localtime()-starttime < g:slimv_timeout
-                " Wait for the first swank_inspector_range() call to finish
-                call SlimvRefreshReplBuffer()
-            endwhile
-            let starttime = localtime()
-            while b:inspect_more > 0 && localtime()-starttime < g:slimv_timeout
-                " There are more parts to fetch (1 entry is usually 4 parts)
-                echon "\rFetching all entries, please wait [" . (b:inspect_more / 4) . "]"
-                call SlimvCommand( 'python swank_inspector_range()' )
-                call SlimvRefreshReplBuffer()
-                if getchar(1)
-                    " User is impatient, stop fetching
-                    break
-                endif
-            endwhile
             if b:inspect_more > 0
                 echon "\rFetch exhausted. Select [--all---] to resume."
             else
@@ -2161,6 +2214,28 @@ function! SlimvArglist( ... )
     endif
 endfunction
 
+" Open an additional SWANK connection, the current one remains available
+function! SlimvConnectNew()
+    if s:python_initialized && s:swank_connected
+        python swank_new_connection()
+    endif
+    let g:swank_host = input( 'Swank server host name: ', g:swank_host )
+    let g:swank_port = input( 'Swank server port: ', g:swank_port )
+    call SlimvConnectServer()
+endfunction
+
+" Select the SWANK connection with the given number or list connections
+function! SlimvSelectConnection( num )
+    if !s:python_initialized
+        return
+    endif
+    if a:num == ''
+        python swank_list_connections()
+    else
+        execute 'python swank_select_connection(' . a:num . ')'
+    endif
+endfunction
+
 " Start and connect swank server
 function! SlimvConnectServer()
     if s:swank_connected
@@ -2765,7 +2840,31 @@ endfunction
 
 " ---------------------------------------------------------------------
 
+" Load a Python module from the ftplugin directory via pyfile
+" Return 1 if it is loaded
+function! SlimvPyfile( name )
+    if !has_key( s:pyfiles, a:name )
+        let s:pyfiles[a:name] = 0
+        if has( 'python' )
+            let plugins = split( globpath( &runtimepath, 'ftplugin/**/' . a:name ), '\n' )
+            if len( plugins ) > 0
+                python import vim
+                execute 'pyfile ' . plugins[0]
+                let s:pyfiles[a:name] = 1
+            endif
+        endif
+    endif
+    return s:pyfiles[a:name]
+endfunction
+
+" Load the symbol index of symbols.py, return 1 if it can be used
+function! SlimvSymbolIndex()
+    return g:slimv_symbol_index && SlimvPyfile( 'symbols.py' )
+endfunction
+
 " Find word in the CLHS symbol database, with exact or partial match.
+" The database is either a list or the name of a global variable holding
+" the list, the latter is searched in the symbol index if it can be used.
 " Return either the first symbol found with the associated URL,
 " or the list of all symbols found without the associated URL.
 function! SlimvFindSymbol( word, exact, all, db, root, init )
@@ -2776,27 +2875,39 @@ function! SlimvFindSymbol( word, exact, all, db, root, init )
         " Found something already at a previous db lookup, no need to search this db
         return a:init
     endif
+    if type( a:db ) == type( '' )
+        if SlimvSymbolIndex()
+            python symbol_find()
+            return s:symbol_found
+        endif
+        if !exists( a:db )
+            return a:init
+        endif
+        let db = eval( a:db )
+    else
+        let db = a:db
+    endif
     let lst = a:init
     let i = 0
     let w = tolower( a:word )
     if a:exact
-        while i < len( a:db )
+        while i < len( db )
             " Try to find an exact match
-            if a:db[i][0] == w
+            if db[i][0] == w
                 " No reason to check a:all here
-                return [a:db[i][0], a:root . a:db[i][1]]
+                return [db[i][0], a:root . db[i][1]]
             endif
             let i = i + 1
         endwhile
     else
-        while i < len( a:db )
+        while i < len( db )
             " Try to find the symbol starting with the given word
             let w2 = escape( w, '~' )
-            if match( a:db[i][0], w2 ) == 0
+            if match( db[i][0], w2 ) == 0
                 if a:all
-                    call add( lst, a:db[i][0] )
+                    call add( lst, db[i][0] )
                 else
-                    return [a:db[i][0], a:root . a:db[i][1]]
+                    return [db[i][0], a:root . db[i][1]]
                 endif
             endif
             let i = i + 1
@@ -3000,6 +3111,12 @@ function! SlimvInitBuffer()
     endif
     inoremap <silent> <buffer> <C-X>0     <C-O>:call SlimvCloseForm()<CR>
     inoremap <silent> <buffer> <Tab>      <C-R>=SlimvHandleTab()<CR>
+    if g:slimv_indent_python
+        " Reindent in one pass
+        nnoremap <silent> <buffer> <expr> =   ':<C-U>set operatorfunc=SlimvIndentOperator<CR>' . v:count1 . 'g@'
+        nnoremap <silent> <buffer> ==         :<C-U>call SlimvIndentRange(line('.'),line('.')+v:count1-1)<CR>
+        vnoremap <silent> <buffer> =          :<C-U>call SlimvIndentRange(line("'<"),line("'>"))<CR>
+    endif
 
     " Setup balloonexp to display symbol description
     if g:slimv_balloon && has( 'balloon_eval' )
@@ -3075,6 +3192,8 @@ call s:MenuMap( 'Slim&v.&Documentation.Generate-&Tags',         g:slimv_leader.'
 
 " REPL commands
 call s:MenuMap( 'Slim&v.&Repl.&Connect-Server',                 g:slimv_leader.'c',  g:slimv_leader.'rc',  ':call SlimvConnectServer()<CR>' )
+call s:MenuMap( 'Slim&v.&Repl.Connect-&New-Server',             '',                  '',                   ':call SlimvConnectNew()<CR>' )
+call s:MenuMap( 'Slim&v.&Repl.&List-Connections',               '',                  '',                   ':call SlimvSelectConnection("")<CR>' )
 call s:MenuMap( '',                                             g:slimv_leader.'g',  g:slimv_leader.'rp',  ':call SlimvSetPackage()<CR>' )
 call s:MenuMap( 'Slim&v.&Repl.Interrup&t-Lisp-Process',         g:slimv_leader.'y',  g:slimv_leader.'ri',  ':call SlimvInterrupt()<CR>' )
 
@@ -3107,6 +3226,7 @@ function! SlimvAddReplMenu()
     amenu &REPL.&Previous-Input                        :call SlimvPreviousCommand()<CR>
     amenu &REPL.&Next-Input                            :call SlimvNextCommand()<CR>
     amenu &REPL.Clear-&REPL                            :call SlimvClearReplBuffer()<CR>
+    amenu &REPL.Page-&Back-History                     :call SlimvReplPageBack()<CR>
 endfunction
 
 " =====================================================================
@@ -3115,6 +3235,9 @@ endfunction
 
 command! -complete=customlist,SlimvCommandComplete -nargs=* Lisp call SlimvEval([<q-args>])
 command! -complete=customlist,SlimvCommandComplete -nargs=* Eval call SlimvEval([<q-args>])
+command! SlimvStats call SlimvStats()
+command! SlimvConnectNew call SlimvConnectNew()
+command! -nargs=? SlimvConnection call SlimvSelectConnection(<q-args>)
 
 " Switch on syntax highlighting
 if !exists("g:syntax_on")
@@ -14,12 +14,23 @@
 ############################################################################### 
 
 
+import os
 import sys
+import errno
 import socket
 import time
 import select
 import string
-
+import re
+import threading
+import Queue
+import collections
+import bisect
+import tempfile
+import mmap
+import marshal
+
+input_host      = 'localhost'
 input_port      = 4005
 output_port     = 4006
 lenbytes        = 6             # Message length is encoded in this number of bytes
@@ -31,6 +42,8 @@ id              = 0             # Message id
 debug           = False
 log             = False         # Set this to True in order to enable logging
 logfile         = 'swank.log'   # Logfile name in case logging is on
+logsize         = 1024 * 1024   # Logfile is rotated when it grows above this size in bytes
+logbackups      = 3             # Number of rotated logfiles kept
 pid             = '0'           # Process id
 current_thread  = '0'
 use_unicode     = True          # Use unicode message length counting
@@ -40,24 +53,153 @@ read_string     = None          # Thread and tag in Swank read string mode
 empty_last_line = True          # Swank output ended with a new line
 prompt          = 'SLIMV'       # Command prompt
 package         = 'COMMON-LISP-USER' # Current package
-actions         = dict()        # Swank actions (like ':write-string'), by message id
+session_dir     = ''            # Directory of the session snapshots, empty if disabled
+session_host    = ''            # Host and port of the connection, the snapshot file is named after them
+session_id      = None          # Pid and swank version of the connected server
+session         = None          # Snapshot loaded at connect time, applied if still valid
+batch           = None          # Messages collected for sending at once, None if not batching
+batch_keys      = []            # Message ids of the requests in the last batch
+actions_keep    = 500           # Maximum number of completed actions not yet collected
+actions_age     = 600           # Maximum age of completed actions not yet collected in seconds
 indent_info     = dict()        # Data of :indentation-update
 frame_locals    = dict()        # Map frame variable names to their index
-inspect_content = []            # Partial content of the last Inspect command
+inspect_limit   = 20000         # Number of inspector parts fetched without asking
+use_reader      = False         # Read swank messages in a background thread
+reader          = None          # Background reader thread
+messages        = Queue.Queue() # Swank messages parsed by the reader thread
+recv_buffer     = None          # Buffer for the messages received from swank
+send_queue      = collections.deque()   # Data not yet accepted by the socket
+held            = collections.deque()   # Messages received while polled in the background, handled when selected
+polling         = False         # Receiving for a connection not selected, only its REPL output is handled
+backend         = None          # Session backend if the server does not speak swank (e.g. nrepl_session)
+arglist_size    = 500           # Maximum number of cached operator arglists
+compl_limit     = 2000          # Maximum number of fuzzy completions requested
+completions     = None          # Completions fetched for the last prefix
+repl_pending    = collections.deque()   # Output chunks not yet written to the REPL buffer
+repl_pending_lines = 0          # Number of newlines in repl_pending
+repl_dropped    = 0             # Number of lines dropped from repl_pending since the last flush
+repl_flush      = 1000          # Maximum number of lines written to the REPL buffer at once
+repl_backlog    = 20000         # Maximum number of lines waiting for the REPL buffer
+repl_spill      = None          # Temporary file keeping the lines trimmed from the REPL buffer
+repl_spilled    = []            # Offset of each trimmed chunk in repl_spill and if a balancing line replaced it
+sldb_page       = 50            # Number of backtrace frames rendered or fetched at once
+sldb_level      = ''            # Level of the debugger displayed in the SLDB buffer
+sldb_frames     = []            # Backtrace frames received but not yet rendered
+sldb_fetched    = 0             # Number of backtrace frames received
+sldb_more       = False         # Swank may have more backtrace frames
+frame_cache     = dict()        # Frame locals and source locations by debug level, request and frame
+compile_notes   = 100           # Maximum number of compiler notes listed in the REPL buffer
 
 
 ###############################################################################
 # Basic utility functions
 ###############################################################################
 
+# Monotonic clock if available, Python 2 only has the wall clock
+clock = getattr(time, 'monotonic', time.time)
+
+class log_writer:
+    """
+    Buffered log file writer keeping the file open, the file is rotated
+    when it grows too large
+    """
+    def __init__ (self, name, size, backups):
+        self.name = name
+        self.size = size
+        self.backups = backups
+        self.f = None
+        self.written = 0
+        self.lines = []
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        # Lines are written by the reader thread too
+        with self.lock:
+            self.lines.append(text + '\n')
+            full = len(self.lines) >= 100
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            lines, self.lines = self.lines, []
+            if not lines:
+                return
+            data = ''.join(lines)
+            if self.f is None:
+                self.f = open(self.name, 'a')
+                self.written = self.f.tell()
+            if self.written > 0 and self.written + len(data) > self.size:
+                self.rotate()
+            self.f.write(data)
+            self.f.flush()
+            self.written = self.written + len(data)
+
+    def rotate(self):
+        self.f.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(self.name + '.' + str(i)):
+                os.rename(self.name + '.' + str(i), self.name + '.' + str(i+1))
+        if self.backups > 0:
+            os.rename(self.name, self.name + '.1')
+            self.f = open(self.name, 'a')
+        else:
+            self.f = open(self.name, 'w')
+        self.written = 0
+
+logger = log_writer(logfile, logsize, logbackups)
+
 def logprint(text):
     if log:
-        f = open(logfile, "a")
-        f.write(text + '\n')
-        f.close()
+        logger.write(text)
 
 def logtime(text):
-    logprint(text + ' ' + str(time.clock()))
+    logprint(text + ' ' + str(clock()))
+
+class swank_stats:
+    """
+    Counters of the received messages, latency histograms and the number of
+    bytes received and sent
+    """
+    limits = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]    # Histogram bucket limits in ms
+
+    def __init__ (self):
+        self.clear()
+
+    def clear(self):
+        self.started = clock()
+        self.messages = dict()      # Number of received messages by message type
+        self.latency = dict()       # Histogram, sum and maximum in ms by measurement name
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def count(self, message):
+        self.messages[message] = self.messages.get(message, 0) + 1
+
+    def record(self, name, start):
+        ms = (clock() - start) * 1000.0
+        h = self.latency.get(name)
+        if h is None:
+            h = self.latency[name] = [[0] * (len(self.limits) + 1), 0.0, 0.0]
+        h[0][bisect.bisect_right(self.limits, ms)] += 1
+        h[1] = h[1] + ms
+        h[2] = max(h[2], ms)
+
+    def report(self):
+        lines = ['Uptime: %.1f s  Received: %d bytes  Sent: %d bytes' % \
+                 (clock() - self.started, self.bytes_in, self.bytes_out), '', 'Messages:']
+        for m, n in sorted(self.messages.items()):
+            lines.append('  %-30s %8d' % (m, n))
+        lines.append('')
+        lines.append('%-32s %8s %8s %8s  ' % ('Latency (ms):', 'count', 'avg', 'max') + \
+                     ' '.join(['<' + str(l) for l in self.limits]) + ' more')
+        for name, [buckets, total, top] in sorted(self.latency.items()):
+            n = sum(buckets)
+            lines.append('  %-30s %8d %8.1f %8.1f  ' % (name, n, total / n, top) + \
+                         ' '.join([str(b) for b in buckets]))
+        return lines
+
+stats = swank_stats()
 
 ###############################################################################
 # Simple Lisp s-expression parser
@@ -71,96 +213,75 @@ PARSERR_MISSINGLITERAL      = -4    # literal is missing after the escape charac
 PARSERR_EMPTY               = -5    # s-expression is empty
 
 
-def parse_comment( sexpr ):
-    """Parses a ';' Lisp comment till the end of line, returns comment length
-    """
-    pos = sexpr.find( '\n' )
-    if pos >= 0:
-        return pos + 1
-    return len( sexpr )
+# Tokens recognized inside an s-expression, tried in this order
+sexpr_token = re.compile(r'''
+    (?P<space>[ \t\n\r\x0b\x0c]+)
+  | (?P<string>"[^"\\]*(?:\\.[^"\\]*)*")
+  | (?P<badstring>"[^"\\]*(?:\\.[^"\\]*)*(?P<badesc>\\)?\Z)
+  | (?P<open>[(\[])
+  | (?P<close>[)\]])
+  | (?P<comment>;[^\n]*\n?)
+  | \\(?:(?P<literal>[^ \t\n\r\x0b\x0c\\)\]][^ \t\n\r\x0b\x0c)\]]*)|[ \t\n\r\x0b\x0c\\]|(?P<blank>(?=[)\]])))?
+  | (?P<keyword>[^ \t\n\r\x0b\x0c)\]]+)
+''', re.VERBOSE | re.DOTALL)
 
-def parse_keyword( sexpr ):
-    """Parses a Lisp keyword, returns keyword length
-    """
-    for pos in range( len( sexpr ) ):
-        if sexpr[pos] in string.whitespace + ')]':
-            return pos
-    return pos
+sexpr_start = re.compile(r'[ \t\n\r\x0b\x0c]*')
 
 def parse_sub_sexpr( sexpr, opening, closing ):
     """Parses a Lisp sub -expression, returns parsed string length
        and a Python list built from the s-expression,
        expression can be a Clojure style list surrounded by braces
     """
-    result = []
-    l = len( sexpr )
-    for pos in range( l ):
-        # Find first opening '(' or '['
-        if sexpr[pos] == opening:
-            break
-        if not sexpr[pos] in string.whitespace:
-            # S-expression does not start with '(' or '['
-            return [PARSERR_NOSTARTBRACE, result]
-    else:
+    pos = sexpr_start.match( sexpr ).end()
+    if pos == len( sexpr ):
         # Empty s-expression
-        return [PARSERR_EMPTY, result]
+        return [PARSERR_EMPTY, []]
+    if sexpr[pos] != opening:
+        # S-expression does not start with '(' or '['
+        return [PARSERR_NOSTARTBRACE, []]
 
+    # The buffer is walked by index, nested lists are kept on an explicit
+    # stack, so the parse time is linear in the length of the s-expression
+    result = []
+    stack = [(result, closing)]
     pos = pos + 1
-    quote_cnt = 0
-    while pos < l:
-        literal = 0
-        if sexpr[pos] == '\\':
-            literal = 1
-            pos = pos + 1
-            if pos == l:
-                return [PARSERR_MISSINGLITERAL, result]
-        if not literal and sexpr[pos] == '"':
-            # We toggle a string
-            quote_cnt = 1 - quote_cnt
-            if quote_cnt == 1:
-                quote_pos = pos
-            else:
-                result = result + [sexpr[quote_pos:pos+1]]
-        elif quote_cnt == 0:
-            # We are not in a string
-            if not literal and sexpr[pos] == '(':
-                # Parse sub expression
-                [slen, subresult] = parse_sub_sexpr( sexpr[pos:], '(', ')' )
-                if slen < 0:
-                    # Sub expression parsing error
-                    return [slen, result]
-                result = result + [subresult]
-                pos = pos + slen - 1
-            elif not literal and sexpr[pos] == '[':
-                # Parse sub expression
-                [slen, subresult] = parse_sub_sexpr( sexpr[pos:], '[', ']' )
-                if slen < 0:
-                    # Sub expression parsing error
-                    return [slen, result]
-                result = result + [subresult]
-                pos = pos + slen - 1
-            elif not literal and sexpr[pos] == closing:
-                # End of this sub expression
-                return [pos + 1, result]
-            elif not literal and sexpr[pos] != closing and sexpr[pos] in ')]':
+    match = sexpr_token.match
+    while True:
+        m = match( sexpr, pos )
+        if m is None:
+            # Closing ')' or ']' not found
+            return [PARSERR_NOCLOSEBRACE, result]
+        kind = m.lastgroup
+        if kind == 'string':
+            stack[-1][0].append( m.group( kind ) )
+        elif kind == 'open':
+            stack.append( ([], m.group( kind ) == '(' and ')' or ']') )
+        elif kind == 'close':
+            if m.group( kind ) != stack[-1][1]:
                 # Wrong closing brace/bracket
                 return [PARSERR_NOCLOSEBRACE, result]
-            elif not literal and sexpr[pos] == ';':
-                # Skip coment
-                pos = pos + parse_comment( sexpr[pos:] ) - 1
-            elif not sexpr[pos] in string.whitespace + '\\':
-                # Parse keyword but ignore dot in dotted notation (a . b)
-                klen = parse_keyword( sexpr[pos:] )
-                if klen > 1 or sexpr[pos] != '.':
-                    result = result + [sexpr[pos:pos+klen]]
-                    pos = pos + klen - 1
-        pos = pos + 1
-
-    if quote_cnt != 0:
-        # Last string is not closed
-        return [PARSERR_NOCLOSESTRING, result]
-    # Closing ')' or ']' not found
-    return [PARSERR_NOCLOSEBRACE, result]
+            sub = stack.pop()[0]
+            if not stack:
+                # End of the s-expression
+                return [m.end(), result]
+            stack[-1][0].append( sub )
+        elif kind == 'blank':
+            # Escaped closing brace/bracket
+            stack[-1][0].append( '' )
+        elif kind == 'keyword' or kind == 'literal':
+            # Ignore dot in dotted notation (a . b)
+            token = m.group( kind )
+            if token != '.':
+                stack[-1][0].append( token )
+        elif kind == 'badstring' or kind == 'badesc':
+            if m.group( 'badesc' ):
+                return [PARSERR_MISSINGLITERAL, result]
+            # Last string is not closed
+            return [PARSERR_NOCLOSESTRING, result]
+        elif kind is None and m.end() - pos == 1:
+            # Escape character at the very end
+            return [PARSERR_MISSINGLITERAL, result]
+        pos = m.end()
 
 def parse_sexpr( sexpr ):
     """Parses a Lisp s-expression, returns parsed string length
@@ -180,23 +301,243 @@ class swank_action:
         self.data = data
         self.result = ''
         self.pending = True
+        self.sent = clock()
+
+class action_registry:
+    """
+    Swank actions (like ':write-string') by message id, keeping the number
+    of pending actions and the completed ones in order of completion, also
+    per action name. Completed actions nobody collects are dropped when
+    there are too many of them or they are too old.
+    """
+    def __init__ (self, keep, age):
+        self.keep = keep
+        self.age = age
+        self.entries = dict()
+        self.pending = 0
+        self.completed = collections.OrderedDict()  # Completion time by message id
+        self.by_name = dict()                       # Completed message ids by action name
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __getitem__(self, key):
+        return self.entries[key]
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def items(self):
+        return self.entries.items()
+
+    def add(self, action):
+        self.entries[action.id] = action
+        if action.pending:
+            self.pending = self.pending + 1
+        else:
+            self.done(action)
+
+    def complete(self, key):
+        """
+        Mark the action with the given id completed and return it
+        """
+        action = self.entries.get(key)
+        if action and action.pending:
+            action.pending = False
+            self.pending = self.pending - 1
+            self.done(action)
+        return action
+
+    def done(self, action):
+        now = time.time()
+        self.completed[action.id] = now
+        self.by_name.setdefault(action.name, collections.OrderedDict())[action.id] = True
+        # Evict the oldest completed actions
+        while len(self.completed) > self.keep or \
+              (self.completed and now - self.completed.itervalues().next() > self.age):
+            self.pop(self.completed.iterkeys().next())
+
+    def first_completed(self, name=''):
+        """
+        Return the earliest completed action with the given name (any name if empty)
+        """
+        if name == '':
+            keys = self.completed
+        else:
+            keys = self.by_name.get(name)
+        if keys:
+            return self.entries[keys.iterkeys().next()]
+        return None
+
+    def pop(self, key):
+        action = self.entries.pop(key, None)
+        if action is None:
+            return None
+        if action.pending:
+            self.pending = self.pending - 1
+        else:
+            del self.completed[key]
+            keys = self.by_name[action.name]
+            del keys[key]
+            if not keys:
+                del self.by_name[action.name]
+        return action
+
+    def clear(self):
+        self.entries.clear()
+        self.pending = 0
+        self.completed.clear()
+        self.by_name.clear()
+
+actions         = action_registry(actions_keep, actions_age)
+
+class lru_cache:
+    """
+    Cache keeping the most recently used entries, with hit/miss counters
+    """
+    def __init__ (self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key in self.entries:
+            self.hits = self.hits + 1
+            # Move entry to the most recently used end
+            value = self.entries.pop(key)
+            self.entries[key] = value
+            return value
+        self.misses = self.misses + 1
+        return None
+
+    def put(self, key, value):
+        if self.size <= 0:
+            return
+        if key in self.entries:
+            del self.entries[key]
+        elif len(self.entries) >= self.size:
+            # Evict the least recently used entry
+            self.entries.popitem(last=False)
+        self.entries[key] = value
+
+    def remove_if(self, pred):
+        for key in [k for k in self.entries if pred(k)]:
+            del self.entries[key]
+
+    def clear(self):
+        self.entries.clear()
+
+arglist_cache   = lru_cache(arglist_size)   # Operator arglists by package and operator name
+filepos_cache   = lru_cache(20)             # Line start offsets by source file name
+filepos_mmap    = 1024 * 1024               # Map source files of at least this size instead of reading
+
+def fuzzy_score(pattern, name):
+    """
+    Score name for the fuzzy completion of pattern or return None if pattern
+    characters do not appear in name in this order (both in lowercase)
+    """
+    score = 0
+    pos = 0
+    last = -2
+    for c in pattern:
+        i = name.find(c, pos)
+        if i < 0:
+            return None
+        if i == 0:
+            score = score + 10      # Matching the first character
+        elif name[i-1] in '-/.:*':
+            score = score + 5       # Matching the start of a word
+        elif i == last + 1:
+            score = score + 3       # Continuing the previous match
+        else:
+            score = score + 1
+        last = i
+        pos = i + 1
+    return score
+
+class completion_set:
+    """
+    Completion candidates fetched from SWANK for a prefix in a package,
+    longer prefixes are answered locally by narrowing this set
+    """
+    def __init__ (self, kind, package, prefix, names, complete):
+        self.kind = kind            # ':simple-completions' or ':fuzzy-completions'
+        self.package = package
+        self.prefix = prefix.lower()
+        self.complete = complete    # False if the list was truncated by SWANK
+        self.names = sorted(names, key=string.lower)
+        self.keys = [n.lower() for n in self.names]
+        self.last_prefix = self.prefix
+        self.last_names = names     # Fuzzy matches of last_prefix, in SWANK order first
+
+    def covers(self, kind, package, prefix):
+        return self.complete and kind == self.kind and package == self.package and \
+               prefix.lower().startswith(self.prefix)
+
+    def matches(self, prefix):
+        prefix = prefix.lower()
+        if self.kind == ':simple-completions':
+            # Sorted names starting with prefix
+            lo = bisect.bisect_left(self.keys, prefix)
+            hi = bisect.bisect_left(self.keys, prefix + '\xff')
+            return self.names[lo:hi]
+        if prefix == self.last_prefix:
+            return self.last_names
+        if prefix.startswith(self.last_prefix):
+            # Narrow the previous matches further
+            names = self.last_names
+        else:
+            names = self.names
+        scored = []
+        for n in names:
+            score = fuzzy_score(prefix, n.lower())
+            if score is not None:
+                scored.append((-score, len(n), n))
+        scored.sort()
+        self.last_prefix = prefix
+        self.last_names = [x[2] for x in scored]
+        return self.last_names
+
+def completions_store(action, params):
+    """
+    Keep the completion list received from SWANK for narrowing
+    """
+    global completions
+
+    names = []
+    complete = True
+    if type(params[0]) == list:
+        if action.name == ':fuzzy-completions':
+            names = [unquote(x[0]) for x in params[0] if type(x) == list]
+            # Second element is true if the time limit interrupted the search
+            complete = len(names) < compl_limit and (len(params) < 2 or params[1] == 'nil')
+        else:
+            names = [unquote(x) for x in params[0] if type(x) == str]
+    [package, prefix] = action.data.split(' ', 1)
+    completions = completion_set(action.name, package, prefix, names, complete)
+
+def swank_local_completions(kind, symbol):
+    """
+    Answer completion request locally if the last fetched set covers it,
+    returns the message data for the SWANK request otherwise
+    """
+    pkg = get_swank_package()
+    if completions and completions.covers(kind, pkg, symbol):
+        swank_local_rex(kind, "\n".join(completions.matches(symbol)))
+        return None
+    return pkg + ' ' + symbol
 
 def unquote(s):
     if len(s) < 2:
         return s
     if s[0] == '"' and s[-1] == '"':
-        slist = []
-        esc = False
-        for c in s[1:-1]:
-            if not esc and c == '\\':
-                esc = True
-            elif esc and c == 'n':
-                esc = False
-                slist.append('\n')
-            else:
-                esc = False
-                slist.append(c)
-        return "".join(slist)
+        s = s[1:-1]
+        if '\\' not in s:
+            return s
+        # Escapes pair up from the left, so after splitting at the escaped
+        # backslashes every remaining backslash escapes the next character
+        return '\\'.join([p.replace('\\n', '\n').replace('\\', '') for p in s.split('\\\\')])
     else:
         return s
 
@@ -206,8 +547,20 @@ def requote(s):
     return '"' + t + '"'
 
 def new_line(new_text):
+    """
+    Return a newline if the text (a string or a list of strings) does not
+    end with one, for empty text this depends on the previous output
+    """
     global empty_last_line
 
+    if type(new_text) == list:
+        # Check the last non-empty chunk
+        for t in reversed(new_text):
+            if t != '':
+                new_text = t
+                break
+        else:
+            new_text = ''
     if new_text != '':
         if new_text[-1] != '\n':
             return '\n'
@@ -228,22 +581,48 @@ def parse_plist(lst, keyword):
             return unquote(lst[i+1])
     return ''
 
+def line_starts(fname, size):
+    """
+    Return the offsets of the line starts in the given file
+    """
+    starts = [0]
+    f = open(fname, "rb")
+    try:
+        if size >= filepos_mmap:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            data = f.read()
+        pos = data.find('\n')
+        while pos >= 0:
+            starts.append(pos + 1)
+            pos = data.find('\n', pos + 1)
+        if size >= filepos_mmap:
+            data.close()
+    finally:
+        f.close()
+    if starts[-1] == size:
+        # No line after the last newline
+        starts.pop()
+    return starts
+
 def parse_filepos(fname, loc):
-    lnum = 1
-    cnum = 1
-    pos = loc
+    """
+    Convert byte offset loc in file fname to [line, column], the line starts
+    of the file are indexed once and kept while the file is not modified
+    """
     try:
-        f = open(fname, "r")
-    except:
+        st = os.stat(fname)
+        index = filepos_cache.get(fname)
+        if index is None or index[0] != st.st_mtime or index[1] != st.st_size:
+            index = (st.st_mtime, st.st_size, line_starts(fname, st.st_size))
+            filepos_cache.put(fname, index)
+    except (OSError, IOError):
         return [0, 0]
-    for line in f:
-        if pos < len(line):
-            cnum = pos
-            break
-        pos = pos - len(line)
-        lnum = lnum + 1
-    f.close()
-    return [lnum, cnum]
+    [mtime, size, starts] = index
+    if loc >= size:
+        return [len(starts) + 1, 1]
+    lnum = bisect.bisect_right(starts, loc)
+    return [lnum, loc - starts[lnum-1]]
 
 def format_filename(fname):
     fname = vim.eval('fnamemodify(' + fname + ', ":~:.")')
@@ -277,162 +656,558 @@ def parse_location(lst):
                 return 'in ' + format_filename(fname) + ' byte ' + pos
     return 'no source line information'
 
+def parse_version(conn_info):
+    """
+    Return swank version from connection info in YYYY-MM-DD format
+    """
+    ver = conn_info.get(':version', 'nil')
+    if len(ver) == 8:
+        ver = ver[0:4] + '-' + ver[4:6] + '-' + ver[6:8]
+    return ver
+
+def swank_version(conn_info):
+    """
+    Return swank version from connection info and set message length counting
+    """
+    global use_unicode
+
+    ver = parse_version(conn_info)
+    if ver >= '2011-11-08':
+        # Recent swank servers count bytes instead of unicode characters
+        use_unicode = False
+    return ver
+
+def session_file():
+    name = 'swank-' + re.sub(r'[^\w.-]', '_', session_host) + '.session'
+    return os.path.join(os.path.expanduser(session_dir), name)
+
+def session_load(host, port):
+    """
+    Read the snapshot saved for the given swank server, it is applied only
+    when :connection-info confirms that the same server is running
+    """
+    global session_dir
+    global session_host
+    global session_id
+    global session
+
+    session_dir = ''
+    if vim.eval('exists("g:swank_session_dir")') != '0':
+        session_dir = vim.eval('g:swank_session_dir')
+    session_host = host + '-' + str(port)
+    session_id = None
+    session = None
+    if session_dir == '':
+        return
+    try:
+        f = open(session_file(), 'rb')
+        try:
+            if hasattr(os, 'getuid') and os.fstat(f.fileno()).st_uid != os.getuid():
+                # Do not trust a snapshot written by another user
+                logprint('Session snapshot ignored, not owned by the user: ' + session_file())
+                return
+            # marshal only reads plain data, the snapshot cannot run code
+            session = marshal.load(f)
+        finally:
+            f.close()
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        session = None
+    if type(session) != dict:
+        session = None
+
+def session_validate(pid, ver):
+    """
+    Apply the loaded snapshot if it was saved for this swank server process
+    """
+    global session_id
+    global session
+    global completions
+
+    session_id = [pid, ver]
+    if session and session.get('id') == session_id:
+        logprint('Session snapshot loaded from ' + session_file())
+        indent_info.update(session['indent'])
+        for [key, arglist] in session['arglists']:
+            arglist_cache.put(key, arglist)
+        if session['completions']:
+            completions = completion_set(*session['completions'])
+    session = None
+
+def swank_stats_report():
+    """
+    Print the statistics of the swank traffic
+    """
+    for line in stats.report():
+        sys.stdout.write(line + '\n')
+
+def swank_session_save():
+    """
+    Save indentation info, cached arglists and completions for a reconnect
+    """
+    if session_dir == '' or session_id is None or not sock:
+        return
+    c = None
+    if completions:
+        c = [completions.kind, completions.package, completions.prefix, completions.names, completions.complete]
+    snapshot = {'id': session_id, 'indent': indent_info, 'completions': c,
+                'arglists': [[k, v] for k, v in arglist_cache.entries.items()]}
+    fname = session_file()
+    try:
+        if not os.path.isdir(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+        if os.path.lexists(fname + '.tmp'):
+            os.remove(fname + '.tmp')
+        # Readable only by the user, never write through an existing file
+        f = os.fdopen(os.open(fname + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0600), 'wb')
+        try:
+            marshal.dump(snapshot, f)
+        finally:
+            f.close()
+        os.rename(fname + '.tmp', fname)
+    except (IOError, OSError, ValueError):
+        logprint('Unable to save session snapshot to ' + fname)
+
 def unicode_len(text):
     if use_unicode:
-        return len(unicode(text, "utf-8"))
+        # Count the bytes starting a UTF-8 sequence instead of decoding
+        return len(text.translate(None, utf8_trail))
     else:
         return len(text)
 
 def swank_send(text):
-    global sock
-
+    if backend:
+        # Messages other than :emacs-rex (e.g. :emacs-interrupt) are translated by the backend
+        backend.message(text)
+        return
     logtime('[---Sent---]')
     logprint(text)
-    l = "%06x" % unicode_len(text)
-    t = l + text
-    if debug:
+    t = "%06x" % unicode_len(text) + text
+    stats.bytes_out = stats.bytes_out + len(t)
+    if debug and batch is None:
         print 'Sending:', t
+    transport_send(t)
+
+def transport_send(data):
+    """
+    Send data already encoded for the server
+    """
+    if batch is not None:
+        # Sent later together with the other messages of the batch
+        batch.append(data)
+        return
+    send_queue.append(memoryview(data))
+    swank_flush()
+
+# Do not block in send() if the socket buffer is full (not available on Windows)
+send_flags = getattr(socket, 'MSG_DONTWAIT', 0)
+
+def swank_flush():
+    """
+    Send the queued data as far as the socket accepts it without blocking,
+    the rest is sent by the next call (from swank_listen)
+    """
     try:
-        sock.send(t)
-    except socket.error:
+        while send_queue:
+            data = send_queue[0]
+            n = sock.send(data, send_flags)
+            if n < len(data):
+                # Short write, keep the unsent part without copying it
+                send_queue[0] = data[n:]
+            else:
+                send_queue.popleft()
+    except socket.error, e:
+        if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+            return
         sys.stdout.write( 'Socket error when sending to SWANK server.\n' )
         swank_disconnect()
 
-def swank_recv_len(timeout):
+def swank_select(timeout):
+    """
+    Wait at most timeout seconds until there is data to receive, meanwhile
+    send the queued data whenever the socket accepts more of it,
+    return True if the socket is readable
+    """
+    deadline = time.time() + timeout
+    while sock:
+        writable = []
+        if send_queue:
+            writable = [sock]
+        ready = select.select([sock], writable, [], max(deadline - time.time(), 0))
+        if ready[0]:
+            return True
+        if not ready[1]:
+            return False
+        swank_flush()
+    return False
+
+# UTF-8 continuation bytes, these do not start a new unicode character
+utf8_trail = ''.join([chr(c) for c in range(0x80, 0xc0)])
+
+def utf8_seqlen(c):
+    """
+    Number of bytes in the UTF-8 sequence starting with byte c
+    """
+    o = ord(c)
+    if o < 0xc0:
+        return 1
+    elif o < 0xe0:
+        return 2
+    elif o < 0xf0:
+        return 3
+    return 4
+
+class swank_buffer:
+    """
+    Receive buffer splitting the swank message stream into messages.
+    Data is received into a single reusable bytearray, each message is
+    copied out only once, when it is complete.
+    """
+    def __init__ (self, size=65536):
+        self.size = size
+        self.data = bytearray(size)
+        self.start = 0          # Start of the unprocessed data
+        self.end = 0            # End of the received data
+        self.msglen = -1        # Length of the current message, -1 if header not yet processed
+        self.scan = 0           # Unicode characters of the current message are counted up to here
+        self.chars = 0          # Number of unicode characters counted before self.scan
+
+    def fill(self, s):
+        """
+        Receive available data from socket s, return the number of bytes received
+        """
+        if self.end == len(self.data):
+            self.compact()
+        n = s.recv_into(memoryview(self.data)[self.end:])
+        self.end = self.end + n
+        return n
+
+    def compact(self):
+        """
+        Move unprocessed data to the beginning of the buffer, grow buffer if still full
+        """
+        if self.start > 0:
+            l = self.end - self.start
+            self.data[0:l] = self.data[self.start:self.end]
+            self.scan = self.scan - self.start
+            self.start = 0
+            self.end = l
+        if self.end == len(self.data):
+            self.data.extend(bytearray(len(self.data)))
+
+    def next_message(self, counted):
+        """
+        Return the next complete message or None if not yet received,
+        message length counts unicode characters if counted, otherwise bytes
+        """
+        if self.msglen < 0:
+            if self.end - self.start < lenbytes:
+                return None
+            self.msglen = int(str(self.data[self.start:self.start+lenbytes]), 16)
+            self.start = self.start + lenbytes
+            self.scan = self.start
+            self.chars = 0
+        if counted:
+            end = self.char_boundary()
+        else:
+            end = self.start + self.msglen
+        if end < 0 or end > self.end:
+            return None
+        msg = str(self.data[self.start:end])
+        self.start = end
+        self.msglen = -1
+        if self.start == self.end:
+            # Everything processed, start again from the beginning
+            self.start = 0
+            self.end = 0
+            if len(self.data) > self.size:
+                # Release memory held for a large message
+                self.data = bytearray(self.size)
+        return msg
+
+    def char_boundary(self):
+        """
+        Return end position of the current message when its length counts
+        unicode characters, or -1 if the message is not complete yet.
+        Only the newly received bytes are examined, nothing is decoded.
+        """
+        needed = self.msglen - self.chars
+        if needed == 0:
+            return self.scan
+        # The remaining characters take at most 4 bytes each
+        chunk = str(self.data[self.scan:min(self.end, self.scan + 4 * needed + 1)])
+        n = len(chunk.translate(None, utf8_trail))
+        if n > needed:
+            # Binary search for the first byte of the character after the message
+            lo = 0
+            hi = len(chunk)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if len(chunk[:mid+1].translate(None, utf8_trail)) > needed:
+                    hi = mid
+                else:
+                    lo = mid + 1
+            return self.scan + lo
+        # Find the last character, it may be incomplete
+        q = len(chunk) - 1
+        while q > 0 and chunk[q] in utf8_trail:
+            q = q - 1
+        if q < 0 or chunk[q] in utf8_trail:
+            return -1
+        if n == needed and len(chunk) - q >= utf8_seqlen(chunk[q]):
+            return self.scan + len(chunk)
+        # Remember the characters counted so far, except the last one
+        self.chars = self.chars + n - 1
+        self.scan = self.scan + q
+        return -1
+
+def swank_recv(timeout):
+    """
+    Receive the next message, wait at most timeout seconds for new data,
+    return None if no complete message is available
+    """
     global sock
 
-    rec = ''
-    sock.setblocking(0)
-    ready = select.select([sock], [], [], timeout)
-    if ready[0]:
-        l = lenbytes
-        sock.setblocking(1)
+    try:
+        rec = recv_buffer.next_message(use_unicode)
+        while rec is None:
+            # A partially received message is kept in the buffer for the next call
+            if not swank_select(timeout):
+                return None
+            if recv_buffer.fill(sock) == 0:
+                raise socket.error('Connection closed')
+            rec = recv_buffer.next_message(use_unicode)
+        return rec
+    except (socket.error, ValueError):
+        sys.stdout.write( 'Socket error when receiving from SWANK server.\n' )
+        swank_disconnect()
+        return None
+
+def swank_reader(s, q, st, counted):
+    """
+    Background thread reading swank messages from socket s,
+    the parsed messages are put into queue q, None marks a lost connection.
+    Statistics go to st, counted is the initial message length counting.
+    Vim and the globals of the current connection must not be used from here.
+    """
+    buf = swank_buffer()
+    try:
+        while True:
+            rec = buf.next_message(counted)
+            if rec is None:
+                if buf.fill(s) == 0:
+                    raise socket.error('Connection closed')
+                continue
+            logtime('[-Received-]')
+            logprint(rec)
+            start = clock()
+            [l, r] = parse_sexpr( rec )
+            st.record('parse', start)
+            st.bytes_in = st.bytes_in + lenbytes + len(rec)
+            if len(r) > 2 and r[0].lower() == ':return' and type(r[1]) == list and len(r[1]) > 1:
+                params = r[1][1]
+                if type(params) == list and params and params[0] == ':pid':
+                    # Framing of the following messages depends on the swank version
+                    if parse_version(make_keys(params)) >= '2011-11-08':
+                        counted = False
+            q.put(r)
+    except (socket.error, ValueError):
+        q.put(None)
+
+def swank_get_message(timeout):
+    """
+    Return the next parsed swank message or None if nothing arrived in time
+    """
+    if held and not polling:
+        return held.popleft()
+    if backend:
         try:
-            data = sock.recv(l)
-        except socket.error:
+            return backend.get_message(timeout)
+        except (socket.error, ValueError):
             sys.stdout.write( 'Socket error when receiving from SWANK server.\n' )
             swank_disconnect()
-            return rec
-        while data and len(rec) < lenbytes:
-            rec = rec + data
-            l = l - len(data)
-            if l > 0:
-                try:
-                    data = sock.recv(l)
-                except socket.error:
-                    sys.stdout.write( 'Socket error when receiving from SWANK server.\n' )
-                    swank_disconnect()
-                    return rec
-    return rec
-
-def swank_recv(msglen, timeout):
-    global sock
+            return None
+
+    if reader:
+        # Just take the next message already parsed by the reader thread
+        deadline = time.time() + timeout
+        while True:
+            wait = deadline - time.time()
+            if send_queue and sock:
+                # Send the rest of the queued data when the socket accepts it,
+                # check it again shortly if still not all sent
+                if select.select([], [sock], [], 0)[1]:
+                    swank_flush()
+                if send_queue:
+                    wait = min(wait, 0.01)
+            try:
+                if wait > 0:
+                    r = messages.get(True, wait)
+                else:
+                    r = messages.get_nowait()
+                break
+            except Queue.Empty:
+                if time.time() >= deadline:
+                    return None
+        if r is None:
+            sys.stdout.write( 'Socket error when receiving from SWANK server.\n' )
+            swank_disconnect()
+        return r
+
+    rec = swank_recv(timeout)
+    if rec is None:
+        return None
+    logtime('[-Received-]')
+    logprint(rec)
+    start = clock()
+    [s, r] = parse_sexpr( rec )
+    stats.record('parse', start)
+    stats.bytes_in = stats.bytes_in + lenbytes + len(rec)
+    if debug:
+        print 'Parsed:', r
+    return r
 
-    if msglen > 0:
-        sock.setblocking(0)
-        ready = select.select([sock], [], [], timeout)
-        if ready[0]:
-            sock.setblocking(1)
-            rec = ''
-            while True:
-                # Each codepoint has at least 1 byte; so we start with the 
-                # number of bytes, and read more if needed.
-                try:
-                    needed = msglen - unicode_len(rec)
-                except UnicodeDecodeError:
-                    # Add single bytes until we've got valid UTF-8 again
-                    needed = max(msglen - len(rec), 1)
-                if needed == 0:
-                    return rec
-                try:
-                    data = sock.recv(needed)
-                except socket.error:
-                    sys.stdout.write( 'Socket error when receiving from SWANK server.\n' )
-                    swank_disconnect()
-                    return rec
-                if len(data) == 0:
-                    sys.stdout.write( 'Socket error when receiving from SWANK server.\n' )
-                    swank_disconnect()
-                    return rec
-                rec = rec + data
-    rec = ''
+class inspect_view:
+    """
+    State of the Inspect buffer: the content received so far is only kept in
+    the buffer, except the parts of the last, unfinished line. The next range
+    of a big object is requested in advance, while the user reads the buffer.
+    """
+    def __init__ (self):
+        self.reset()
+
+    def reset(self):
+        self.parts = []             # Parts of the unfinished last content line
+        self.item = False           # The unfinished line contains an item or action
+        self.volatile = 0           # Number of lines at the end of the buffer redrawn by the next range
+        self.end = 0                # Number of content parts received
+        self.pending = None         # Message id of the range request in progress
+        self.prefetched = None      # Range received in advance, not yet displayed
+        self.until = 0              # Fetch ranges without asking up to this part
+
+    def add(self, content):
+        """
+        Add content elements, return the text of the lines completed by them
+        """
+        done = []
+        for el in content:
+            if type(el) == list:
+                if el[0] == ':action':
+                    self.parts.append('{<' + unquote(el[2]) + '>')
+                    tail = '<>}'
+                else:
+                    self.parts.append('{[' + unquote(el[2]) + ']')
+                    tail = '[]}'
+                self.parts.append(unquote(el[1]) + tail)
+                self.item = True
+            else:
+                text = unquote(el)
+                self.parts.append(text)
+                if text == "\n":
+                    done.extend(self.parts)
+                    self.parts = []
+                    self.item = False
+        return "".join(done)
+
+    def tail(self, more):
+        """
+        Return the lines of the unfinished content line and the [--more--] marks
+        """
+        lst = list(self.parts)
+        if more:
+            # Swank returns end+1000 if there are more entries to request
+            if not self.item and lst and (len(lst[0]) == 0 or lst[0][0] != '['):
+                lst = ["[--more--]"]
+            else:
+                lst.append("\n[--more--]")
+            lst.append("\n[--all---]")
+        return "".join(lst).split("\n")
+
+inspector = inspect_view()
+
+def swank_inspect_request(start, end, prefetch):
+    """
+    Request the next range of the inspected object following start..end
+    """
+    cmd = '(swank:inspector-range ' + str(end) + " " + str(end+(end-start)) + ')'
+    data = ''
+    if prefetch:
+        data = 'prefetch'
+    inspector.pending = swank_rex(':inspector-range', cmd, get_swank_package(), 't', data)
 
 def swank_parse_inspect_content(pcont):
     """
-    Parse the swank inspector content
+    Parse the swank inspector content and append it to the Inspect buffer,
+    the lines already displayed are not rendered again
     """
-    global inspect_content
+    start = clock()
+    istate = pcont[1]
+    more = int(istate) > int(pcont[3])
+    if more:
+        # Ask for the next range before rendering this one
+        [first, last] = [int(pcont[2]), int(pcont[3])]
+        if last < inspector.until:
+            swank_inspect_request(first, last, False)
+        elif last < inspect_limit:
+            swank_inspect_request(first, last, True)
 
     vim.command('let oldpos=winsaveview()')
     buf = vim.current.buffer
-    # First 2 lines are filled in swank_parse_inspect()
-    buf[2:] = []
+    if inspector.volatile > 0:
+        buf[len(buf)-inspector.volatile:] = []
+    lines = []
     if type(pcont[0]) == list:
-        inspect_content = inspect_content + pcont[0]  # Append to the previous content
-    istate = pcont[1]
-    start  = pcont[2]
-    end    = pcont[3]
-    lst = []
-    linestart = 0
-    for el in inspect_content:
-        logprint(str(el))
-        if type(el) == list:
-            if el[0] == ':action':
-                item = '{<' + unquote(el[2]) + '>'
-                tail = '<>}'
-            else:
-                item = '{[' + unquote(el[2]) + ']'
-                tail = '[]}'
-            lst.insert(len(lst), item)
-            linestart = -1
-            text = unquote(el[1])
-            lst.append(text + tail)
-        else:
-            text = unquote(el)
-            lst.append(text)
-            if text == "\n":
-                linestart = len(lst)
-    if int(istate) > int(end):
-        # Swank returns end+1000 if there are more entries to request
-        if linestart >= 0 and linestart < len(lst) and (len(lst[linestart]) == 0 or lst[linestart][0] != '['):
-            lst[linestart:] = "[--more--]"
-        else:
-            lst.append("\n[--more--]")
-        lst.append("\n[--all---]")
-    buf = vim.current.buffer
-    buf.append([''])
-    buf.append("".join(lst).split("\n"))
+        inspector.end = inspector.end + len(pcont[0])
+        text = inspector.add(pcont[0])
+        if text:
+            lines = text.split("\n")[:-1]
+    tail = inspector.tail(more)
     inspect_path = vim.eval('s:inspect_path')
     if len(inspect_path) > 1:
         ret = '[<<] Return to ' + ' -> '.join(inspect_path[:-1])
     else:
         ret = '[<<] Exit Inspector'
-    buf.append(['', ret])
-    vim.command('normal! 3G0')
-    vim.command('call SlimvHelp(2)')
+    tail = tail + ['', ret]
+    inspector.volatile = len(tail)
+    buf.append(lines + tail)
+    vim.command('call SlimvEndUpdate()')
     vim.command('call winrestview(oldpos)')
-    if int(istate) > int(end):
+    if more:
         # There are more entries to request
         # Save current range for the next request
-        vim.command("let b:range_start=" + start)
-        vim.command("let b:range_end=" + end)
-        vim.command("let b:inspect_more=" + end)
+        vim.command("let b:range_start=" + pcont[2])
+        vim.command("let b:range_end=" + pcont[3])
+        vim.command("let b:inspect_more=" + pcont[3])
     else:
-        # No ore entries left
+        # No more entries left
         vim.command("let b:inspect_more=0")
+    stats.record('inspect', start)
+
+def swank_parse_inspect_range(pcont, action):
+    """
+    Display a range received from swank, or keep it until [--more--]
+    is selected if it was requested in advance
+    """
+    if action.id != inspector.pending:
+        # Reply for a previously inspected object
+        return
+    inspector.pending = None
+    if action.data == 'prefetch' or vim.eval('bufname("%") == g:slimv_inspect_name') != '1':
+        inspector.prefetched = pcont
+    else:
+        swank_parse_inspect_content(pcont)
 
 def swank_parse_inspect(struct):
     """
     Parse the swank inspector output
     """
-    global inspect_content
-
     vim.command('call SlimvOpenInspectBuffer()')
     buf = vim.current.buffer
-    buf[:] = ['Inspecting ' + parse_plist(struct, ':title'), '--------------------']
+    buf[:] = ['Inspecting ' + parse_plist(struct, ':title'), '--------------------', '']
+    inspector.reset()
     pcont = parse_plist(struct, ':content')
-    inspect_content = []
     swank_parse_inspect_content(pcont)
+    vim.command('normal! 3G0')
+    vim.command('call SlimvHelp(2)')
 
 def swank_parse_debug(struct):
     """
@@ -449,18 +1224,96 @@ def swank_parse_debug(struct):
         r1 = r1.replace("\n", " ")
         buf.append([str(i).rjust(3) + ': [' + r0 + '] ' + r1])
     buf.append(['', 'Backtrace:'])
-    for f in frames:
-        frame = str(f[0])
-        ftext = unquote( f[1] )
-        ftext = ftext.replace('\n', '')
-        ftext = ftext.replace('\\\\n', '')
-        buf.append([frame.rjust(3) + ': ' + ftext])
+    swank_sldb_start(level, frames)
+    sldb_render(buf)
     vim.command('call SlimvEndUpdate()')
     vim.command("call search('^Restarts:', 'w')")
     vim.command('stopinsert')
     # This text will be printed into the REPL buffer
     return unquote(condition[0]) + "\n" + unquote(condition[1]) + "\n"
 
+def swank_sldb_start(level, frames):
+    """
+    Start a new backtrace with the frames received in the :debug message
+    """
+    global sldb_level
+    global sldb_frames
+    global sldb_fetched
+    global sldb_more
+
+    sldb_level = level
+    if type(frames) != list:
+        frames = []
+    sldb_frames = frames
+    sldb_fetched = len(frames)
+    # The number of frames in the :debug message depends on the swank server,
+    # ask for more until a swank:backtrace reply is shorter than requested
+    sldb_more = len(frames) > 0
+    # Frame information of this level and above is not valid any more
+    for key in frame_cache.keys():
+        if int(key.split(' ')[0]) >= int(level):
+            del frame_cache[key]
+
+def sldb_render(buf):
+    """
+    Append the next page of received backtrace frames to the SLDB buffer,
+    followed by [--more--] if there are further frames here or in swank
+    """
+    global sldb_frames
+
+    if len(buf) > 0 and buf[-1] == '[--more--]':
+        buf[len(buf)-1:] = []
+    page = sldb_frames[:sldb_page]
+    sldb_frames = sldb_frames[sldb_page:]
+    lines = []
+    for f in page:
+        frame = str(f[0])
+        ftext = unquote( f[1] )
+        ftext = ftext.replace('\n', '')
+        ftext = ftext.replace('\\\\n', '')
+        lines.append(frame.rjust(3) + ': ' + ftext)
+    if sldb_frames or sldb_more:
+        lines.append('[--more--]')
+    buf.append(lines)
+
+def swank_parse_backtrace(struct, action):
+    """
+    Parse the next range of backtrace frames
+    """
+    global sldb_frames
+    global sldb_fetched
+    global sldb_more
+
+    if action.data != sldb_level:
+        # Reply for a debugger already left
+        return
+    if type(struct) != list:
+        struct = []
+    sldb_frames = struct
+    sldb_fetched = sldb_fetched + len(struct)
+    sldb_more = len(struct) >= sldb_page
+    vim.command('call SlimvOpenSldbBuffer()')
+    buf = vim.current.buffer
+    if buf[-1] == '[--more--]':
+        sldb_render(buf)
+    vim.command('call SlimvEndUpdate()')
+
+def swank_sldb_more():
+    """
+    Render more backtrace frames, fetch them from swank if all received
+    frames are already displayed
+    """
+    if sldb_frames:
+        vim.command('call SlimvOpenSldbBuffer()')
+        sldb_render(vim.current.buffer)
+        vim.command('call SlimvEndUpdate()')
+    elif sldb_more:
+        cmd = '(swank:backtrace ' + str(sldb_fetched) + ' ' + str(sldb_fetched + sldb_page) + ')'
+        swank_rex(':backtrace', cmd, 'nil', current_thread, sldb_level)
+
+def frame_cache_key(action):
+    return sldb_level + ' ' + action.name + ' ' + action.data
+
 def swank_parse_xref(struct):
     """
     Parse the swank xref output
@@ -470,11 +1323,17 @@ def swank_parse_xref(struct):
         buf = buf + unquote(e[0]) + ' - ' + parse_location(e[1]) + '\n'
     return buf
 
+def vim_string(s):
+    """
+    Return s as a double quoted Vim string literal
+    """
+    return requote(s).replace('\n', '\\n')
+
 def swank_parse_compile(struct):
     """
-    Parse compiler output
+    Parse compiler output, fill the quickfix list in one step and return
+    the text report of the notes (only if the REPL buffer is visible)
     """
-    buf = ''
     warnings = struct[1]
     time = struct[3]
     filename = ''
@@ -483,40 +1342,48 @@ def swank_parse_compile(struct):
     if filename == '' or filename[0] != '"':
         filename = '"' + filename + '"'
     vim.command('let s:compiled_file=' + filename + '')
-    vim.command("let qflist = []")
-    if type(warnings) == list:
-        buf = '\n' + str(len(warnings)) + ' compiler notes:\n\n'
-        for w in warnings:
-            msg      = parse_plist(w, ':message')
-            severity = parse_plist(w, ':severity')
-            if severity[0] == ':':
-                severity = severity[1:]
-            location = parse_plist(w, ':location')
-            if location[0] == ':error':
-                # "no error location available"
-                buf = buf + '  ' + unquote(location[1]) + '\n'
-                buf = buf + '  ' + severity + ': ' + msg + '\n\n'
-            else:
-                fname   = unquote(location[1][1])
-                pos     = location[2][1]
+    if type(warnings) != list:
+        vim.command("call setqflist([])")
+        return '\nCompilation finished. (No warnings)  [' + time + ' secs]\n\n'
+
+    report = vim.eval('bufwinnr(g:slimv_repl_name)') != '-1'
+    buf = ['\n' + str(len(warnings)) + ' compiler notes:\n\n']
+    qflist = []
+    for i, w in enumerate(warnings):
+        msg      = parse_plist(w, ':message')
+        severity = parse_plist(w, ':severity')
+        if severity[0] == ':':
+            severity = severity[1:]
+        location = parse_plist(w, ':location')
+        listed = report and i < compile_notes
+        if location[0] == ':error':
+            # "no error location available"
+            if listed:
+                buf.append('  ' + unquote(location[1]) + '\n')
+                buf.append('  ' + severity + ': ' + msg + '\n\n')
+        else:
+            fname   = unquote(location[1][1])
+            pos     = location[2][1]
+            if listed:
                 if location[3] != 'nil':
                     snippet = unquote(location[3][1]).replace('\r', '')
-                    buf = buf + snippet + '\n'
-                buf = buf + fname + ':' + pos + '\n'
-                buf = buf + '  ' + severity + ': ' + msg + '\n\n' 
-                if location[2][0] == ':line':
-                    lnum = pos
-                    cnum = 1
-                else:
-                    [lnum, cnum] = parse_filepos(fname, int(pos))
-                msg = msg.replace("'", "' . \"'\" . '")
-                qfentry = "{'filename':'"+fname+"','lnum':'"+str(lnum)+"','col':'"+str(cnum)+"','text':'"+msg+"'}"
-                logprint(qfentry)
-                vim.command("call add(qflist, " + qfentry + ")")
-    else:
-        buf = '\nCompilation finished. (No warnings)  [' + time + ' secs]\n\n'
-    vim.command("call setqflist(qflist)")
-    return buf
+                    buf.append(snippet + '\n')
+                buf.append(fname + ':' + pos + '\n')
+                buf.append('  ' + severity + ': ' + msg + '\n\n')
+            if location[2][0] == ':line':
+                lnum = pos
+                cnum = 1
+            else:
+                [lnum, cnum] = parse_filepos(fname, int(pos))
+            qflist.append("{'filename':" + vim_string(fname) + ",'lnum':'" + str(lnum) + \
+                          "','col':'" + str(cnum) + "','text':" + vim_string(msg) + "}")
+    logprint('qflist: ' + str(len(qflist)) + ' entries')
+    vim.command("call setqflist([" + ",".join(qflist) + "])")
+    if not report:
+        return '\n' + str(len(warnings)) + ' compiler notes, see the quickfix list.\n\n'
+    if len(warnings) > compile_notes:
+        buf.append('... ' + str(len(warnings) - compile_notes) + ' more compiler notes, see the quickfix list.\n\n')
+    return "".join(buf)
 
 def swank_parse_list_threads(tl):
     vim.command('call SlimvOpenThreadsBuffer()')
@@ -559,6 +1426,7 @@ def swank_parse_frame_source(struct, action):
     http://comments.gmane.org/gmane.lisp.slime.devel/9961 ;-(
     'Well, let's say a missing feature: source locations are currently not available for code loaded as source.'
     """
+    frame_cache[frame_cache_key(action)] = struct
     vim.command('call SlimvGotoFrame(' + action.data + ')')
     buf = vim.current.buffer
     win = vim.current.window
@@ -591,6 +1459,7 @@ def swank_parse_locals(struct, action):
     """
     Parse frame locals output
     """
+    frame_cache[frame_cache_key(action)] = struct
     frame_num = action.data
     vim.command('call SlimvGotoFrame(' + frame_num + ')')
     buf = vim.current.buffer
@@ -612,7 +1481,7 @@ def swank_parse_locals(struct, action):
     buf[line:line] = lines.split("\n")
     vim.command('call SlimvEndUpdate()')
 
-def swank_listen():
+def swank_listen(timeout=recv_timeout):
     global output_port
     global use_unicode
     global debug_active
@@ -624,225 +1493,221 @@ def swank_listen():
     global package
     global pid
 
-    retval = ''
+    retval = []
     msgcount = 0
     #logtime('[- Listen--]')
-    timeout = recv_timeout
+    if send_queue:
+        swank_flush()
     while msgcount < maxmessages:
-        rec = swank_recv_len(timeout)
-        if rec == '':
+        r = swank_get_message(timeout)
+        if r is None:
             break
         timeout = 0.0
         msgcount = msgcount + 1
-        if debug:
-            print 'swank_recv_len received', rec
-        msglen = int(rec, 16)
-        if debug:
-            print 'Received length:', msglen
-        if msglen > 0:
-            # length already received so it must be followed by data
-            # use a higher timeout
-            rec = swank_recv(msglen, 1.0)
-            logtime('[-Received-]')
-            logprint(rec)
-            [s, r] = parse_sexpr( rec )
+        if len(r) > 0:
+            r_id = r[-1]
+            message = r[0].lower()
+            if polling and message not in [':write-string', ':presentation-start', ':indentation-update', ':ping']:
+                # Anything else may open buffers or set the script variables
+                # of the current connection: keep it and the messages after it
+                # until this connection is selected
+                held.append(r)
+                break
+            stats.count(message)
             if debug:
-                print 'Parsed:', r
-            if len(r) > 0:
-                r_id = r[-1]
-                message = r[0].lower()
-                if debug:
-                    print 'Message:', message
+                print 'Message:', message
 
-                if message == ':open-dedicated-output-stream':
-                    output_port = int( r[1].lower(), 10 )
-                    if debug:
-                        print ':open-dedicated-output-stream result:', output_port
-                    break
+            if message == ':open-dedicated-output-stream':
+                output_port = int( r[1].lower(), 10 )
+                if debug:
+                    print ':open-dedicated-output-stream result:', output_port
+                break
+
+            elif message == ':presentation-start':
+                retval.append(new_line(retval))
+
+            elif message == ':write-string':
+                # REPL has new output to display
+                retval.append(unquote(r[1]))
+                if actions.pending == 0:
+                    retval.append(new_line(retval) + prompt + '> ')
+
+            elif message == ':read-string':
+                # REPL requests entering a string
+                read_string = r[1:3]
+
+            elif message == ':indentation-update':
+                for el in r[1]:
+                    indent_info[ unquote(el[0]) ] = el[1]
+
+            elif message == ':new-package':
+                package = unquote( r[1] )
+                prompt  = unquote( r[2] )
+
+            elif message == ':return':
+                read_string = None
+                result = r[1][0].lower()
+                if type(r_id) == str:
+                    action = actions.complete(r_id)
+                else:
+                    action = None
+                if action:
+                    stats.record(action.name, action.sent)
+                if log:
+                    logtime('[Actionlist]')
+                    for k,a in sorted(actions.items()):
+                        if a.pending:
+                            pending = 'pending '
+                        else:
+                            pending = 'finished'
+                        logprint("%s: %s %s %s" % (k, str(pending), a.name, a.result))
 
-                elif message == ':presentation-start':
-                    retval = retval + new_line(retval)
-
-                elif message == ':write-string':
-                    # REPL has new output to display
-                    retval = retval + unquote(r[1])
-                    add_prompt = True
-                    for k,a in actions.items():
-                        if a.pending and a.name.find('eval'):
-                            add_prompt = False
-                            break
-                    if add_prompt:
-                        retval = retval + new_line(retval) + prompt + '> '
-
-                elif message == ':read-string':
-                    # REPL requests entering a string
-                    read_string = r[1:3]
-
-                elif message == ':indentation-update':
-                    for el in r[1]:
-                        indent_info[ unquote(el[0]) ] = el[1]
-
-                elif message == ':new-package':
-                    package = unquote( r[1] )
-                    prompt  = unquote( r[2] )
-
-                elif message == ':return':
-                    read_string = None
-                    result = r[1][0].lower()
-                    if type(r_id) == str and r_id in actions:
-                        action = actions[r_id]
-                        action.pending = False
-                    else:
-                        action = None
+                if result == ':ok':
+                    params = r[1][1]
                     if log:
-                        logtime('[Actionlist]')
-                        for k,a in sorted(actions.items()):
-                            if a.pending:
-                                pending = 'pending '
-                            else:
-                                pending = 'finished'
-                            logprint("%s: %s %s %s" % (k, str(pending), a.name, a.result))
-
-                    if result == ':ok':
-                        params = r[1][1]
                         logprint('params: ' + str(params))
-                        if type(params) == str:
-                            element = params.lower()
-                            to_ignore = [':frame-call', ':quit-inspector', ':kill-thread', ':debug-thread']
-                            to_nodisp = [':describe-symbol']
-                            to_prompt = [':undefine-function', ':swank-macroexpand-1', ':swank-macroexpand-all', ':disassemble-form', \
-                                         ':load-file', ':toggle-profile-fdefinition', ':profile-by-substring', ':swank-toggle-trace', 'sldb-break']
-                            if action and action.name in to_ignore:
-                                # Just ignore the output for this message
-                                pass
-                            elif element == 'nil' and action and action.name == ':inspector-pop':
-                                # Quit inspector
-                                vim.command('b #')
-                            elif element != 'nil' and action and action.name in to_nodisp:
-                                # Do not display output, just store it in actions
-                                action.result = unquote(params)
-                            else:
-                                retval = retval + new_line(retval)
-                                if element != 'nil':
-                                    retval = retval + unquote(params)
-                                    if action:
-                                        action.result = retval
-                                if element == 'nil' or (action and action.name in to_prompt):
-                                    # No more output from REPL, write new prompt
-                                    retval = retval + new_line(retval) + prompt + '> '
-
-                        elif type(params) == list and params:
-                            element = ''
-                            if type(params[0]) == str: 
-                                element = params[0].lower()
-                            if element == ':present':
+                    if type(params) == str:
+                        element = params.lower()
+                        to_ignore = [':frame-call', ':quit-inspector', ':kill-thread', ':debug-thread']
+                        to_nodisp = [':describe-symbol']
+                        to_prompt = [':undefine-function', ':swank-macroexpand-1', ':swank-macroexpand-all', ':disassemble-form', \
+                                     ':load-file', ':toggle-profile-fdefinition', ':profile-by-substring', ':swank-toggle-trace', 'sldb-break']
+                        if action and action.name in to_ignore:
+                            # Just ignore the output for this message
+                            pass
+                        elif element == 'nil' and action and action.name == ':inspector-pop':
+                            # Quit inspector
+                            vim.command('b #')
+                        elif element != 'nil' and action and action.name in to_nodisp:
+                            # Do not display output, just store it in actions
+                            action.result = unquote(params)
+                        elif action and action.name == ':backtrace':
+                            # No more frames
+                            swank_parse_backtrace(params, action)
+                        else:
+                            retval.append(new_line(retval))
+                            if element != 'nil':
+                                retval.append(unquote(params))
+                                if action:
+                                    action.result = "".join(retval)
+                                    if action.name == ':operator-arglist':
+                                        arglist_cache.put(action.data, unquote(params))
+                            if element == 'nil' or (action and action.name in to_prompt):
                                 # No more output from REPL, write new prompt
-                                retval = retval + new_line(retval) + unquote(params[1][0][0]) + '\n' + prompt + '> '
-                            elif element == ':values':
-                                retval = retval + new_line(retval)
-                                if type(params[1]) == list: 
-                                    retval = retval + unquote(params[1][0]) + '\n'
-                                else:
-                                    retval = retval + unquote(params[1]) + '\n' + prompt + '> '
-                            elif element == ':suppress-output':
-                                pass
-                            elif element == ':pid':
-                                conn_info = make_keys(params)
-                                pid = conn_info[':pid']
-                                ver = conn_info.get(':version', 'nil')
-                                if len(ver) == 8:
-                                    # Convert version to YYYY-MM-DD format
-                                    ver = ver[0:4] + '-' + ver[4:6] + '-' + ver[6:8]
-                                imp = make_keys( conn_info[':lisp-implementation'] )
-                                pkg = make_keys( conn_info[':package'] )
-                                package = pkg[':name']
-                                prompt = pkg[':prompt']
-                                vim.command('let s:swank_version="' + ver + '"')
-                                if ver >= '2011-11-08':
-                                    # Recent swank servers count bytes instead of unicode characters
-                                    use_unicode = False
-                                vim.command('let s:lisp_version="' + imp[':version'] + '"')
-                                retval = retval + new_line(retval)
-                                retval = retval + imp[':type'] + ' ' + imp[':version'] + '  Port: ' + str(input_port) + '  Pid: ' + pid + '\n; SWANK ' + ver
-                                retval = retval + '\n' + prompt + '> '
-                                logprint(' Package:' + package + ' Prompt:' + prompt)
-                            elif element == ':name':
-                                keys = make_keys(params)
-                                retval = retval + new_line(retval)
-                                retval = retval + '  ' + keys[':name'] + ' = ' + keys[':value'] + '\n'
-                            elif element == ':title':
-                                swank_parse_inspect(params)
-                            elif element == ':compilation-result':
-                                retval = retval + new_line(retval) + swank_parse_compile(params) + prompt + '> '
+                                retval.append(new_line(retval) + prompt + '> ')
+
+                    elif type(params) == list and params:
+                        element = ''
+                        if type(params[0]) == str: 
+                            element = params[0].lower()
+                        if element == ':present':
+                            # No more output from REPL, write new prompt
+                            retval.append(new_line(retval) + unquote(params[1][0][0]) + '\n' + prompt + '> ')
+                        elif element == ':values':
+                            retval.append(new_line(retval))
+                            if type(params[1]) == list: 
+                                retval.append(unquote(params[1][0]) + '\n')
                             else:
-                                if action.name == ':simple-completions':
-                                    if type(params[0]) == list and type(params[0][0]) == str and params[0][0] != 'nil':
-                                        compl = "\n".join(params[0])
-                                        retval = retval + compl.replace('"', '')
-                                elif action.name == ':fuzzy-completions':
-                                    if type(params[0]) == list and type(params[0][0]) == list:
-                                        compl = "\n".join(map(lambda x: x[0], params[0]))
-                                        retval = retval + compl.replace('"', '')
-                                elif action.name == ':list-threads':
-                                    swank_parse_list_threads(r[1])
-                                elif action.name == ':xref':
-                                    retval = retval + '\n' + swank_parse_xref(r[1][1])
-                                    retval = retval + new_line(retval) + prompt + '> '
-                                elif action.name == ':set-package':
-                                    package = unquote(params[0])
-                                    prompt = unquote(params[1])
-                                    retval = retval + '\n' + prompt + '> '
-                                elif action.name == ':untrace-all':
-                                    retval = retval + '\nUntracing:'
-                                    for f in params:
-                                        retval = retval + '\n' + '  ' + f
-                                    retval = retval + '\n' + prompt + '> '
-                                elif action.name == ':frame-call':
-                                    swank_parse_frame_call(params, action)
-                                elif action.name == ':frame-source-location':
-                                    swank_parse_frame_source(params, action)
-                                elif action.name == ':frame-locals-and-catch-tags':
-                                    swank_parse_locals(params[0], action)
-                                elif action.name == ':profiled-functions':
-                                    retval = retval + '\n' + 'Profiled functions:\n'
-                                    for f in params:
-                                        retval = retval + '  ' + f + '\n'
-                                    retval = retval + prompt + '> '
-                                elif action.name == ':inspector-range':
-                                    swank_parse_inspect_content(params)
-                                if action:
-                                    action.result = retval
-
-                    elif result == ':abort':
-                        debug_active = False
-                        vim.command('let s:sldb_level=-1')
-                        if len(r[1]) > 1:
-                            retval = retval + '; Evaluation aborted on ' + unquote(r[1][1]) + '\n' + prompt + '> '
+                                retval.append(unquote(params[1]) + '\n' + prompt + '> ')
+                        elif element == ':suppress-output':
+                            pass
+                        elif element == ':pid':
+                            conn_info = make_keys(params)
+                            pid = conn_info[':pid']
+                            ver = swank_version(conn_info)
+                            session_validate(pid, ver)
+                            imp = make_keys( conn_info[':lisp-implementation'] )
+                            pkg = make_keys( conn_info[':package'] )
+                            package = pkg[':name']
+                            prompt = pkg[':prompt']
+                            vim.command('let s:swank_version="' + ver + '"')
+                            vim.command('let s:lisp_version="' + imp[':version'] + '"')
+                            retval.append(new_line(retval))
+                            retval.append(imp[':type'] + ' ' + imp[':version'] + '  Port: ' + str(input_port) + '  Pid: ' + pid + '\n; SWANK ' + ver)
+                            retval.append('\n' + prompt + '> ')
+                            logprint(' Package:' + package + ' Prompt:' + prompt)
+                        elif element == ':name':
+                            keys = make_keys(params)
+                            retval.append(new_line(retval))
+                            retval.append('  ' + keys[':name'] + ' = ' + keys[':value'] + '\n')
+                        elif element == ':title':
+                            swank_parse_inspect(params)
+                        elif element == ':compilation-result':
+                            retval.append(new_line(retval) + swank_parse_compile(params) + prompt + '> ')
                         else:
-                            retval = retval + '; Evaluation aborted\n' + prompt + '> '
-
-                elif message == ':inspect':
-                    swank_parse_inspect(r[1])
-
-                elif message == ':debug':
-                    retval = retval + swank_parse_debug(r)
-
-                elif message == ':debug-activate':
-                    debug_active = True
-                    debug_activated = True
-                    current_thread = r[1]
-                    sldb_level = r[2]
-                    vim.command('let s:sldb_level=' + sldb_level)
-                    frame_locals.clear()
-
-                elif message == ':debug-return':
+                            if action.name == ':simple-completions':
+                                if type(params[0]) == list and type(params[0][0]) == str and params[0][0] != 'nil':
+                                    compl = "\n".join(params[0])
+                                    retval.append(compl.replace('"', ''))
+                                completions_store(action, params)
+                            elif action.name == ':fuzzy-completions':
+                                if type(params[0]) == list and type(params[0][0]) == list:
+                                    compl = "\n".join(map(lambda x: x[0], params[0]))
+                                    retval.append(compl.replace('"', ''))
+                                completions_store(action, params)
+                            elif action.name == ':list-threads':
+                                swank_parse_list_threads(r[1])
+                            elif action.name == ':xref':
+                                retval.append('\n' + swank_parse_xref(r[1][1]))
+                                retval.append(new_line(retval) + prompt + '> ')
+                            elif action.name == ':set-package':
+                                package = unquote(params[0])
+                                prompt = unquote(params[1])
+                                retval.append('\n' + prompt + '> ')
+                            elif action.name == ':untrace-all':
+                                retval.append('\nUntracing:')
+                                for f in params:
+                                    retval.append('\n' + '  ' + f)
+                                retval.append('\n' + prompt + '> ')
+                            elif action.name == ':frame-call':
+                                swank_parse_frame_call(params, action)
+                            elif action.name == ':frame-source-location':
+                                swank_parse_frame_source(params, action)
+                            elif action.name == ':frame-locals-and-catch-tags':
+                                swank_parse_locals(params[0], action)
+                            elif action.name == ':backtrace':
+                                swank_parse_backtrace(params, action)
+                            elif action.name == ':profiled-functions':
+                                retval.append('\n' + 'Profiled functions:\n')
+                                for f in params:
+                                    retval.append('  ' + f + '\n')
+                                retval.append(prompt + '> ')
+                            elif action.name == ':inspector-range':
+                                swank_parse_inspect_range(params, action)
+                            if action:
+                                action.result = "".join(retval)
+
+                elif result == ':abort':
                     debug_active = False
                     vim.command('let s:sldb_level=-1')
-                    retval = retval + '; Quit to level ' + r[2] + '\n' + prompt + '> '
-
-                elif message == ':ping':
-                    [thread, tag] = r[1:3]
-                    swank_send('(:emacs-pong ' + thread + ' ' + tag + ')')
+                    if len(r[1]) > 1:
+                        retval.append('; Evaluation aborted on ' + unquote(r[1][1]) + '\n' + prompt + '> ')
+                    else:
+                        retval.append('; Evaluation aborted\n' + prompt + '> ')
+
+            elif message == ':inspect':
+                swank_parse_inspect(r[1])
+
+            elif message == ':debug':
+                retval.append(swank_parse_debug(r))
+
+            elif message == ':debug-activate':
+                debug_active = True
+                debug_activated = True
+                current_thread = r[1]
+                level = r[2]
+                vim.command('let s:sldb_level=' + level)
+                frame_locals.clear()
+
+            elif message == ':debug-return':
+                debug_active = False
+                vim.command('let s:sldb_level=-1')
+                retval.append('; Quit to level ' + r[2] + '\n' + prompt + '> ')
+
+            elif message == ':ping':
+                [thread, tag] = r[1:3]
+                swank_send('(:emacs-pong ' + thread + ' ' + tag + ')')
+    retval = "".join(retval)
     if retval != '':
         empty_last_line = (retval[-1] == '\n')
     return retval
@@ -854,9 +1719,28 @@ def swank_rex(action, cmd, package, thread, data=''):
     global id
     id = id + 1
     key = str(id)
-    actions[key] = swank_action(key, action, data)
+    actions.add(swank_action(key, action, data))
+    if batch is not None:
+        batch_keys.append(key)
+    if backend:
+        backend.rex(cmd, package, key)
+        return key
     form = '(:emacs-rex ' + cmd + ' ' + package + ' ' + thread + ' ' + str(id) + ')\n'
     swank_send(form)
+    return key
+
+def swank_local_rex(action, result, data=''):
+    """
+    Register an action answered locally (e.g. from a cache) without asking SWANK
+    """
+    global id
+    id = id + 1
+    key = str(id)
+    a = swank_action(key, action, data)
+    a.result = result
+    a.pending = False
+    actions.add(a)
+    return key
 
 def get_package():
     """
@@ -878,6 +1762,51 @@ def get_swank_package():
     else:
         return requote(pkg)
 
+# Lisp definition forms, the first group is the name being defined
+defined_name = re.compile(r'\(\s*def[^\s()\[\]]*\s+(?:#?\^[^\s]+\s+)*([^\s()\[\]{}"]+)', re.IGNORECASE)
+
+def cache_invalidate(names):
+    """
+    Remove cached data of the given operators in all packages
+    """
+    global completions
+
+    names = set([n.lower() for n in names])
+    def defined(key):
+        op = key.split(' ', 1)[-1].lower()
+        return op in names or op.split('/')[-1] in names or op.split(':')[-1] in names
+    if names:
+        arglist_cache.remove_if(defined)
+        # Symbols may be added or removed
+        completions = None
+
+def cache_invalidate_form(form):
+    """
+    Remove cached data of the operators (re)defined in form
+    """
+    cache_invalidate(defined_name.findall(form))
+
+def cache_invalidate_file(name):
+    """
+    Remove cached data of the operators (re)defined in a file
+    """
+    global completions
+
+    try:
+        f = open(name, 'r')
+        form = f.read()
+        f.close()
+    except IOError:
+        # Anything may be redefined
+        arglist_cache.clear()
+        form = ''
+    cache_invalidate_form(form)
+    completions = None
+
+def swank_arglist_stats():
+    vim.command("let s:arglist_stats={'size':%d,'entries':%d,'hits':%d,'misses':%d}" % \
+                (arglist_cache.size, len(arglist_cache.entries), arglist_cache.hits, arglist_cache.misses))
+
 def get_indent_info(name):
     indent = ''
     if name in indent_info:
@@ -885,24 +1814,319 @@ def get_indent_info(name):
     vc = ":let s:indent='" + indent + "'"
     vim.command(vc)
 
+###############################################################################
+# nREPL backend of the session layer
+###############################################################################
+
+class bencode_decoder:
+    """
+    Incremental bencode decoder: received data is fed as it arrives and
+    next() returns the complete values, a partially received value is
+    continued where it was left when more data arrives
+    """
+    def __init__ (self):
+        self.data = ''          # Data being decoded
+        self.pos = 0            # Decoding position in data
+        self.chunks = []        # Data received since, not yet added to data
+        self.size = 0           # Size of the data in chunks
+        self.need = 0           # Size of data needed to continue decoding
+        self.stack = []         # Lists and dictionaries being decoded
+
+    def feed(self, data):
+        self.chunks.append(data)
+        self.size = self.size + len(data)
+
+    def next(self):
+        """
+        Return the next complete value or None if more data is needed
+        """
+        if self.chunks and len(self.data) + self.size >= self.need:
+            # Join the data only when it is enough for the next step, so that
+            # a long string received in many chunks is not copied many times
+            self.data = self.data[self.pos:] + ''.join(self.chunks)
+            self.need = self.need - self.pos
+            self.pos = 0
+            self.chunks = []
+            self.size = 0
+        data = self.data
+        pos = self.pos
+        self.need = len(data) + 1
+        while pos < len(data):
+            c = data[pos]
+            if c == 'l' or c == 'd':
+                self.stack.append((c, []))
+                pos = pos + 1
+                continue
+            if c == 'e':
+                if not self.stack:
+                    raise ValueError('Unexpected end in bencode data')
+                [kind, items] = self.stack.pop()
+                if kind == 'd':
+                    value = dict(zip(items[0::2], items[1::2]))
+                else:
+                    value = items
+                pos = pos + 1
+            elif c == 'i':
+                end = data.find('e', pos)
+                if end < 0:
+                    break
+                value = int(data[pos+1:end])
+                pos = end + 1
+            else:
+                colon = data.find(':', pos)
+                if colon < 0:
+                    break
+                end = colon + 1 + int(data[pos:colon])
+                if end > len(data):
+                    self.need = end
+                    break
+                value = data[colon+1:end]
+                pos = end
+            if not self.stack:
+                self.pos = pos
+                return value
+            self.stack[-1][1].append(value)
+        self.pos = pos
+        return None
+
+def bencode(value):
+    """
+    Encode a string, number, list or dictionary in bencode
+    """
+    if type(value) == dict:
+        return 'd' + ''.join([bencode(k) + bencode(value[k]) for k in sorted(value.keys())]) + 'e'
+    elif type(value) == list:
+        return 'l' + ''.join([bencode(v) for v in value]) + 'e'
+    elif type(value) == int or type(value) == long:
+        return 'i' + str(value) + 'e'
+    elif type(value) == unicode:
+        value = value.encode('utf-8')
+    return str(len(value)) + ':' + value
+
+class nrepl_session:
+    """
+    Session backend for nREPL servers: swank requests are translated to nREPL
+    messages and the nREPL replies to the swank messages swank_listen()
+    processes, so the rest of the client works the same with both servers.
+    Requests without an nREPL counterpart are answered with :abort.
+    """
+    def __init__ (self):
+        self.decoder = bencode_decoder()
+        self.session = None                     # nREPL session id
+        self.held = []                          # Messages waiting for the session
+        self.requests = dict()                  # [kind, swank message id, data, reply state] by nREPL id
+        self.replies = collections.deque()      # Translated messages not yet processed
+        self.last_eval = None                   # nREPL id of the last REPL evaluation
+
+    def start(self):
+        self.request('clone', 'clone', {'op': 'clone'})
+
+    def request(self, kind, key, msg, data=''):
+        msg['id'] = key
+        self.requests[key] = [kind, key, data, dict()]
+        self.send(msg)
+
+    def send(self, msg):
+        if msg['op'] not in ['clone', 'describe']:
+            if self.session is None:
+                self.held.append(msg)
+                return
+            msg['session'] = self.session
+        text = bencode(msg)
+        logtime('[---Sent---]')
+        logprint(text)
+        stats.bytes_out = stats.bytes_out + len(text)
+        transport_send(text)
+
+    def reply(self, key, result):
+        self.replies.append([':return', result, key])
+
+    def namespace(self, pkg):
+        """
+        Namespace of a quoted package name or nil for the current one
+        """
+        if pkg[:1] == '"':
+            return unquote(pkg)
+        return package
+
+    def rex(self, cmd, pkg, key):
+        """
+        Translate an :emacs-rex request
+        """
+        form = parse_sexpr(cmd)[1]
+        op = form[0].split(':')[-1]
+        ns = self.namespace(pkg)
+        if op == 'connection-info':
+            self.request('describe', key, {'op': 'describe'})
+        elif op == 'create-repl' or op == 'set-package':
+            if op == 'set-package':
+                ns = self.namespace(form[1])
+            self.reply(key, [':ok', [requote(ns), requote(ns)]])
+        elif op == 'swank-require':
+            self.reply(key, [':ok', [requote(form[1].lstrip("'"))]])
+        elif op == 'listener-eval' or op == 'pprint-eval':
+            self.last_eval = key
+            self.request('eval', key, {'op': 'eval', 'code': unquote(form[1]), 'ns': ns})
+        elif op == 'simple-completions' or op == 'fuzzy-completions':
+            prefix = unquote(form[1])
+            self.request(op, key, {'op': 'completions', 'prefix': prefix, 'ns': self.namespace(form[2])}, prefix)
+        elif op == 'operator-arglist':
+            sym = unquote(form[1])
+            self.request('arglist', key, {'op': 'lookup', 'sym': sym, 'ns': self.namespace(form[2])}, sym)
+        else:
+            self.reply(key, [':abort', requote(form[0] + ' is not supported by nREPL')])
+
+    def message(self, text):
+        """
+        Translate a swank message sent without :emacs-rex
+        """
+        form = parse_sexpr(text)[1]
+        if form[0] == ':emacs-interrupt' and self.last_eval:
+            self.send({'op': 'interrupt', 'interrupt-id': self.last_eval})
+        elif form[0] == ':emacs-return-string':
+            self.send({'op': 'stdin', 'stdin': unquote(form[3])})
+
+    def handle(self, msg):
+        """
+        Translate a message received from nREPL
+        """
+        req = self.requests.get(msg.get('id'))
+        if req is None:
+            # Output of a thread started by a previous evaluation
+            for k in ['out', 'err']:
+                if msg.has_key(k):
+                    self.replies.append([':write-string', requote(msg[k])])
+            return
+        [kind, key, data, state] = req
+        status = msg.get('status', [])
+        if kind == 'clone':
+            if msg.has_key('new-session'):
+                self.session = msg['new-session']
+                held = self.held
+                self.held = []
+                for m in held:
+                    self.send(m)
+        elif kind == 'eval':
+            for k in ['out', 'err']:
+                if msg.has_key(k):
+                    self.replies.append([':write-string', requote(msg[k])])
+            if msg.has_key('value'):
+                self.replies.append([':write-string', requote(msg['value'] + '\n'), ':repl-result'])
+            if msg.has_key('ns'):
+                self.replies.append([':new-package', requote(msg['ns']), requote(msg['ns'])])
+            if msg.has_key('ex'):
+                state['ex'] = msg['ex']
+            if 'need-input' in status:
+                self.replies.append([':read-string', '0', '0'])
+        else:
+            state.update(msg)
+        if 'done' in status:
+            del self.requests[key]
+            if kind != 'clone':
+                self.reply(key, self.result(kind, data, state))
+
+    def result(self, kind, data, state):
+        """
+        Return the swank :return value of a finished request
+        """
+        if kind == 'eval':
+            if state.has_key('ex'):
+                return [':abort', requote(state['ex'])]
+            return [':ok', 'nil']
+        if kind == 'describe':
+            versions = state.get('versions', {})
+            clojure = versions.get('clojure', {}).get('version-string', '')
+            nrepl = versions.get('nrepl', {}).get('version-string', '')
+            return [':ok', [':pid', '"0"', ':version', requote(nrepl),
+                            ':lisp-implementation', [':type', '"Clojure"', ':version', requote(clojure)],
+                            ':package', [':name', '"user"', ':prompt', '"user"']]]
+        if kind == 'arglist':
+            arglists = state.get('info', {}).get('arglists-str', '')
+            if arglists == '':
+                return [':ok', 'nil']
+            arglists = ' '.join(arglists.split())
+            if arglists[0] == '(' and arglists[-1] == ')':
+                arglists = arglists[1:-1]
+            return [':ok', requote('(' + data + ' ' + arglists + ')')]
+        # Completions
+        names = [c.get('candidate') for c in state.get('completions', []) if type(c) == dict and c.get('candidate')]
+        if not names:
+            return [':ok', ['nil', 'nil']]
+        if kind == 'fuzzy-completions':
+            return [':ok', [[[requote(n), '"0.0"', 'nil', '"--------"'] for n in names], 'nil']]
+        return [':ok', [[requote(n) for n in names], requote(data)]]
+
+    def get_message(self, timeout):
+        """
+        Return the next translated message or None if nothing arrived in time
+        """
+        while not self.replies:
+            msg = self.decoder.next()
+            if msg is None:
+                if not swank_select(timeout):
+                    return None
+                data = sock.recv(65536)
+                if data == '':
+                    raise socket.error('Connection closed')
+                stats.bytes_in = stats.bytes_in + len(data)
+                self.decoder.feed(data)
+                continue
+            logtime('[-Received-]')
+            if log:
+                logprint(str(msg))
+            if type(msg) == dict:
+                self.handle(msg)
+        r = self.replies.popleft()
+        if debug:
+            print 'Parsed:', r
+        return r
+
 ###############################################################################
 # Various SWANK messages
 ###############################################################################
 
 def swank_connection_info():
     global log
+    global completions
+    global repl_flush
+    global repl_backlog
+    global repl_pending_lines
+    global repl_dropped
+    global sldb_page
+    global compile_notes
+    global inspect_limit
     actions.clear()
     indent_info.clear()
     frame_locals.clear()
+    frame_cache.clear()
+    stats.clear()
     debug_activated = False
     if vim.eval('exists("g:swank_log") && g:swank_log') != '0':
         log = True
+    if vim.eval('exists("g:swank_arglist_cache")') != '0':
+        arglist_cache.size = int(vim.eval('g:swank_arglist_cache'))
+    if vim.eval('exists("g:swank_repl_flush")') != '0':
+        repl_flush = int(vim.eval('g:swank_repl_flush'))
+    if vim.eval('exists("g:swank_repl_backlog")') != '0':
+        repl_backlog = int(vim.eval('g:swank_repl_backlog'))
+    if vim.eval('exists("g:swank_compile_notes")') != '0':
+        compile_notes = int(vim.eval('g:swank_compile_notes'))
+    if vim.eval('exists("g:swank_sldb_page")') != '0':
+        sldb_page = max(int(vim.eval('g:swank_sldb_page')), 1)
+    if vim.eval('exists("g:swank_inspect_limit")') != '0':
+        inspect_limit = int(vim.eval('g:swank_inspect_limit'))
+    arglist_cache.clear()
+    completions = None
+    repl_pending.clear()
+    repl_pending_lines = 0
+    repl_dropped = 0
     swank_rex(':connection-info', '(swank:connection-info)', 'nil', 't')
 
 def swank_create_repl():
     swank_rex(':create-repl', '(swank:create-repl nil)', get_swank_package(), 't')
 
 def swank_eval(exp):
+    cache_invalidate_form(exp)
     cmd = '(swank:listener-eval ' + requote(exp) + ')'
     swank_rex(':listener-eval', cmd, get_swank_package(), ':repl-thread')
 
@@ -939,10 +2163,18 @@ def swank_frame_call(frame):
     swank_rex(':frame-call', cmd, 'nil', current_thread, frame)
 
 def swank_frame_source_loc(frame):
+    action = swank_action('', ':frame-source-location', frame)
+    if frame_cache.has_key(frame_cache_key(action)):
+        swank_parse_frame_source(frame_cache[frame_cache_key(action)], action)
+        return
     cmd = '(swank:frame-source-location ' + frame + ')'
     swank_rex(':frame-source-location', cmd, 'nil', current_thread, frame)
 
 def swank_frame_locals(frame):
+    action = swank_action('', ':frame-locals-and-catch-tags', frame)
+    if frame_cache.has_key(frame_cache_key(action)):
+        swank_parse_locals(frame_cache[frame_cache_key(action)], action)
+        return
     cmd = '(swank:frame-locals-and-catch-tags ' + frame + ')'
     swank_rex(':frame-locals-and-catch-tags', cmd, 'nil', current_thread, frame)
 
@@ -960,18 +2192,28 @@ def swank_describe_function(fn):
 
 def swank_op_arglist(op):
     pkg = get_swank_package()
+    key = pkg + ' ' + op
+    arglist = arglist_cache.get(key)
+    if arglist is not None:
+        swank_local_rex(':operator-arglist', new_line('') + arglist, key)
+        return
     cmd = '(swank:operator-arglist "' + op + '" ' + pkg + ')'
-    swank_rex(':operator-arglist', cmd, pkg, 't')
+    swank_rex(':operator-arglist', cmd, pkg, 't', key)
 
 def swank_completions(symbol):
-    cmd = '(swank:simple-completions "' + symbol + '" ' + get_swank_package() + ')'
-    swank_rex(':simple-completions', cmd, 'nil', 't')
+    key = swank_local_completions(':simple-completions', symbol)
+    if key:
+        cmd = '(swank:simple-completions "' + symbol + '" ' + get_swank_package() + ')'
+        swank_rex(':simple-completions', cmd, 'nil', 't', key)
 
 def swank_fuzzy_completions(symbol):
-    cmd = '(swank:fuzzy-completions "' + symbol + '" ' + get_swank_package() + ' :limit 2000 :time-limit-in-msec 2000)' 
-    swank_rex(':fuzzy-completions', cmd, 'nil', 't')
+    key = swank_local_completions(':fuzzy-completions', symbol)
+    if key:
+        cmd = '(swank:fuzzy-completions "' + symbol + '" ' + get_swank_package() + ' :limit ' + str(compl_limit) + ' :time-limit-in-msec 2000)' 
+        swank_rex(':fuzzy-completions', cmd, 'nil', 't', key)
 
 def swank_undefine_function(fn):
+    cache_invalidate([fn])
     cmd = '(swank:undefine-function "' + fn + '")'
     swank_rex(':undefine-function', cmd, get_package(), 't')
 
@@ -1006,10 +2248,34 @@ def swank_inspect_in_frame(symbol, n):
     swank_rex(':inspect-in-frame', cmd, get_swank_package(), current_thread, str(n))
 
 def swank_inspector_range():
-    start = int(vim.eval("b:range_start"))
-    end   = int(vim.eval("b:range_end"))
-    cmd = '(swank:inspector-range ' + str(end) + " " + str(end+(end-start)) + ')'
-    swank_rex(':inspector-range', cmd, get_swank_package(), 't')
+    if inspector.prefetched is not None:
+        # Next range already received
+        pcont = inspector.prefetched
+        inspector.prefetched = None
+        swank_parse_inspect_content(pcont)
+    elif inspector.pending and inspector.pending in actions:
+        # Next range is on its way, display it when received
+        actions[inspector.pending].data = ''
+    else:
+        start = int(vim.eval("b:range_start"))
+        end   = int(vim.eval("b:range_end"))
+        swank_inspect_request(start, end, False)
+
+def swank_inspector_all(timeout_ms):
+    """
+    Fetch and display the remaining parts of the inspected object (at most
+    inspect_limit parts at once) until timeout_ms elapses or a key is pressed
+    """
+    inspector.until = inspector.end + inspect_limit
+    swank_inspector_range()
+    deadline = clock() + timeout_ms / 1000.0
+    while sock and inspector.pending and clock() < deadline:
+        vim.command('echon "\\rFetching all entries, please wait [' + str(inspector.end / 4) + ']"')
+        swank_wait_all([inspector.pending], 200, True)
+        if vim.eval('getchar(1)') != '0':
+            # User is impatient, stop fetching
+            break
+    inspector.until = 0
 
 def swank_quit_inspector():
     swank_rex(':quit-inspector', '(swank:quit-inspector)', 'nil', 't')
@@ -1045,6 +2311,7 @@ def swank_xref(fn, type):
 
 def swank_compile_string(formvar):
     form = vim.eval(formvar)
+    cache_invalidate_form(form)
     filename = vim.eval("substitute( expand('%:p'), '\\', '/', 'g' )")
     line = vim.eval("line('.')")
     pos = vim.eval("line2byte(line('.'))")
@@ -1055,10 +2322,12 @@ def swank_compile_string(formvar):
     swank_rex(':compile-string-for-emacs', cmd, get_package(), 't')
 
 def swank_compile_file(name):
+    cache_invalidate_file(name)
     cmd = '(swank:compile-file-for-emacs ' + requote(name) + ' t)'
     swank_rex(':compile-file-for-emacs', cmd, get_package(), 't')
 
 def swank_load_file(name):
+    cache_invalidate_file(name)
     cmd = '(swank:load-file ' + requote(name) + ')'
     swank_rex(':load-file', cmd, get_package(), 't')
 
@@ -1104,18 +2373,33 @@ def swank_debug_thread(index):
 
 def swank_connect(host, port, resultvar):
     """
-    Create socket to swank server and request connection info
+    Create socket to swank server
     """
     global sock
+    global input_host
     global input_port
+    global use_reader
+    global recv_buffer
+    global backend
 
     if not sock:
         try:
+            input_host = host
             input_port = port
             swank_server = (host, input_port)
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             sock.connect(swank_server)
-            swank_connection_info()
+            session_load(host, port)
+            recv_buffer = swank_buffer()
+            backend = None
+            use_reader = False
+            if vim.eval('exists("g:swank_transport") && g:swank_transport ==? "nrepl"') != '0':
+                backend = nrepl_session()
+                backend.start()
+            else:
+                use_reader = vim.eval('exists("g:swank_reader_thread") && g:swank_reader_thread') != '0'
+            if use_reader:
+                swank_start_reader()
             vim.command('let ' + resultvar + '=""')
             return sock
         except socket.error:
@@ -1124,16 +2408,42 @@ def swank_connect(host, port, resultvar):
             return sock
     vim.command('let ' + resultvar + '=""')
 
+def swank_start_reader():
+    """
+    Start the background thread reading the swank socket
+    """
+    global reader
+    global messages
+
+    messages = Queue.Queue()
+    reader = threading.Thread(target=swank_reader, args=(sock, messages, stats, use_unicode))
+    reader.daemon = True
+    reader.start()
+
 def swank_disconnect():
     """
     Disconnect from swank server
     """
     global sock
+    global reader
+    global backend
+    swank_session_save()
+    logger.flush()
+    send_queue.clear()
+    held.clear()
     try:
         # Try to close socket but don't care if doesn't succeed
+        if reader:
+            # Wake up the reader thread blocked in recv()
+            reader = None
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
         sock.close()
     finally:
         sock = None
+        backend = None
         vim.command('let s:swank_connected = 0')
         sys.stdout.write( 'Connection to SWANK server is closed.\n' )
 
@@ -1157,19 +2467,172 @@ def swank_input(formvar):
         swank_eval(form)
 
 def actions_pending():
-    count = 0
-    for k,a in sorted(actions.items()):
-        if a.pending:
-            count = count + 1
-    vc = ":let s:swank_actions_pending=" + str(count)
+    vc = ":let s:swank_actions_pending=" + str(actions.pending)
     vim.command(vc)
-    return count
+    return actions.pending
+
+def repl_queue(text):
+    """
+    Queue output for the REPL buffer, drop the oldest lines
+    if the output arrives faster than it can be displayed
+    """
+    global repl_pending_lines
+    global repl_dropped
+
+    if text == '':
+        return
+    repl_pending.append(text)
+    repl_pending_lines = repl_pending_lines + text.count('\n')
+    if repl_backlog > 0 and repl_pending_lines > repl_backlog:
+        # Drop the oldest lines down to 3/4 of the backlog,
+        # so that the next chunks do not need to be trimmed again
+        drop = repl_pending_lines - repl_backlog * 3 / 4
+        while drop > 0 and repl_pending:
+            text = repl_pending.popleft()
+            n = text.count('\n')
+            if n > drop:
+                # Drop only the first lines of this chunk
+                repl_pending.appendleft(text.split('\n', drop)[drop])
+                n = drop
+            drop = drop - n
+            repl_pending_lines = repl_pending_lines - n
+            repl_dropped = repl_dropped + n
+
+def repl_take(maxlines):
+    """
+    Remove and return at most maxlines lines of the queued REPL output,
+    preceded by a note about the lines dropped since the last call
+    """
+    global repl_pending_lines
+    global repl_dropped
+
+    chunks = []
+    lines = 0
+    if repl_dropped > 0:
+        chunks.append('\n; Slimv: ' + str(repl_dropped) + ' lines of output dropped\n')
+        repl_dropped = 0
+    while repl_pending and lines < maxlines:
+        text = repl_pending.popleft()
+        n = text.count('\n')
+        if lines + n > maxlines:
+            # Split chunk after the last line fitting in this batch
+            pos = -1
+            for i in range(maxlines - lines):
+                pos = text.find('\n', pos + 1)
+            repl_pending.appendleft(text[pos+1:])
+            text = text[:pos+1]
+            n = maxlines - lines
+        chunks.append(text)
+        lines = lines + n
+    repl_pending_lines = repl_pending_lines - lines
+    return ''.join(chunks)
+
+# Tokens affecting the paren balance of the REPL buffer, like in s:CloseForm()
+balance_token = re.compile(r'"(?:[^"\\]|\\.)*(?P<closed>")?|;[^\n]*|[()\[\]{}]', re.DOTALL)
+
+def balance_ending(text, clojure):
+    """
+    Return the closing characters needed to balance text or None if
+    text has an invalid closing paren, like s:CloseForm()
+    """
+    end = []
+    openings = '('
+    closings = ')'
+    if clojure:
+        openings = '([{'
+        closings = ')]}'
+    for m in balance_token.finditer(text):
+        t = m.group()
+        if t[0] == '"':
+            if not m.group('closed'):
+                # Inside a string till the end
+                end.append('"')
+                break
+        elif t[0] in openings:
+            end.append(closings[openings.index(t[0])])
+        elif t[0] in closings:
+            if not end or end[-1] != t[0]:
+                # Too many closing parens or invalid closing paren
+                return None
+            end.pop()
+    end.reverse()
+    return ''.join(end)
+
+def repl_trim(max_len, clojure, spill):
+    """
+    Keep only the last max_len lines of the REPL buffer, but some opening
+    parens and/or double quotes remain in order to maintain their balanced
+    state. Only the removed lines are scanned, each of them once, because
+    the balancing line inserted by the previous trim is also removed.
+    """
+    buf = vim.current.buffer
+    n = len(buf) - max_len
+    if n <= 0:
+        return
+    removed = buf[0:n]
+    ending = balance_ending('\n'.join(removed), clojure)
+    start = ''
+    if ending:
+        # Reverse the ending and replace matched characters with their pairs
+        start = ''.join(reversed(ending))
+        start = start.replace(')', '(').replace(']', '[').replace('}', '{')
+    if spill:
+        repl_spill_lines(removed, start != '')
+    buf[0:n] = []
+    if start != '':
+        buf[0:0] = [start + ' .... ; output shortened']
+
+def repl_spill_lines(lines, balanced):
+    """
+    Save lines trimmed from the REPL buffer so that they can be paged back
+    """
+    global repl_spill
+
+    if repl_spill is None:
+        repl_spill = tempfile.TemporaryFile()
+    repl_spill.seek(0, 2)
+    repl_spilled.append((repl_spill.tell(), balanced))
+    repl_spill.write('\n'.join(lines) + '\n')
+
+def repl_page_back():
+    """
+    Put back the most recently trimmed lines to the beginning of the REPL buffer
+    """
+    added = 0
+    if repl_spilled:
+        [offset, balanced] = repl_spilled.pop()
+        repl_spill.seek(offset)
+        lines = repl_spill.read().split('\n')[:-1]
+        repl_spill.seek(offset)
+        repl_spill.truncate()
+        buf = vim.current.buffer
+        if balanced:
+            # The balancing line stands for the trimmed lines
+            buf[0:1] = lines
+            added = len(lines) - 1
+        else:
+            buf[0:0] = lines
+            added = len(lines)
+    vim.command('let s:repl_paged_lines=' + str(added))
+
+def repl_spill_clear():
+    """
+    Forget the lines trimmed from the REPL buffer
+    """
+    global repl_spill
+
+    if repl_spill:
+        repl_spill.close()
+    repl_spill = None
+    del repl_spilled[:]
 
 def swank_output(echo):
     global sock
     global debug_active
     global debug_activated
 
+    if len(connections) > 1:
+        swank_poll_connections()
     if not sock:
         return "SWANK server is not connected."
     count = 0
@@ -1181,36 +2644,276 @@ def swank_output(echo):
         result = swank_listen()
         pending = actions_pending()
         count = count + 1
-    if echo and result != '':
-        # Append SWANK output to REPL buffer
-        vim.command('call SlimvOpenReplBuffer()')
-        buf = vim.current.buffer
-        lines = result.split("\n")
-        if lines[0] != '':
-            # Concatenate first line to the last line of the buffer
-            nlines = len(buf)
-            buf[nlines-1] = buf[nlines-1] + lines[0]
-        if len(lines) > 1:
-            # Append all subsequent lines
-            buf.append(lines[1:])
-        vim.command('call SlimvEndUpdateRepl()')
+    if echo:
+        repl_queue(result)
+        if repl_pending or repl_dropped:
+            # Append a batch of SWANK output to REPL buffer
+            start = clock()
+            vim.command('call SlimvOpenReplBuffer()')
+            buf = vim.current.buffer
+            lines = repl_take(repl_flush).split("\n")
+            if lines[0] != '':
+                # Concatenate first line to the last line of the buffer
+                nlines = len(buf)
+                buf[nlines-1] = buf[nlines-1] + lines[0]
+            if len(lines) > 1:
+                # Append all subsequent lines
+                buf.append(lines[1:])
+            vim.command('call SlimvEndUpdateRepl()')
+            stats.record('render', start)
+    vim.command('let s:swank_output_pending=' + str(len(repl_pending) + (repl_dropped > 0) + len(held)))
+    if log:
+        logger.flush()
     if debug_activated and debug_active:
         # Debugger was activated in this run
-        vim.command('call SlimvOpenSldbBuffer()')
-        vim.command('call SlimvEndUpdate()')
-        vim.command("call search('^Restarts:', 'w')")
+        swank_show_debugger()
+
+def swank_show_debugger():
+    vim.command('call SlimvOpenSldbBuffer()')
+    vim.command('call SlimvEndUpdate()')
+    vim.command("call search('^Restarts:', 'w')")
+
+def swank_wait_all(keys, timeout_ms, output=False):
+    """
+    Process swank messages until the replies to all message ids in keys
+    arrive or timeout_ms milliseconds elapse, return the actions for keys.
+    REPL output received meanwhile is queued if output is set, otherwise
+    it is dropped, like in swank_output(0)
+    """
+    global debug_activated
+
+    deadline = time.time() + timeout_ms / 1000.0
+    debug_activated = False
+    waiting = [actions.get(key) for key in keys]
+    result = waiting
+    waiting = [a for a in waiting if a and a.pending]
+    while sock and waiting:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        text = swank_listen(remaining)
+        if output:
+            repl_queue(text)
+        waiting = [a for a in waiting if a.pending]
+    if debug_activated and debug_active:
+        swank_show_debugger()
+    return result
+
+def swank_wait(key, timeout_ms):
+    """
+    Process swank messages until the reply to message id key arrives
+    or timeout_ms milliseconds elapse, return the action for key
+    """
+    return swank_wait_all([key], timeout_ms)[0]
+
+def swank_batch_begin():
+    """
+    Collect the following requests instead of sending them one by one
+    """
+    global batch
+
+    batch = []
+    del batch_keys[:]
+
+def swank_batch_end(timeout_ms):
+    """
+    Send the requests collected since swank_batch_begin() back-to-back,
+    then wait for all their replies (at most timeout_ms milliseconds)
+    """
+    global batch
+
+    data = "".join(batch)
+    batch = None
+    if not batch_keys or not sock:
+        return []
+    if data != '':
+        # Requests answered locally by the backend have nothing to send
+        if debug:
+            print 'Sending:', data
+        send_queue.append(memoryview(data))
+        swank_flush()
+    if not sock:
+        return []
+    result = swank_wait_all(batch_keys, timeout_ms, True)
+    actions_pending()
+    return result
+
+def swank_wait_response(name, timeout_ms):
+    """
+    Wait for the reply to the most recently sent request and write its result,
+    the request is identified by its message id, name is only a sanity check
+    """
+    key = str(id)
+    action = actions.get(key)
+    if action and action.name == name:
+        action = swank_wait(key, timeout_ms)
+    if action and action.name == name and not action.pending:
+        vim.command(":let s:swank_action='" + action.name + "'")
+        sys.stdout.write(action.result)
+        actions.pop(key)
+    else:
+        vim.command(":let s:swank_action=''")
+    actions_pending()
 
 def swank_response(name):
     #logtime('[-Response-]')
-    for k,a in sorted(actions.items()):
-        if not a.pending and (name == '' or name == a.name):
-            vc = ":let s:swank_action='" + a.name + "'"
-            vim.command(vc)
-            sys.stdout.write(a.result)
-            actions.pop(a.id)
-            actions_pending()
-            return
+    a = actions.first_completed(name)
+    if a:
+        vc = ":let s:swank_action='" + a.name + "'"
+        vim.command(vc)
+        sys.stdout.write(a.result)
+        actions.pop(a.id)
+        actions_pending()
+        return
     vc = ":let s:swank_action=''"
     vim.command(vc)
     actions_pending()
 
+###############################################################################
+# Multiple SWANK connections
+###############################################################################
+
+# Module globals holding the state of the current connection
+connection_vars = ['sock', 'id', 'input_host', 'input_port', 'output_port', 'pid', 'current_thread',
+                   'use_unicode', 'debug_active', 'debug_activated', 'read_string', 'empty_last_line',
+                   'prompt', 'package', 'actions', 'indent_info', 'frame_locals', 'inspector',
+                   'use_reader', 'reader', 'messages', 'recv_buffer', 'send_queue', 'held', 'backend', 'completions', 'arglist_cache',
+                   'repl_pending', 'repl_pending_lines', 'repl_dropped', 'sldb_level', 'sldb_frames', 'sldb_fetched',
+                   'sldb_more', 'frame_cache', 'session_host', 'session_id', 'session', 'batch',
+                   'batch_keys', 'stats']
+
+# Script variables of slimv.vim holding the state of the current connection
+connection_vim_vars = ['s:swank_connected', 's:swank_version', 's:lisp_version', 's:sldb_level']
+
+class swank_connection:
+    """
+    State of a swank connection. The state of the current connection is kept
+    in the module globals, the others keep it here while not selected.
+    """
+    def __init__ (self, num):
+        self.num = num
+        self.state = None
+        self.vim_state = {'s:swank_connected': '0', 's:swank_version': "''",
+                          's:lisp_version': "''", 's:sldb_level': '-1'}
+
+    def fresh(self):
+        """
+        Set the state of a connection not yet connected
+        """
+        self.state = {'sock': None, 'id': 0, 'input_host': 'localhost', 'input_port': 4005,
+                      'output_port': 4006, 'pid': '0', 'current_thread': '0', 'use_unicode': True,
+                      'debug_active': False, 'debug_activated': False, 'read_string': None,
+                      'empty_last_line': True, 'prompt': 'SLIMV', 'package': 'COMMON-LISP-USER',
+                      'actions': action_registry(actions_keep, actions_age), 'indent_info': dict(),
+                      'frame_locals': dict(), 'inspector': inspect_view(), 'use_reader': False,
+                      'reader': None, 'messages': Queue.Queue(), 'recv_buffer': None,
+                      'send_queue': collections.deque(), 'held': collections.deque(), 'backend': None,
+                      'completions': None, 'arglist_cache': lru_cache(arglist_cache.size),
+                      'repl_pending': collections.deque(), 'repl_pending_lines': 0, 'repl_dropped': 0,
+                      'sldb_level': '', 'sldb_frames': [], 'sldb_fetched': 0, 'sldb_more': False,
+                      'frame_cache': dict(), 'session_host': '', 'session_id': None,
+                      'session': None, 'batch': None, 'batch_keys': [], 'stats': swank_stats()}
+
+    def save(self):
+        g = globals()
+        self.state = dict([(v, g[v]) for v in connection_vars])
+        self.vim_state = dict([(v, vim.eval('string(' + v + ')')) for v in connection_vim_vars])
+
+    def load(self):
+        globals().update(self.state)
+        self.state = None
+        for v in connection_vim_vars:
+            vim.command('let ' + v + '=' + self.vim_state[v])
+
+    def ready(self):
+        """
+        Check if messages are waiting for a connection not selected
+        """
+        st = self.state
+        if not st['sock'] or st['held']:
+            # Held messages are handled first, when it is selected again
+            return False
+        if st['use_reader']:
+            return not st['messages'].empty()
+        if st['backend'] and st['backend'].replies:
+            return True
+        if st['recv_buffer'] and st['recv_buffer'].end > st['recv_buffer'].start:
+            return True
+        try:
+            return len(select.select([st['sock']], [], [], 0)[0]) > 0
+        except (select.error, socket.error):
+            return True
+
+    def describe(self):
+        if self.state is None:
+            [host, port, p, connected] = [input_host, input_port, pid, sock]
+        else:
+            st = self.state
+            [host, port, p, connected] = [st['input_host'], st['input_port'], st['pid'], st['sock']]
+        text = str(self.num) + ': ' + host + ':' + str(port)
+        if connected:
+            return text + '  Pid: ' + p
+        return text + '  (not connected)'
+
+connections     = [swank_connection(1)]     # All connections, the first one is using the globals
+connection      = connections[0]            # The current connection
+
+def connection_switch(c):
+    """
+    Make connection c the current one
+    """
+    global connection
+
+    if c is not connection:
+        connection.save()
+        c.load()
+        connection = c
+
+def swank_poll_connections():
+    """
+    Receive the messages waiting for the connections not selected,
+    their REPL output is kept until they are selected again, any other
+    message is held until then, so no other buffer is touched
+    """
+    global polling
+
+    current = connection
+    for c in connections:
+        if c is not current and c.ready():
+            connection_switch(c)
+            polling = True
+            try:
+                repl_queue(swank_listen(0.0))
+            finally:
+                polling = False
+                connection_switch(current)
+
+def swank_new_connection():
+    """
+    Add a new connection not yet connected and select it
+    """
+    c = swank_connection(connections[-1].num + 1)
+    c.fresh()
+    connections.append(c)
+    connection_switch(c)
+
+def swank_select_connection(num):
+    """
+    Select the connection with the given number
+    """
+    for c in connections:
+        if c.num == num:
+            connection_switch(c)
+            sys.stdout.write('Selected SWANK connection ' + c.describe() + '\n')
+            return
+    sys.stdout.write('No SWANK connection ' + str(num) + '\n')
+
+def swank_list_connections():
+    """
+    List the connections, the current one is marked with a '*'
+    """
+    for c in connections:
+        if c is connection:
+            sys.stdout.write('* ' + c.describe() + '\n')
+        else:
+            sys.stdout.write('  ' + c.describe() + '\n')
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# Symbol database index for Slimv
+# symbols.py:   sorted index of the Hyperspec, Clojure API and Javadoc symbols
+# License:      This file is placed in the public domain.
+#               No warranty, express or implied.
+#               *** ***   Use At-Your-Own-Risk!   *** ***
+#
+# The symbol lists (e.g. g:slimv_clhs_clhs) are read directly from the Vim
+# script defining them (slimv-clhs.vim, slimv-cljapi.vim, slimv-javadoc.vim),
+# so Vim does not need to build them. Each list is sorted by the lowercase
+# symbol name, exact and prefix lookups are binary searches.
+# The index of a script is saved into a cache file and is reused as long as
+# the script is not modified, it is loaded at the first lookup.
+# It is loaded by SlimvPyfile() via pyfile, so it shares the namespace
+# with swank.py, all names start with symbol.
+#
+###############################################################################
+
+
+import os
+import re
+import bisect
+import marshal
+import getpass
+
+import vim
+
+
+symbol_cache_version = 1        # Change it when the format of the cache changes
+
+# A list assignment in a symbol database script
+symbol_list_re  = re.compile(r"^\s*let\s+(g:\w+)\s*=\s*\[", re.M)
+
+# Item of a symbol list: ["name", "url"], either string may be single quoted
+symbol_item_re  = re.compile(r"""\[\s*("(?:[^"\\]|\\.)*"|'(?:[^']|'')*')\s*,\s*("(?:[^"\\]|\\.)*"|'(?:[^']|'')*')\s*\]""")
+
+# Escaped character in a double quoted Vim string
+symbol_escape_re = re.compile(r'\\(.)')
+
+# Database script of a list, e.g. g:slimv_clhs_clhs is in slimv-clhs.vim
+symbol_script_re = re.compile(r'^g:slimv_([a-z]+)_')
+
+
+class symbol_db:
+    """
+    Symbols of a list sorted by the lowercase name
+    """
+    def __init__ (self, items):
+        items = sorted([(n.lower(), n, u) for [n, u] in items])
+        self.keys  = [i[0] for i in items]
+        self.names = [i[1] for i in items]
+        self.urls  = [i[2] for i in items]
+
+    def exact(self, word):
+        """
+        Return the position of the symbol or -1 if not found
+        """
+        i = bisect.bisect_left(self.keys, word)
+        if i < len(self.keys) and self.keys[i] == word:
+            return i
+        return -1
+
+    def prefix(self, word):
+        """
+        Return the range of the symbols starting with word
+        """
+        lo = bisect.bisect_left(self.keys, word)
+        hi = bisect.bisect_left(self.keys, word + '\xff')
+        return lo, hi
+
+    def dump(self):
+        return [self.keys, self.names, self.urls]
+
+    def load(self, data):
+        [self.keys, self.names, self.urls] = data
+        return self
+
+symbol_dbs    = dict()          # Indexed lists by variable name
+symbol_loaded = dict()          # Database scripts already read
+
+def symbol_string(s):
+    """
+    Value of a quoted Vim string
+    """
+    if s[0] == "'":
+        return s[1:-1].replace("''", "'")
+    return symbol_escape_re.sub(r'\1', s[1:-1])
+
+def symbol_parse(text):
+    """
+    Return the lists defined in a database script by variable name
+    """
+    lists = dict()
+    starts = [m for m in symbol_list_re.finditer(text)]
+    for i in range(len(starts)):
+        m = starts[i]
+        if i + 1 < len(starts):
+            end = starts[i+1].start()
+        else:
+            end = len(text)
+        items = symbol_item_re.findall(text, m.end(), end)
+        lists[m.group(1)] = [[symbol_string(n), symbol_string(u)] for [n, u] in items]
+    return lists
+
+def symbol_cache_file(script):
+    """
+    Name of the cache file of a database script
+    """
+    cache = vim.eval('g:slimv_symbol_cache')
+    if cache == '':
+        # Per user directory, not the shared temporary one
+        cache = os.path.join(os.environ.get('XDG_CACHE_HOME', '~/.cache'), 'slimv')
+    try:
+        user = getpass.getuser()
+    except Exception:
+        user = ''
+    name = os.path.splitext(os.path.basename(script))[0]
+    return os.path.join(os.path.expanduser(cache), name + '-' + user + '.idx')
+
+def symbol_load_script(script):
+    """
+    Index the lists of a database script, read from the cache if it is
+    up to date, otherwise parse the script and save the cache
+    """
+    try:
+        st = os.stat(script)
+    except OSError:
+        return
+    stamp = [symbol_cache_version, script, int(st.st_mtime), st.st_size]
+    fname = symbol_cache_file(script)
+    try:
+        f = open(fname, 'rb')
+        try:
+            if hasattr(os, 'getuid') and os.fstat(f.fileno()).st_uid != os.getuid():
+                # Do not trust a cache written by another user
+                raise ValueError
+            [cached, dbs] = marshal.load(f)
+        finally:
+            f.close()
+        if cached == stamp:
+            for name in dbs.keys():
+                symbol_dbs[name] = symbol_db([]).load(dbs[name])
+            return
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        pass
+
+    f = open(script, 'r')
+    try:
+        lists = symbol_parse(f.read())
+    finally:
+        f.close()
+    dbs = dict()
+    for name in lists.keys():
+        symbol_dbs[name] = symbol_db(lists[name])
+        dbs[name] = symbol_dbs[name].dump()
+    try:
+        if not os.path.isdir(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname), 0700)
+        if os.path.lexists(fname + '.tmp'):
+            os.remove(fname + '.tmp')
+        # Readable only by the user, never write through an existing file
+        f = os.fdopen(os.open(fname + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0600), 'wb')
+        try:
+            marshal.dump([stamp, dbs], f)
+        finally:
+            f.close()
+        os.rename(fname + '.tmp', fname)
+    except (IOError, OSError):
+        pass
+
+def symbol_get_db(name):
+    """
+    Return the index of the list named name or None if there is no such list
+    """
+    if vim.eval('exists("' + name + '")') != '0':
+        # The list is defined in Vim, e.g. by the user in the vimrc
+        size = int(vim.eval('len(' + name + ')'))
+        db = symbol_dbs.get(name)
+        if db is None or len(db.keys) != size:
+            db = symbol_db(vim.eval(name))
+            symbol_dbs[name] = db
+        return db
+    if name not in symbol_dbs:
+        m = symbol_script_re.match(name)
+        if m:
+            script = 'slimv-' + m.group(1) + '.vim'
+            if script not in symbol_loaded:
+                symbol_loaded[script] = True
+                plugins = vim.eval("globpath(&runtimepath, 'ftplugin/**/" + script + "')").split('\n')
+                if plugins[0] != '':
+                    symbol_load_script(plugins[0])
+    return symbol_dbs.get(name)
+
+def symbol_vim_list(items):
+    return '[' + ','.join(["'" + i.replace("'", "''") + "'" for i in items]) + ']'
+
+def symbol_find():
+    """
+    SlimvFindSymbol() for a list given by name, the result is in s:symbol_found
+    """
+    word = vim.eval('a:word').lower()
+    exact = vim.eval('a:exact') != '0'
+    all = vim.eval('a:all') != '0'
+    root = vim.eval('a:root')
+    result = vim.eval('a:init')
+    db = symbol_get_db(vim.eval('a:db'))
+    if db:
+        if exact:
+            i = db.exact(word)
+            if i >= 0:
+                # No reason to check all here
+                result = [db.names[i], root + db.urls[i]]
+        else:
+            [lo, hi] = db.prefix(word)
+            if all:
+                result = result + db.names[lo:hi]
+            elif lo < hi:
+                result = [db.names[lo], root + db.urls[lo]]
+    vim.command('let s:symbol_found=' + symbol_vim_list(result))
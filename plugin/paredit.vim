@@ -53,6 +53,11 @@ if !exists( 'g:paredit_electric_return' )
     let g:paredit_electric_return = 1
 endif
 
+" Use the paren structure index in paredit.py if Vim has Python
+if !exists( 'g:paredit_python' )
+    let g:paredit_python = 1
+endif
+
 " =====================================================================
 "  Other variable definitions
 " =====================================================================
@@ -69,6 +74,9 @@ let s:repeat             = 0
 
 let s:yank_pos           = []
 
+" Is paredit.py loaded? (-1 = not yet tried)
+let s:python_index       = -1
+
 " =====================================================================
 "  General utility functions
 " =====================================================================
@@ -420,6 +428,23 @@ function! s:SynIDMatch( regexp, line, col, match_eol )
     return synIDattr( synID( a:line, col, 0), 'name' ) =~ a:regexp
 endfunction
 
+" Load the paren structure index of paredit.py, return 1 if it can be used
+function! s:PythonIndex()
+    if s:python_index < 0
+        let s:python_index = 0
+        if g:paredit_python && has( 'python' )
+            let plugins = split( globpath( &runtimepath, 'ftplugin/**/paredit.py'), '\n' )
+            if len( plugins ) > 0
+                python import vim
+                execute 'pyfile ' . plugins[0]
+                au BufWipeout * execute 'python paredit_forget(' . expand( '<abuf>' ) . ')'
+                let s:python_index = 1
+            endif
+        endif
+    endif
+    return s:python_index && g:paredit_python
+endfunction
+
 " Is the current cursor position inside a comment?
 function! s:InsideComment( ... )
     let l = a:0 ? a:1 : line('.')
@@ -493,6 +518,12 @@ function! s:IsBalanced()
         " Do not go before the last command prompt in the REPL buffer
         let matchb = prompt
     endif
+    if s:PythonIndex()
+        " Count the delimiters in the index instead of searching the buffer
+        let base = ( s:IsReplBuffer() && l >= prompt ) ? prompt : 1
+        execute 'python paredit_balanced(' . matchb . ', ' . matchf . ', ' . base . ')'
+        return s:paredit_balanced
+    endif
     let p1 = searchpair( '(', '', ')', 'brnmW', s:skip_sc, matchb )
     let p2 = searchpair( '(', '', ')',  'rnmW', s:skip_sc, matchf )
     if !(p1 == p2) && !(p1 == p2 - 1 && line[c-1] == '(') && !(p1 == p2 + 1 && line[c-1] == ')')
@@ -519,6 +550,10 @@ endfunction
 
 " Filter out all non-matched characters from the region
 function! s:GetMatchedChars( lines, start_in_string, start_in_comment )
+    if s:PythonIndex()
+        python paredit_get_matched()
+        return s:paredit_matched
+    endif
     let inside_string  = a:start_in_string
     let inside_comment = a:start_in_comment
     let matched = repeat( ' ', len( a:lines ) )